@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+"""
+Benchmark de las analíticas de SupabaseClient
+==============================================
+Genera datos sintéticos con las 23 columnas reales de BD_Import_IQ
+(marcas e importadores con distribución sesgada tipo Zipf), los sirve con
+un cliente falso compatible con PostgREST (páginas de 1000 filas, conteo
+exacto, filtros eq/neq/gt/gte/lt/lte/ilike) y mide cada analítica:
+latencia, bytes transferidos, requests y memoria pico.
+
+Modos:
+  stream    sin snapshot ni cubo: todo se pagina desde "Supabase"
+  snapshot  snapshot local (Parquet) sin cubo
+  cube      snapshot + cubo año × mes × dimensión
+
+Uso:
+  python Complemento/benchmark.py                       # 10k y 100k filas
+  python Complemento/benchmark.py --filas 10000 100000 1000000 --latencia-ms 40
+  python Complemento/benchmark.py --salida resultados.csv
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# ========== DATOS SINTÉTICOS ==========
+
+PAISES = ["CHINA", "INDIA", "ESTADOS UNIDOS", "ALEMANIA", "ISRAEL", "ARGENTINA",
+          "BRASIL", "ESPAÑA", "COLOMBIA", "MEXICO", "JAPON", "SUIZA"]
+CLASES = ["INSECTICIDA", "FUNGICIDA", "HERBICIDA", "ACARICIDA", "NEMATICIDA", "COADYUVANTE"]
+FORMULACIONES = ["SC", "EC", "WP", "WG", "SL", "GR", "OD", "CS"]
+INGREDIENTES = ["GLIFOSATO", "MANCOZEB", "CLORPIRIFOS", "IMIDACLOPRID", "ABAMECTINA",
+                "AZOXISTROBINA", "CIPERMETRINA", "PARAQUAT", "TEBUCONAZOL", "LAMBDA CIHALOTRINA",
+                "METOMILO", "CLOROTALONIL", "EMAMECTINA", "2,4-D", "ATRAZINA", "TIAMETOXAM"]
+SILABAS = ["AGRO", "TRI", "MAX", "FOR", "ZAN", "TOP", "GRO", "KIL", "CIDE", "VER", "MIX",
+           "HOR", "SAN", "TEC", "QUIM", "PLUS", "NOVA", "FIT", "BIO", "TOR"]
+
+
+def _zipf_choice(rng, n_items, size, exponent=1.1):
+    """Índices 0..n_items-1 con probabilidad ∝ 1 / rango^exponent (pocos dominan)"""
+    weights = 1.0 / np.arange(1, n_items + 1) ** exponent
+    return rng.choice(n_items, size=size, p=weights / weights.sum())
+
+
+def _nombres(rng, cantidad, palabras=2):
+    nombres = set()
+    while len(nombres) < cantidad:
+        nombre = "".join(rng.choice(SILABAS, size=palabras))
+        nombres.add(f"{nombre} {rng.integers(1, 999)}" if rng.random() < 0.3 else nombre)
+    return sorted(nombres)
+
+
+def generar_datos(n, seed=42):
+    """DataFrame con n importaciones sintéticas y las columnas de SupabaseClient.COLUMNS"""
+    rng = np.random.default_rng(seed)
+    n_marcas = max(50, min(5000, n // 40))
+    n_importadores = max(20, min(800, n // 250))
+
+    marcas = np.array(_nombres(rng, n_marcas))
+    importadores = np.array([f"{nombre} S.A.C." for nombre in _nombres(rng, n_importadores, 3)])
+    rucs = np.array([f"20{rng.integers(10**8, 10**9 - 1)}" for _ in range(n_importadores)])
+
+    # Cada marca tiene un ingrediente, clase y formulación fijos
+    marca_ingrediente = rng.integers(0, len(INGREDIENTES), n_marcas)
+    marca_clase = rng.integers(0, len(CLASES), n_marcas)
+    marca_formulacion = rng.integers(0, len(FORMULACIONES), n_marcas)
+
+    i_marca = _zipf_choice(rng, n_marcas, n)
+    i_importador = _zipf_choice(rng, n_importadores, n)
+    i_pais = _zipf_choice(rng, len(PAISES), n, exponent=1.5)
+
+    inicio = np.datetime64("2020-01-01")
+    dias = rng.integers(0, (np.datetime64("2025-11-30") - inicio).astype(int), n)
+    fechas = np.sort(inicio + dias)
+
+    kg = np.round(rng.lognormal(mean=6.5, sigma=1.4, size=n), 2)
+    precio = rng.lognormal(mean=2.0, sigma=0.6, size=n)
+    cif = np.round(kg * precio, 2)
+    qty = np.maximum(1, np.round(kg / rng.choice([1, 5, 20, 200], size=n)))
+
+    ingredientes = np.array(INGREDIENTES)[marca_ingrediente[i_marca]]
+    concentracion = rng.choice(["480 g/L", "250 g/L", "72 %", "1.8 %", "80 %", "500 g/kg"], size=n)
+
+    df = pd.DataFrame({
+        "ID": np.arange(1, n + 1),
+        "DUA": [f"118-{y}-10-{i:06d}" for i, y in zip(range(n), fechas.astype("datetime64[Y]").astype(int) + 1970)],
+        "Fecha": fechas.astype(str),
+        "RUC": rucs[i_importador],
+        "Importador": importadores[i_importador],
+        "Embarcador": np.array([f"{p} EXPORT CO." for p in PAISES])[i_pais],
+        "Pais_origen": np.array(PAISES)[i_pais],
+        "Descripcion": [f"{m} {c} {i} PLAGUICIDA DE USO AGRICOLA" for m, c, i in zip(marcas[i_marca], concentracion, ingredientes)],
+        "Kg_Neto": kg,
+        "Qty_2": qty,
+        "Und_2": rng.choice(["L", "KG", "U"], size=n),
+        "CIF_Tot": cif,
+        "CIF_und": np.round(cif / qty, 4),
+        "Marca": marcas[i_marca],
+        "Formulacion": np.array(FORMULACIONES)[marca_formulacion[i_marca]],
+        "Concentracion": concentracion,
+        "Concent_disgregada": concentracion,
+        "INGREDIENTE_nuevo": ingredientes,
+        "CLASE_SIGIA": np.array(CLASES)[marca_clase[i_marca]],
+        "TIPO": rng.choice(["PRODUCTO FORMULADO", "INGREDIENTE ACTIVO"], size=n, p=[0.9, 0.1]),
+        "Estado": rng.choice(["LIQUIDO", "SOLIDO"], size=n),
+        "Presentacion": rng.choice(["BIDON 20 L", "FRASCO 1 L", "SACO 25 KG", "CILINDRO 200 L"], size=n),
+        "Via": rng.choice(["MARITIMA", "AEREA", "TERRESTRE"], size=n, p=[0.85, 0.1, 0.05])
+    })
+
+    # Algunos nulos como en la tabla real
+    df.loc[rng.random(n) < 0.01, "Kg_Neto"] = np.nan
+    df.loc[rng.random(n) < 0.005, "Marca"] = None
+    return df
+
+
+# ========== CLIENTE FALSO COMPATIBLE CON POSTGREST ==========
+
+class _Respuesta:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class _Consulta:
+    """Subconjunto del query builder de postgrest-py usado por SupabaseClient"""
+
+    def __init__(self, servidor, tabla):
+        self.servidor = servidor
+        self.tabla = tabla
+        self.filtros = []
+        self.columnas = None
+        self.contar = False
+        self.orden = None
+        self.limite = None
+
+    def select(self, columnas="*", count=None):
+        self.columnas = None if columnas == "*" else [c.strip() for c in columnas.split(",")]
+        self.contar = count == "exact"
+        return self
+
+    def _filtro(self, op, columna, valor):
+        self.filtros.append((columna, op, valor))
+        return self
+
+    def eq(self, columna, valor): return self._filtro("eq", columna, valor)
+    def neq(self, columna, valor): return self._filtro("neq", columna, valor)
+    def gt(self, columna, valor): return self._filtro("gt", columna, valor)
+    def gte(self, columna, valor): return self._filtro("gte", columna, valor)
+    def lt(self, columna, valor): return self._filtro("lt", columna, valor)
+    def lte(self, columna, valor): return self._filtro("lte", columna, valor)
+    def ilike(self, columna, valor): return self._filtro("ilike", columna, valor)
+
+    def order(self, columna, desc=False):
+        self.orden = (columna, desc)
+        return self
+
+    def limit(self, n):
+        self.limite = n
+        return self
+
+    def execute(self):
+        return self.servidor.ejecutar(self)
+
+
+class FakeSupabase:
+    """
+    Servidor en memoria sobre un DataFrame ordenado por "ID".
+    Las máscaras de filtros se memorizan por combinación de filtros, así
+    paginar por keyset cuesta O(página) y no O(tabla) por request.
+    """
+
+    def __init__(self, tablas, max_rows=1000, latencia_ms=0):
+        self.tablas = tablas
+        self.max_rows = max_rows
+        self.latencia = latencia_ms / 1000
+        self._mascaras = {}
+        self.reset_metricas()
+
+    def reset_metricas(self):
+        self.requests = 0
+        self.bytes = 0
+        self.overhead = 0.0
+
+    def table(self, nombre):
+        return _Consulta(self, nombre)
+
+    def rpc(self, nombre, params=None, **opciones):
+        # Sin funciones SQL: el pushdown se desactiva igual que sin sql/001_agregaciones.sql
+        class _Rpc:
+            def order(self_rpc, *args, **kwargs):
+                return self_rpc
+
+            def range(self_rpc, *args, **kwargs):
+                return self_rpc
+
+            def execute(self_rpc):
+                raise Exception({"code": "PGRST202", "message": f"Could not find the function public.{nombre}"})
+        return _Rpc()
+
+    def _posiciones(self, tabla, df, filtros):
+        clave = (tabla, tuple((c, op, str(v)) for c, op, v in filtros if c != "ID"))
+        if clave not in self._mascaras:
+            mascara = np.ones(len(df), dtype=bool)
+            for columna, op, valor in clave[1]:
+                serie = df[columna]
+                if op == "ilike":
+                    mascara &= serie.astype(str).str.contains(valor.strip("%"), case=False, regex=False, na=False).to_numpy()
+                    continue
+                if pd.api.types.is_numeric_dtype(serie):
+                    valor = float(valor)
+                comparacion = {"eq": serie == valor, "neq": serie != valor, "gt": serie > valor,
+                               "gte": serie >= valor, "lt": serie < valor, "lte": serie <= valor}[op]
+                mascara &= (comparacion & serie.notna()).to_numpy()
+            self._mascaras[clave] = np.flatnonzero(mascara)
+        return self._mascaras[clave]
+
+    def ejecutar(self, consulta):
+        if consulta.tabla not in self.tablas:
+            raise Exception({"code": "42P01", "message": f"relation public.{consulta.tabla} does not exist"})
+        if self.latencia:
+            time.sleep(self.latencia)
+        df = self.tablas[consulta.tabla]
+        posiciones = self._posiciones(consulta.tabla, df, consulta.filtros)
+        total = len(posiciones) if consulta.contar else None
+
+        # Keyset: ID > último visto (el DataFrame está ordenado por ID)
+        for columna, op, valor in consulta.filtros:
+            if columna == "ID" and op == "gt":
+                ids = df["ID"].to_numpy()[posiciones]
+                posiciones = posiciones[np.searchsorted(ids, valor, side="right"):]
+        if consulta.orden and consulta.orden[1]:
+            posiciones = posiciones[::-1]
+        posiciones = posiciones[:min(consulta.limite or self.max_rows, self.max_rows)]
+
+        pagina = df.iloc[posiciones]
+        if consulta.columnas:
+            pagina = pagina[[c for c in consulta.columnas if c in pagina.columns]]
+        filas = pagina.astype(object).where(pagina.notna(), None).to_dict("records")
+
+        inicio = time.perf_counter()
+        self.requests += 1
+        self.bytes += len(json.dumps(filas, default=str))
+        self.overhead += time.perf_counter() - inicio
+        return _Respuesta(filas, total)
+
+
+# ========== BENCHMARK ==========
+
+def casos(df):
+    """Llamadas a medir, con entidades reales de los datos generados"""
+    marca = df["Marca"].value_counts().index[3]
+    importador = df["Importador"].value_counts().index[1]
+    return [
+        ("get_summary_stats", ()),
+        ("get_summary_stats_by_year", (2024,)),
+        ("get_top_n_global", ("Marca", "Kg_Neto", "sum", 10, None)),
+        ("get_top_n_global", ("Importador", "CIF_Tot", "sum", 10, 2024)),
+        ("get_aggregated_by_year", (2023, "Pais_origen", "Kg_Neto", "sum")),
+        ("comparar_periodos", (2023, 2024, "Marca")),
+        ("get_new_brands_count", (2024,)),
+        ("get_time_series_by_entity", ("Marca", marca)),
+        ("get_entity_total_historico", ("Importador", importador)),
+        ("get_year_comparison", (2023, 2024)),
+        ("get_unique_values_by_year", ("Pais_origen", 2024)),
+    ]
+
+
+def crear_cliente(fake, modo, directorio):
+    import utils.supabase_client as supabase_client
+
+    os.environ["RESULT_CACHE_ENABLED"] = "false"
+    os.environ["AGG_PUSHDOWN"] = "false"
+    os.environ["CUBE_ENABLED"] = "true" if modo == "cube" else "false"
+    os.environ["SNAPSHOT_PATH"] = os.path.join(directorio, f"snapshot_{modo}.parquet")
+    os.environ.setdefault("SUPABASE_URL", "http://benchmark.local")
+    os.environ.setdefault("SUPABASE_KEY", "benchmark")
+    supabase_client.create_client = lambda url, key, options=None: fake
+    return supabase_client.SupabaseClient(use_snapshot=modo != "stream")
+
+
+def medir(fake, funcion):
+    """Ejecuta funcion() y devuelve (resultado, segundos, bytes, requests, MB pico)"""
+    fake.reset_metricas()
+    tracemalloc.start()
+    inicio = time.perf_counter()
+    resultado = funcion()
+    segundos = time.perf_counter() - inicio - fake.overhead
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return resultado, segundos, fake.bytes, fake.requests, pico / 1024 ** 2
+
+
+def ejecutar_benchmark(filas, modos, latencia_ms=0, seed=42):
+    resultados = []
+    for n in filas:
+        print(f"\n📦 Generando {n:,} filas sintéticas...")
+        df = generar_datos(n, seed)
+        fake = FakeSupabase({os.getenv("TABLE_NAME", "importaciones"): df}, latencia_ms=latencia_ms)
+
+        with tempfile.TemporaryDirectory() as directorio:
+            for modo in modos:
+                db = crear_cliente(fake, modo, directorio)
+
+                # Carga inicial del snapshot/cubo medida aparte
+                if db.snapshot is not None:
+                    def carga():
+                        db.snapshot.refresh(force_full=True)
+                        if db.cube is not None:
+                            db.cube.ensure_ready()
+                    _, seg, bytes_, reqs, mb = medir(fake, carga)
+                    resultados.append({"filas": n, "modo": modo, "metodo": "carga_inicial",
+                                       "ms": seg * 1000, "bytes": bytes_, "requests": reqs, "mb_pico": mb})
+
+                for metodo, args in casos(df):
+                    _, seg, bytes_, reqs, mb = medir(fake, lambda: getattr(db, metodo)(*args))
+                    resultados.append({"filas": n, "modo": modo, "metodo": metodo,
+                                       "ms": seg * 1000, "bytes": bytes_, "requests": reqs, "mb_pico": mb})
+                print(f"  ✅ {modo}: {len(casos(df))} analíticas medidas")
+    return pd.DataFrame(resultados)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de analíticas de SupabaseClient con datos sintéticos")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 100_000],
+                        help="Tamaños a generar (ej: 10000 100000 1000000)")
+    parser.add_argument("--modos", nargs="+", default=["stream", "snapshot", "cube"],
+                        choices=["stream", "snapshot", "cube"])
+    parser.add_argument("--latencia-ms", type=float, default=0,
+                        help="Latencia simulada por request (round trip a Supabase)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--salida", help="Guarda los resultados en CSV")
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print("⏱️ BENCHMARK DE ANALÍTICAS - SupabaseClient")
+    print("=" * 60)
+
+    resultados = ejecutar_benchmark(args.filas, args.modos, args.latencia_ms, args.seed)
+
+    pd.set_option("display.width", 160)
+    pd.set_option("display.max_rows", 500)
+    tabla = resultados.assign(
+        ms=resultados["ms"].round(1),
+        kb=(resultados["bytes"] / 1024).round(1),
+        mb_pico=resultados["mb_pico"].round(1)
+    )[["filas", "modo", "metodo", "ms", "kb", "requests", "mb_pico"]]
+    print("\n" + tabla.to_string(index=False))
+
+    if args.salida:
+        resultados.to_csv(args.salida, index=False)
+        print(f"\n💾 Resultados guardados en {args.salida}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,156 +1,797 @@
 import pandas as pd
 from supabase import create_client
 from dotenv import load_dotenv
+import argparse
+import io
+import json
 import os
+import random
+import sys
+import threading
+import time
+import httpx
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from datetime import datetime
+from ingesta import ArchivoRechazos, hojas_disponibles, tramos_limpios
+from diario_carga import DiarioCarga
+
+try:
+    import psycopg2
+    from psycopg2 import sql
+except ImportError:
+    psycopg2 = None
 
 load_dotenv()
 
-def cargar_datos_a_supabase(ruta_excel):
+
+class _CsvStream:
+    """Archivo de solo lectura que genera el CSV de cada tramo a medida que copy_expert lo lee"""
+
+    def __init__(self, tramos, columnas):
+        self._tramos = iter(tramos)
+        self._columnas = columnas
+        self._current = io.BytesIO()
+        self.filas = 0
+        self.desde = None
+        self.hasta = None
+
+    def read(self, size=-1):
+        while True:
+            data = self._current.read(size)
+            if data:
+                return data
+            tramo = next(self._tramos, None)
+            if tramo is None:
+                return b""
+            if not len(tramo):
+                continue
+            self.filas += len(tramo)
+            self.desde = tramo.index[0] if self.desde is None else self.desde
+            self.hasta = tramo.index[-1]
+            tramo = _preparar_para_copy(tramo.reindex(columns=self._columnas))
+            self._current = io.BytesIO(tramo.to_csv(index=False, header=False).encode("utf-8"))
+
+
+def _preparar_para_copy(df):
+    """
+    Columnas numéricas con valores enteros como Int64: COPY rechaza "12.0"
+    en columnas integer (los NaN quedan como NULL).
+    """
+    df = df.copy()
+    for col in df.columns:
+        if pd.api.types.infer_dtype(df[col], skipna=True) not in ("floating", "integer", "mixed-integer-float"):
+            continue
+        numeros = pd.to_numeric(df[col], errors="coerce")
+        validos = numeros.dropna()
+        if len(validos) and (validos % 1 == 0).all():
+            numeros = numeros.astype("Int64")
+        df[col] = numeros
+    return df
+
+
+def _registros(df):
+    """Filas como dicts para la API REST (NaN/NA → None)"""
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+# ========== CARGA INCREMENTAL (sql/003_carga_incremental.sql) ==========
+
+# Identidad de una fila: DUA + n° de línea dentro de la DUA
+CLAVE_FILA = ["DUA", "Linea"]
+
+MODOS_CARGA = {
+    "incremental": "Incremental (solo filas nuevas o modificadas)",
+    "agregar": "Agregar todas las filas",
+    "reemplazar": "Reemplazar toda la tabla"
+}
+
+
+def _canonico(serie):
+    """Texto estable de una columna para el hash: 12, 12.0 y "12" coinciden; nulos = '' """
+    texto = serie.astype("string").str.strip().fillna("")
+    if pd.api.types.infer_dtype(serie, skipna=True) in ("string", "empty"):
+        return texto
+    numeros = pd.to_numeric(serie, errors="coerce").round(6)
+    enteros = numeros.notna() & (numeros % 1 == 0)
+    como_numero = numeros.astype(str).where(~enteros, numeros.where(enteros, 0).astype("int64").astype(str))
+    return texto.where(numeros.isna(), como_numero)
+
+
+class NumeradorLineas:
+    """N° de línea de cada fila dentro de su DUA, en orden de archivo y a través de los tramos"""
+
+    def __init__(self):
+        self._vistas = pd.Series(dtype="int64")
+
+    def __call__(self, duas):
+        duas = duas.fillna("")
+        previas = duas.map(self._vistas).fillna(0).astype("int64")
+        lineas = previas + duas.groupby(duas, sort=False).cumcount() + 1
+        conteo = duas.value_counts()
+        self._vistas = self._vistas.add(conteo, fill_value=0).astype("int64")
+        return lineas
+
+
+def agregar_hash_filas(df, numerador=None):
+    """
+    Agrega row_hash (hash del contenido, sin "ID" ni la clave) y, si el tramo
+    no la trae ya de la limpieza (tramos_limpios con numerador), "Linea"
+    (orden de la fila dentro de su DUA en el archivo).
+    """
+    df = df.copy()
+    if "Linea" not in df.columns:
+        df["Linea"] = numerador(df["DUA"]) if "DUA" in df.columns and numerador is not None else 1
+    contenido = [c for c in df.columns if c not in ("ID", "row_hash", *CLAVE_FILA)]
+    canonico = pd.DataFrame({c: _canonico(df[c]) for c in contenido})
+    hashes = pd.util.hash_pandas_object(canonico, index=False).to_numpy()
+    df["row_hash"] = [f"{h:016x}" for h in hashes]
+    return df
+
+
+def soporta_incremental(client, table_name):
+    """True si la tabla tiene las columnas "Linea" y row_hash"""
+    try:
+        client.table(table_name).select("Linea,row_hash").limit(1).execute()
+        return True
+    except Exception:
+        return False
+
+
+def hashes_existentes(client, table_name, page_size=1000):
+    """ID, DUA, Linea, Fecha y row_hash de las filas guardadas"""
+    filas = []
+    last_id = None
+    while True:
+        query = client.table(table_name).select("ID,DUA,Linea,Fecha,row_hash")
+        if last_id is not None:
+            query = query.gt("ID", last_id)
+        page = query.order("ID").limit(page_size).execute().data or []
+        if not page:
+            break
+        filas.extend(page)
+        last_id = page[-1]["ID"]
+    guardadas = pd.DataFrame(filas, columns=["ID", "DUA", "Linea", "Fecha", "row_hash"])
+    return guardadas.dropna(subset=CLAVE_FILA).astype({"Linea": "int64"})
+
+
+class ComparadorIncremental:
+    """
+    Filtra cada tramo a las filas nuevas o modificadas (hash distinto al
+    guardado) y recuerda las claves vistas para detectar, al final, las
+    filas guardadas del periodo del archivo que ya no están en él.
+    """
+
+    def __init__(self, guardadas):
+        self.guardadas = guardadas
+        self._hash_guardado = guardadas.set_index(CLAVE_FILA)["row_hash"]
+        self._claves_vistas = []
+        self.fecha_min = None
+        self.fecha_max = None
+        self.sin_dua = 0
+        self.sin_cambios = 0
+
+    def filtrar(self, tramo):
+        sin_dua = tramo["DUA"].isna().to_numpy()
+        self.sin_dua += int(sin_dua.sum())
+        tramo = tramo[~sin_dua]
+
+        claves = pd.MultiIndex.from_frame(tramo[CLAVE_FILA].astype({"DUA": object, "Linea": "int64"}))
+        self._claves_vistas.append(claves)
+        fechas = tramo["Fecha"].dropna() if "Fecha" in tramo.columns else []
+        if len(fechas):
+            self.fecha_min = min(filter(None, [self.fecha_min, fechas.min()]))
+            self.fecha_max = max(filter(None, [self.fecha_max, fechas.max()]))
+
+        guardado = self._hash_guardado.reindex(claves).to_numpy()
+        cambios = guardado != tramo["row_hash"].to_numpy()
+        self.sin_cambios += int((~cambios).sum())
+        return tramo[cambios]
+
+    def excluir(self, rechazados):
+        """
+        Claves de filas rechazadas por la limpieza: siguen en el archivo, así
+        que su copia guardada no cuenta como desaparecida
+        """
+        if not {"DUA", "Linea"} <= set(rechazados.columns):
+            return
+        rechazados = rechazados[rechazados["DUA"].notna()]
+        if len(rechazados):
+            self._claves_vistas.append(pd.MultiIndex.from_frame(
+                rechazados[CLAVE_FILA].astype({"DUA": object, "Linea": "int64"})
+            ))
+
+    def desaparecidos(self):
+        """IDs guardados del periodo del archivo cuya clave no apareció en él (ni entre las rechazadas)"""
+        if self.fecha_min is None or not len(self.guardadas):
+            return []
+        periodo = self.guardadas[self.guardadas["Fecha"].between(self.fecha_min, self.fecha_max)]
+        vistas = self._claves_vistas[0].append(self._claves_vistas[1:]) if self._claves_vistas else pd.MultiIndex.from_tuples([], names=CLAVE_FILA)
+        presentes = pd.MultiIndex.from_frame(periodo[CLAVE_FILA]).isin(vistas)
+        return periodo.loc[~presentes, "ID"].astype(int).tolist()
+
+
+# ========== CARGA ==========
+
+def cargar_con_copy(tramos, table_name, modo, connection_string, eliminar=None, diario=None):
+    """
+    Carga masiva con COPY FROM STDIN (psycopg2):
+    1. COPY de los tramos a una tabla temporal de staging, a medida que se leen.
+    2. En la misma transacción se aplica el modo sobre la tabla final:
+       - reemplazar: DELETE + INSERT ... SELECT (DELETE y no TRUNCATE: TRUNCATE
+         toma ACCESS EXCLUSIVE y bloquearía también las lecturas del chatbot
+         durante toda la carga; DELETE solo bloquea a otros escritores)
+       - agregar: INSERT ... SELECT
+       - incremental: INSERT ... ON CONFLICT ("DUA", "Linea") DO UPDATE
+         y DELETE de los IDs que devuelva eliminar() (si se indica)
+       Si algo falla no se aplica nada (rollback), y los lectores ven los
+       datos anteriores hasta el COMMIT.
+    3. Tras el COMMIT el rango de filas completo se anota en el diario (si se indica).
+    Devuelve (filas leídas, filas insertadas o actualizadas).
+    """
+    tramos = iter(tramos)
+    primero = next(tramos, None)
+    if primero is None:
+        return 0, 0
+
+    conn = psycopg2.connect(connection_string)
+    try:
+        with conn:
+            with conn.cursor() as cur:
+                # Solo las columnas que existen en la tabla destino ("ID" lo genera la base)
+                cur.execute(
+                    "SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s",
+                    (table_name,)
+                )
+                existentes = {row[0] for row in cur.fetchall()}
+                if not existentes:
+                    raise ValueError(f"La tabla {table_name} no existe")
+                columnas = [c for c in primero.columns if c in existentes and c != "ID"]
+                ignoradas = [c for c in primero.columns if c not in columnas and c != "ID"]
+                if ignoradas:
+                    print(f"⚠️  Columnas ignoradas (no existen en {table_name}): {ignoradas}")
+
+                tabla = sql.Identifier(table_name)
+                staging = sql.Identifier(f"{table_name}_staging")
+                lista = sql.SQL(", ").join(sql.Identifier(c) for c in columnas)
+
+                cur.execute(sql.SQL(
+                    "CREATE TEMP TABLE {staging} ON COMMIT DROP AS SELECT {cols} FROM {tabla} WITH NO DATA"
+                ).format(staging=staging, cols=lista, tabla=tabla))
+
+                print("📤 COPY a staging...")
+                stream = _CsvStream(_con_primero(primero, tramos), columnas)
+                cur.copy_expert(
+                    sql.SQL("COPY {staging} ({cols}) FROM STDIN WITH (FORMAT csv)").format(
+                        staging=staging, cols=lista
+                    ),
+                    stream,
+                    size=1024 * 1024
+                )
+                print(f"📤 {stream.filas:,} filas en staging")
+
+                insertar = sql.SQL("INSERT INTO {tabla} ({cols}) SELECT {cols} FROM {staging}").format(
+                    tabla=tabla, cols=lista, staging=staging
+                )
+                if modo == "reemplazar":
+                    cur.execute(sql.SQL("DELETE FROM {tabla}").format(tabla=tabla))
+                    print("🗑️  Datos existentes reemplazados (se aplica al confirmar)")
+                elif modo == "incremental":
+                    actualizar = sql.SQL(", ").join(
+                        sql.SQL("{c} = EXCLUDED.{c}").format(c=sql.Identifier(c))
+                        for c in columnas if c not in CLAVE_FILA
+                    )
+                    insertar = sql.SQL("{insertar} ON CONFLICT ({clave}) DO UPDATE SET {actualizar}").format(
+                        insertar=insertar,
+                        clave=sql.SQL(", ").join(sql.Identifier(c) for c in CLAVE_FILA),
+                        actualizar=actualizar
+                    )
+                cur.execute(insertar)
+                cargados = cur.rowcount
+
+                ids_a_eliminar = eliminar() if eliminar else []
+                if ids_a_eliminar:
+                    cur.execute(sql.SQL('DELETE FROM {tabla} WHERE "ID" = ANY(%s)').format(tabla=tabla), (ids_a_eliminar,))
+                    print(f"🗑️  {cur.rowcount} filas que ya no están en el archivo eliminadas")
+    finally:
+        conn.close()
+
+    if diario is not None and stream.filas:
+        diario.confirmar(stream.desde, stream.hasta, stream.filas)
+    return stream.filas, cargados
+
+
+def _con_primero(primero, resto):
+    yield primero
+    yield from resto
+
+
+# ========== CARGA POR POSTGREST (concurrente) ==========
+
+CARGA_WORKERS = int(os.getenv("CARGA_WORKERS", "4"))
+CARGA_LOTE_INICIAL = int(os.getenv("CARGA_LOTE_INICIAL", "500"))
+CARGA_LOTE_MAX = int(os.getenv("CARGA_LOTE_MAX", "5000"))
+CARGA_LOTE_MAX_BYTES = int(os.getenv("CARGA_LOTE_MAX_BYTES", str(1024 * 1024)))
+CARGA_LATENCIA_OBJETIVO = float(os.getenv("CARGA_LATENCIA_OBJETIVO", "2.0"))
+CARGA_REINTENTOS = int(os.getenv("CARGA_REINTENTOS", "4"))
+
+LOTE_MIN = 50
+LOTE_ELIMINAR = 500
+
+# Errores que no dependen de las filas: se reintenta el mismo lote
+_CODIGOS_TRANSITORIOS = {"408", "429", "500", "502", "503", "504", "40001", "40P01", "53300"}
+_ESTADOS_TRANSITORIOS = {408, 429, 500, 502, 503, 504}
+# Lote demasiado grande (payload o statement timeout): se achica y se divide
+_CODIGOS_LOTE_GRANDE = {"413", "57014"}
+# Clave duplicada: suele ser el lote entero (archivo ya cargado), dividirlo no aísla nada
+_CODIGO_DUPLICADO = "23505"
+
+# Status HTTP de la última respuesta de cada worker. APIError de postgrest solo
+# trae el "code" del JSON, que en un 429/5xx del gateway es None o PGRSTxxx.
+_estado_http = threading.local()
+
+
+def _anotar_estado_http(response):
+    _estado_http.status = response.status_code
+
+
+def _registrar_estado_http(client):
+    """Hook de httpx en la sesión de PostgREST para conocer el status HTTP de cada error"""
+    try:
+        hooks = client.postgrest.session.event_hooks["response"]
+    except (AttributeError, KeyError):
+        return
+    if _anotar_estado_http not in hooks:
+        hooks.append(_anotar_estado_http)
+
+
+def _codigo_error(e):
+    return str(getattr(e, "code", "") or "")
+
+
+def _es_lote_grande(e):
+    return _codigo_error(e) in _CODIGOS_LOTE_GRANDE or getattr(e, "status_http", None) == 413
+
+
+def _es_error_de_filas(e):
+    """
+    True si el error lo causa alguna fila del lote (SQLSTATE 22xxx: dato
+    inválido, 23xxx: restricción) o el tamaño del lote: vale la pena dividirlo.
+    Errores como columna o tabla inexistente fallarían igual en cada mitad, y
+    una clave duplicada (23505) casi siempre afecta a todo el lote.
+    """
+    codigo = _codigo_error(e)
+    if codigo == _CODIGO_DUPLICADO:
+        return False
+    return codigo.startswith(("22", "23")) or _es_lote_grande(e)
+
+
+def _es_transitorio(e):
+    if isinstance(e, (httpx.TransportError, ConnectionError, TimeoutError)):
+        return True
+    codigo = _codigo_error(e)
+    if codigo in _CODIGOS_TRANSITORIOS:
+        return True
+    # Sin SQLSTATE (code None o PGRSTxxx) decide el status HTTP de la respuesta
+    sin_sqlstate = not codigo or codigo.startswith("PGRST")
+    return sin_sqlstate and getattr(e, "status_http", None) in _ESTADOS_TRANSITORIOS
+
+
+class TamanoLote:
+    """
+    Tamaño de lote adaptativo, compartido por los workers:
+    crece mientras los requests respondan bajo CARGA_LATENCIA_OBJETIVO y se
+    achica cuando la superan, sin pasar de CARGA_LOTE_MAX filas ni de
+    CARGA_LOTE_MAX_BYTES de payload (según los bytes por fila observados).
+    """
+
+    def __init__(self, inicial=CARGA_LOTE_INICIAL, maximo=CARGA_LOTE_MAX,
+                 max_bytes=CARGA_LOTE_MAX_BYTES, latencia_objetivo=CARGA_LATENCIA_OBJETIVO):
+        self.maximo = max(maximo, LOTE_MIN)
+        self.max_bytes = max_bytes
+        self.latencia_objetivo = latencia_objetivo
+        self._filas = min(max(inicial, LOTE_MIN), self.maximo)
+        self._bytes_por_fila = None
+        self._lock = threading.Lock()
+
+    def actual(self):
+        with self._lock:
+            return self._filas
+
+    def _limitar(self, filas):
+        limite = self.maximo
+        if self._bytes_por_fila:
+            limite = min(limite, int(self.max_bytes / self._bytes_por_fila))
+        return int(min(max(filas, LOTE_MIN), max(limite, LOTE_MIN)))
+
+    def observar(self, filas, bytes_enviados, segundos):
+        with self._lock:
+            if filas:
+                self._bytes_por_fila = bytes_enviados / filas
+            if segundos < self.latencia_objetivo / 2:
+                self._filas = self._limitar(self._filas * 1.5)
+            elif segundos > self.latencia_objetivo:
+                self._filas = self._limitar(self._filas * self.latencia_objetivo / segundos)
+            else:
+                self._filas = self._limitar(self._filas)
+
+    def reducir(self):
+        with self._lock:
+            self._filas = self._limitar(self._filas // 2)
+
+
+def _enviar(client, table_name, registros, modo):
+    _estado_http.status = None
+    try:
+        if modo == "incremental":
+            client.table(table_name).upsert(registros, on_conflict=",".join(CLAVE_FILA)).execute()
+        else:
+            client.table(table_name).insert(registros).execute()
+    except Exception as e:
+        if getattr(e, "status_http", None) is None:
+            e.status_http = getattr(_estado_http, "status", None)
+        raise
+
+
+def _enviar_con_reintentos(client, table_name, registros, modo, tamano, reintentos=CARGA_REINTENTOS):
     """
-    Carga datos desde un archivo Excel a Supabase
+    Envía un lote; los errores transitorios (red, 429, 5xx) se reintentan con
+    backoff exponencial con jitter. Los demás se propagan.
+    """
+    payload = len(json.dumps(registros, default=str))
+    for intento in range(reintentos + 1):
+        inicio = time.perf_counter()
+        try:
+            _enviar(client, table_name, registros, modo)
+            tamano.observar(len(registros), payload, time.perf_counter() - inicio)
+            return
+        except Exception as e:
+            if _es_lote_grande(e):
+                tamano.reducir()
+            if not _es_transitorio(e) or intento == reintentos:
+                raise
+            time.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** intento)))
+
+
+def _subir_lote(client, table_name, registros, modo, tamano, filas, diario=None):
+    """
+    Sube un lote y devuelve (cargados, errores). Si el lote falla por sus
+    datos se divide en mitades hasta aislar las filas inválidas: solo esas
+    quedan como error, con el mensaje de la base.
+    filas son las filas del archivo de cada registro; cada parte confirmada
+    se anota en el diario (si se indica).
+    """
+    try:
+        _enviar_con_reintentos(client, table_name, registros, modo, tamano)
+        if diario is not None:
+            diario.confirmar(filas[0], filas[-1], len(registros))
+        return len(registros), []
+    except Exception as e:
+        if len(registros) == 1 or not _es_error_de_filas(e):
+            # Fila inválida, o error que no depende de las filas (reintentos agotados, esquema)
+            mensaje = (getattr(e, "message", None) or str(e))[:300]
+            if _codigo_error(e) == _CODIGO_DUPLICADO:
+                mensaje = f"Filas ya cargadas (usa --modo incremental o --resume): {mensaje}"
+            return 0, [{**registro, "error": mensaje} for registro in registros]
+        mitad = len(registros) // 2
+        cargados_a, errores_a = _subir_lote(client, table_name, registros[:mitad], modo, tamano, filas[:mitad], diario)
+        cargados_b, errores_b = _subir_lote(client, table_name, registros[mitad:], modo, tamano, filas[mitad:], diario)
+        return cargados_a + cargados_b, errores_a + errores_b
+
+
+def cargar_con_postgrest(client, table_name, tramos, modo, eliminar=None, workers=CARGA_WORKERS, diario=None):
+    """
+    Carga por la API REST (fallback sin conexión directa a Postgres):
+    lotes de tamaño adaptativo enviados por un pool de workers, con a lo
+    sumo 2 lotes por worker en vuelo. En modo incremental cada lote es un
+    upsert sobre ("DUA", "Linea"). Cada lote confirmado se anota en el
+    diario (DiarioCarga) con su rango de filas del archivo.
+    Devuelve (filas leídas, registros cargados, registros con error).
+    """
+    _registrar_estado_http(client)
+    if modo == "reemplazar":
+        try:
+            # Eliminar todos los registros
+            client.table(table_name).delete().neq('ID', -999999).execute()
+            print("🗑️  Datos existentes eliminados")
+        except Exception as e:
+            print(f"⚠️  Advertencia al limpiar: {e}")
+
+    tamano = TamanoLote()
+    leidos = 0
+    registros_cargados = 0
+    registros_con_error = []
+    lote = 0
+    pendientes = []
+    filas_pendientes = []
+    en_vuelo = {}
+
+    print(f"\n🔄 Iniciando carga con {workers} workers (lote inicial de {tamano.actual()})...")
+    print("=" * 60)
+
+    def recoger(futuros):
+        nonlocal registros_cargados
+        for futuro in futuros:
+            numero = en_vuelo.pop(futuro)
+            cargados, errores = futuro.result()
+            registros_cargados += cargados
+            registros_con_error.extend(errores)
+            if errores:
+                print(f"❌ Lote {numero}: {cargados} cargados, {len(errores)} con error ({errores[0]['error'][:120]})")
+            else:
+                print(f"✅ Lote {numero}: {cargados} registros | Cargados: {registros_cargados:,}")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="carga") as executor:
+        def enviar():
+            nonlocal lote
+            if len(en_vuelo) >= workers * 2:
+                listos, _ = wait(en_vuelo, return_when=FIRST_COMPLETED)
+                recoger(listos)
+            n = tamano.actual()
+            registros, filas = pendientes[:n], filas_pendientes[:n]
+            del pendientes[:n], filas_pendientes[:n]
+            lote += 1
+            futuro = executor.submit(_subir_lote, client, table_name, registros, modo, tamano, filas, diario)
+            en_vuelo[futuro] = lote
+
+        for tramo in tramos:
+            leidos += len(tramo)
+            pendientes.extend(_registros(tramo))
+            filas_pendientes.extend(tramo.index.tolist())
+            while len(pendientes) >= tamano.actual():
+                enviar()
+        while pendientes:
+            enviar()
+        recoger(list(en_vuelo))
+
+    print(f"📦 Tamaño de lote final: {tamano.actual()} filas")
+
+    ids_a_eliminar = eliminar() if eliminar else []
+    eliminados = 0
+    for i in range(0, len(ids_a_eliminar), LOTE_ELIMINAR):
+        try:
+            client.table(table_name).delete().in_("ID", ids_a_eliminar[i:i + LOTE_ELIMINAR]).execute()
+            eliminados += len(ids_a_eliminar[i:i + LOTE_ELIMINAR])
+        except Exception as e:
+            print(f"⚠️  Error eliminando filas que ya no están en el archivo: {e}")
+    if eliminados:
+        print(f"🗑️  {eliminados} filas que ya no están en el archivo eliminadas")
+
+    return leidos, registros_cargados, registros_con_error
+
+
+def cargar_datos_a_supabase(ruta_excel, hoja=None, modo=None, eliminar_desaparecidos=None,
+                             reanudar=False, interactivo=True):
+    """
+    Carga datos desde un archivo Excel (o CSV) a Supabase.
+    El archivo se lee y limpia por tramos (ingesta.py): las filas inválidas
+    van a registros_rechazados.csv y la memoria no depende del tamaño.
+    Los lotes confirmados se anotan en el diario (diario_carga.py); con
+    reanudar=True se saltan los de una carga anterior sin terminar.
+    Con interactivo=False no se pregunta nada: los parámetros en None toman
+    su valor por defecto (hoja 1, modo incremental, no eliminar).
+    Devuelve True si la carga terminó sin registros con error.
     """
     print("=" * 60)
     print("🚀 CARGANDO DATOS A SUPABASE")
     print("=" * 60)
-    
+
     # Conectar a Supabase
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_KEY")
     table_name = os.getenv("TABLE_NAME", "importaciones")
-    
+
     if not url or not key:
         print("❌ Error: Configura SUPABASE_URL y SUPABASE_KEY en .env")
-        return
-    
+        return False
+
     client = create_client(url, key)
     print(f"✅ Conectado a Supabase")
     print(f"📋 Tabla destino: {table_name}")
-    
-    # Leer Excel
+
+    # Leer el primer tramo para mostrar columnas y preview
     try:
         # Primero ver las hojas disponibles
-        excel_file = pd.ExcelFile(ruta_excel)
-        hojas = excel_file.sheet_names
-        
+        hojas = hojas_disponibles(ruta_excel)
+
         print(f"\n📂 Archivo: {ruta_excel}")
         print(f"📋 Hojas disponibles: {hojas}")
-        
+
         # Seleccionar hoja
-        if len(hojas) > 1:
+        if hoja is not None:
+            hoja_seleccionada = hojas[int(hoja) - 1] if str(hoja).isdigit() else hoja
+            if hoja_seleccionada not in hojas:
+                print(f"❌ La hoja {hoja} no existe en el archivo")
+                return False
+        elif len(hojas) > 1 and interactivo:
             print(f"\n¿Qué hoja deseas cargar?")
-            for i, hoja in enumerate(hojas, 1):
-                print(f"  {i}. {hoja}")
+            for i, nombre in enumerate(hojas, 1):
+                print(f"  {i}. {nombre}")
             hoja_num = input(f"\nIngresa el número (1-{len(hojas)}) o presiona Enter para usar la hoja 1: ").strip()
             hoja_index = int(hoja_num) - 1 if hoja_num else 0
             hoja_seleccionada = hojas[hoja_index]
         else:
             hoja_seleccionada = hojas[0]
-        
+
         print(f"\n📄 Cargando hoja: {hoja_seleccionada}")
-        df = pd.read_excel(ruta_excel, sheet_name=hoja_seleccionada)
-        
-        print(f"📊 Total de registros: {len(df)}")
-        print(f"📋 Columnas: {len(df.columns)}")
+        muestra = next(tramos_limpios(ruta_excel, hoja_seleccionada, ArchivoRechazos(os.devnull)), None)
+        if muestra is None:
+            print("❌ El archivo no tiene filas válidas")
+            return False
+
+        print(f"📋 Columnas del esquema encontradas: {len(muestra.columns)}")
         print(f"\nColumnas encontradas:")
-        for i, col in enumerate(df.columns, 1):
+        for i, col in enumerate(muestra.columns, 1):
             print(f"  {i}. {col}")
-        
+
         # Mostrar preview de primeras filas
-        print("\n📋 Preview de primeros 3 registros:")
-        print(df.head(3).to_string())
-        
+        print("\n📋 Preview de primeros 3 registros (ya limpios):")
+        print(muestra.head(3).to_string())
+
     except Exception as e:
         print(f"❌ Error al leer el archivo: {e}")
-        return
-    
-    # Convertir fechas a string ISO
-    if 'Fecha' in df.columns:
-        df['Fecha'] = pd.to_datetime(df['Fecha'], errors='coerce').dt.strftime('%Y-%m-%d')
-    
-    # Limpiar datos: Reemplazar NaN, inf, -inf con None
-    print("\n🧹 Limpiando datos (NaN, inf, -inf → NULL)...")
-    
-    # Reemplazar infinitos con NaN primero
-    df = df.replace([float('inf'), float('-inf')], pd.NA)
-    
-    # Convertir NaN a None de forma más robusta
-    df = df.astype(object).where(pd.notnull(df), None)
-    
-    # Verificar columnas numéricas y limpiar
-    for col in df.columns:
-        if df[col].dtype == 'float64' or df[col].dtype == 'int64':
-            df[col] = df[col].apply(lambda x: None if pd.isna(x) or x == float('inf') or x == float('-inf') else x)
-    
-    print("✅ Datos limpiados")
-    
-    # Validar datos antes de continuar
+        return False
+
+    # Validar datos antes de continuar (sobre el primer tramo)
     print("\n" + "=" * 60)
-    print("🔍 VALIDACIÓN DE DATOS")
+    print(f"🔍 VALIDACIÓN DE DATOS (primeras {len(muestra):,} filas)")
     print("=" * 60)
-    
+
     # Contar valores nulos por columna
-    nulos_por_columna = df.isnull().sum()
+    nulos_por_columna = muestra.isnull().sum()
     if nulos_por_columna.sum() > 0:
         print(f"⚠️  Se encontraron {nulos_por_columna.sum()} valores nulos en total:")
         for col, count in nulos_por_columna[nulos_por_columna > 0].items():
             print(f"   - {col}: {count} nulos")
     else:
         print("✅ No hay valores nulos")
-    
+    del muestra
+
     # Preguntar si desea continuar
-    print("\n" + "=" * 60)
-    continuar = input("¿Deseas continuar con la carga? (S/N): ").strip().upper()
-    if continuar != 'S':
-        print("❌ Carga cancelada por el usuario")
-        return
-    
-    # Preguntar si desea limpiar la tabla primero
-    print("\n" + "=" * 60)
-    respuesta = input("¿Deseas ELIMINAR los datos existentes antes de cargar? (S/N): ").strip().upper()
-    
-    if respuesta == 'S':
+    if interactivo:
+        print("\n" + "=" * 60)
+        continuar = input("¿Deseas continuar con la carga? (S/N): ").strip().upper()
+        if continuar != 'S':
+            print("❌ Carga cancelada por el usuario")
+            return False
+
+    # Diario de la carga: ¿hay una anterior de este archivo sin terminar?
+    diario = DiarioCarga(ruta_excel, hoja_seleccionada, table_name)
+    if diario.pendiente and not reanudar:
+        print(f"\n⚠️  Hay una carga sin terminar de este archivo ({diario.filas_confirmadas:,} filas confirmadas)")
+        if interactivo:
+            reanudar = input("¿Continuar donde quedó? (S/N): ").strip().upper() == 'S'
+        else:
+            print("   Se carga desde el inicio (usa --resume para continuar donde quedó)")
+    if reanudar:
+        if diario.completa:
+            print("\n✅ Este archivo ya se cargó completo (según el diario): nada que hacer")
+            return True
+        if not diario.pendiente:
+            print("\nℹ️  No hay una carga anterior de este archivo para reanudar: se carga completo")
+            reanudar = False
+    if reanudar:
+        if modo and modo != diario.modo:
+            print(f"⚠️  Se usa el modo de la carga original: {diario.modo}")
+        modo = diario.modo
+        print(f"\n⏩ Reanudando: se saltan {diario.filas_confirmadas:,} filas ya confirmadas")
+
+    # Modo de carga
+    if modo is None and interactivo:
+        print("\n" + "=" * 60)
+        print("Modo de carga:")
+        modos = list(MODOS_CARGA)
+        for i, nombre in enumerate(modos, 1):
+            print(f"  {i}. {MODOS_CARGA[nombre]}")
+        opcion = input(f"Ingresa el número (1-{len(modos)}) o presiona Enter para el modo 1: ").strip()
+        modo = modos[int(opcion) - 1] if opcion else modos[0]
+    elif modo is None:
+        modo = "incremental"
+
+    # Linea + row_hash en todas las cargas, para que la próxima pueda ser incremental
+    incremental_disponible = soporta_incremental(client, table_name)
+    if not incremental_disponible and modo == "incremental":
+        print("⚠️  La tabla no tiene las columnas Linea/row_hash: ejecuta sql/003_carga_incremental.sql")
+        print("   Se usará el modo 'agregar'")
+        modo = "agregar"
+
+    guardadas = None
+    borrar_desaparecidos = False
+    if modo == "incremental":
+        print("\n🔍 Leyendo claves y hashes guardados...")
+        guardadas = hashes_existentes(client, table_name)
+        print(f"📋 {len(guardadas):,} filas guardadas")
+        if eliminar_desaparecidos is None and interactivo:
+            respuesta = input("¿Eliminar las filas del periodo del archivo que ya no estén en él? (S/N): ").strip().upper()
+            borrar_desaparecidos = respuesta == 'S'
+        else:
+            borrar_desaparecidos = bool(eliminar_desaparecidos)
+
+    # Al reanudar un reemplazo la tabla ya se vació: solo se agregan las filas que faltan
+    modo_carga = "agregar" if reanudar and modo == "reemplazar" else modo
+    if not reanudar:
+        diario.iniciar(modo)
+
+    def pipeline():
+        """Tramos limpios (+ hash, + filtro incremental, - filas ya confirmadas), listos para cargar"""
+        comparador = ComparadorIncremental(guardadas) if guardadas is not None else None
+        estado = {
+            "rechazos": ArchivoRechazos(
+                "registros_rechazados.csv",
+                al_agregar=comparador.excluir if comparador is not None else None
+            ),
+            "comparador": comparador
+        }
+        # Linea se numera antes de separar las filas rechazadas (no corre las siguientes)
+        numerador = NumeradorLineas() if incremental_disponible else None
+
+        def tramos():
+            for tramo in tramos_limpios(ruta_excel, hoja_seleccionada, estado["rechazos"], numerador=numerador):
+                if incremental_disponible:
+                    tramo = agregar_hash_filas(tramo)
+                if estado["comparador"] is not None:
+                    tramo = estado["comparador"].filtrar(tramo)
+                if reanudar:
+                    tramo = diario.pendientes(tramo)
+                yield tramo
+
+        eliminar = comparador.desaparecidos if comparador is not None and borrar_desaparecidos else None
+        return tramos(), estado, eliminar
+
+    registros_cargados = None
+    registros_con_error = []
+    metodo = "PostgREST"
+    inicio = time.perf_counter()
+
+    # COPY directo a Postgres si hay conexión; si no (o si falla) la API REST
+    connection_string = os.getenv("SUPABASE_CONNECTION_STRING")
+    usar_copy = os.getenv("CARGA_COPY", "true").lower() == "true"
+    if usar_copy and psycopg2 is not None and connection_string:
         try:
-            # Eliminar todos los registros
-            client.table(table_name).delete().neq('ID', -999999).execute()
-            print("🗑️  Datos existentes eliminados")
+            tramos, estado, eliminar = pipeline()
+            enviados, registros_cargados = cargar_con_copy(
+                tramos, table_name, modo_carga, connection_string, eliminar, diario=diario
+            )
+            metodo = "COPY"
         except Exception as e:
-            print(f"⚠️  Advertencia al limpiar: {e}")
-    
-    # Cargar datos en lotes
-    batch_size = 500
-    total_registros = len(df)
-    registros_cargados = 0
-    errores = 0
-    registros_con_error = []
-    
-    print(f"\n🔄 Iniciando carga en lotes de {batch_size}...")
-    print("=" * 60)
-    
-    for i in range(0, total_registros, batch_size):
-        batch = df.iloc[i:i+batch_size]
-        batch_data = batch.to_dict('records')
-        
+            print(f"⚠️  COPY falló ({e}). No se aplicó ningún cambio; usando PostgREST...")
+            inicio = time.perf_counter()
+    elif usar_copy:
+        print("ℹ️  Sin SUPABASE_CONNECTION_STRING o psycopg2: carga por PostgREST")
+
+    if registros_cargados is None:
+        # El archivo se vuelve a leer desde el inicio
+        tramos, estado, eliminar = pipeline()
+        enviados, registros_cargados, registros_con_error = cargar_con_postgrest(
+            client, table_name, tramos, modo_carga, eliminar=eliminar, diario=diario
+        )
+
+    segundos = time.perf_counter() - inicio
+    errores = len(registros_con_error)
+    rechazos = estado["rechazos"]
+    comparador = estado["comparador"]
+
+    # Sin errores la carga queda cerrada; con errores --resume reintenta solo esas filas
+    if not errores:
+        diario.terminar(cargados=registros_cargados, metodo=metodo)
+
+    # Refrescar el cubo de agregados del chatbot (sql/002_cubo.sql)
+    if registros_cargados > 0 or borrar_desaparecidos:
         try:
-            response = client.table(table_name).insert(batch_data).execute()
-            registros_cargados += len(batch_data)
-            progreso = (registros_cargados / total_registros) * 100
-            print(f"✅ Lote {i//batch_size + 1}: {len(batch_data)} registros | Progreso: {progreso:.1f}%")
+            client.rpc("fn_refrescar_cubo").execute()
+            print("🧊 Cubo de agregados actualizado")
         except Exception as e:
-            errores += len(batch_data)
-            print(f"❌ Error en lote {i//batch_size + 1}: {e}")
-            
-            # Guardar registros con error para análisis
-            for registro in batch_data:
-                registros_con_error.append(registro)
-    
+            print(f"⚠️  No se pudo refrescar el cubo (¿ejecutaste sql/002_cubo.sql?): {e}")
+
     # Si hay errores, guardar archivo para revisión
     if registros_con_error:
         error_file = "registros_con_error.csv"
         df_errores = pd.DataFrame(registros_con_error)
         df_errores.to_csv(error_file, index=False, encoding='utf-8-sig')
         print(f"\n💾 Registros con error guardados en: {error_file}")
-    
+        print("   Con --resume se reintentan solo los registros que no se confirmaron")
+    if rechazos.total:
+        print(f"\n💾 Filas rechazadas por datos inválidos guardadas en: {rechazos.ruta}")
+
     # Resumen final
     print("\n" + "=" * 60)
     print("📊 RESUMEN DE CARGA")
@@ -158,30 +799,74 @@ def cargar_datos_a_supabase(ruta_excel):
     print(f"✅ Registros cargados exitosamente: {registros_cargados}")
     if errores > 0:
         print(f"❌ Registros con error: {errores}")
-    print(f"📈 Total procesados: {total_registros}")
+    if rechazos.total:
+        print(f"🚫 Filas rechazadas (datos inválidos): {rechazos.total}")
+    if comparador is not None:
+        print(f"🔁 Sin cambios (no enviadas): {comparador.sin_cambios:,}")
+        if comparador.sin_dua:
+            print(f"⚠️  Sin DUA (no se pueden identificar, omitidas): {comparador.sin_dua:,}")
+    if reanudar:
+        print(f"⏩ Saltadas por estar ya confirmadas: {diario.filas_confirmadas:,}")
+    print(f"📈 Total enviados: {enviados}")
+    print(f"🧭 Modo: {MODOS_CARGA[modo]}")
+    print(f"⏱️  Método: {metodo} | {segundos:.1f} s | {registros_cargados / max(segundos, 1e-9):,.0f} filas/s")
     print(f"✅ Carga completada!")
     print("=" * 60)
+    return not errores
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Carga un Excel o CSV de importaciones a Supabase")
+    parser.add_argument("archivo", nargs="?", help="Ruta del Excel o CSV (si falta se pregunta)")
+    parser.add_argument("--hoja", help="Nombre o número (desde 1) de la hoja a cargar")
+    parser.add_argument("--modo", choices=list(MODOS_CARGA), help="Modo de carga (por defecto incremental)")
+    parser.add_argument("--eliminar-desaparecidos", action="store_true", default=None,
+                        help="En modo incremental, elimina las filas del periodo que ya no están en el archivo")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continúa una carga cortada de este archivo saltando los lotes ya confirmados")
+    parser.add_argument("-y", "--yes", action="store_true",
+                        help="Sin preguntas (para cron): usa las opciones indicadas o sus valores por defecto")
+    args = parser.parse_args()
+    interactivo = not args.yes
 
-if __name__ == "__main__":
     print("\n" + "=" * 60)
     print("📦 SCRIPT DE CARGA DE IMPORTACIONES")
     print("=" * 60)
-    
-    # Solicitar ruta del archivo
-    print("\n📁 Ingresa la ruta completa del archivo Excel:")
-    print("   Ejemplo: D:\\Datos\\importaciones_2024.xlsx")
-    print("   O presiona Enter para usar: datos_importaciones.xlsx\n")
-    
-    ruta = input("Ruta del archivo: ").strip()
-    
+
+    ruta = args.archivo
     if not ruta:
-        ruta = "datos_importaciones.xlsx"
-    
+        if not interactivo:
+            parser.error("con --yes hay que indicar el archivo")
+
+        # Solicitar ruta del archivo
+        print("\n📁 Ingresa la ruta completa del archivo Excel o CSV:")
+        print("   Ejemplo: D:\\Datos\\importaciones_2024.xlsx")
+        print("   O presiona Enter para usar: datos_importaciones.xlsx\n")
+
+        ruta = input("Ruta del archivo: ").strip()
+
+        if not ruta:
+            ruta = "datos_importaciones.xlsx"
+
     # Verificar que el archivo existe
     if not os.path.exists(ruta):
         print(f"\n❌ Error: No se encontró el archivo en {ruta}")
         print("   Verifica la ruta y vuelve a intentar")
+        ok = False
     else:
-        cargar_datos_a_supabase(ruta)
-    
-    input("\n\nPresiona Enter para salir...")
+        ok = cargar_datos_a_supabase(
+            ruta,
+            hoja=args.hoja,
+            modo=args.modo,
+            eliminar_desaparecidos=args.eliminar_desaparecidos,
+            reanudar=args.resume,
+            interactivo=interactivo
+        )
+
+    if interactivo:
+        input("\n\nPresiona Enter para salir...")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+Diario de carga (checkpoints) para cargar_datos.py
+===================================================
+Cada lote confirmado por la base se anota como un rango de filas del
+archivo (fila de origen, la misma de registros_rechazados.csv) en un JSONL.
+La clave de la carga es la huella del archivo (sha256 del contenido) + la
+hoja + la tabla destino: si el archivo cambia, la carga empieza de cero.
+
+Con --resume se saltan las filas de los rangos ya confirmados, así una
+carga cortada (red, suspensión del equipo) sigue donde quedó sin duplicar.
+
+Líneas del diario:
+    {"clave": ..., "evento": "inicio", "modo": "agregar", ...}
+    {"clave": ..., "evento": "lote", "desde": 2, "hasta": 501, "filas": 500}
+    {"clave": ..., "evento": "fin", ...}
+Solo cuentan las líneas posteriores al último "inicio" de cada clave.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime
+import numpy as np
+
+CHECKPOINT_PATH = os.getenv("CARGA_CHECKPOINT_PATH", ".carga_checkpoint.jsonl")
+
+
+def huella_archivo(ruta, bloque=1024 * 1024):
+    """sha256 del contenido del archivo"""
+    sha = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for datos in iter(lambda: f.read(bloque), b""):
+            sha.update(datos)
+    return sha.hexdigest()
+
+
+class DiarioCarga:
+    """Rangos de filas confirmados de una carga; seguro entre hilos"""
+
+    def __init__(self, ruta_archivo, hoja, tabla, ruta_diario=CHECKPOINT_PATH):
+        self.ruta = ruta_diario
+        self.clave = f"{huella_archivo(ruta_archivo)}:{hoja}:{tabla}"
+        self.modo = None
+        self.completa = False
+        self.filas_confirmadas = 0
+        self._rangos = []
+        self._lock = threading.Lock()
+        self._leer()
+
+    def _leer(self):
+        if not self.ruta or not os.path.exists(self.ruta):
+            return
+        with open(self.ruta, encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    entrada = json.loads(linea)
+                except ValueError:
+                    continue  # línea cortada por una caída a mitad de escritura
+                if entrada.get("clave") != self.clave:
+                    continue
+                evento = entrada.get("evento")
+                if evento == "inicio":
+                    self.modo = entrada.get("modo")
+                    self.completa = False
+                    self.filas_confirmadas = 0
+                    self._rangos = []
+                elif evento == "lote":
+                    self._rangos.append((entrada["desde"], entrada["hasta"]))
+                    self.filas_confirmadas += entrada.get("filas", 0)
+                elif evento == "fin":
+                    self.completa = True
+        self._ordenar()
+
+    def _ordenar(self):
+        self._rangos.sort()
+        self._inicios = np.array([desde for desde, _ in self._rangos], dtype="int64")
+        self._fines = np.array([hasta for _, hasta in self._rangos], dtype="int64")
+
+    def _escribir(self, evento, **datos):
+        if not self.ruta:
+            return
+        linea = json.dumps({
+            "clave": self.clave,
+            "evento": evento,
+            "ts": datetime.now().isoformat(timespec="seconds"),
+            **datos
+        }, ensure_ascii=False)
+        with open(self.ruta, "a", encoding="utf-8") as f:
+            f.write(linea + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    @property
+    def pendiente(self):
+        """True si hay una carga anterior de este archivo sin terminar"""
+        return bool(self._rangos) and not self.completa
+
+    def iniciar(self, modo):
+        """Empieza la carga desde cero (descarta el progreso anterior de esta clave)"""
+        with self._lock:
+            self.modo = modo
+            self.completa = False
+            self.filas_confirmadas = 0
+            self._rangos = []
+            self._ordenar()
+            self._escribir("inicio", modo=modo)
+
+    def confirmar(self, desde, hasta, filas):
+        """Anota un lote confirmado por la base (filas desde..hasta del archivo)"""
+        with self._lock:
+            self._escribir("lote", desde=int(desde), hasta=int(hasta), filas=int(filas))
+
+    def terminar(self, **resumen):
+        with self._lock:
+            self.completa = True
+            self._escribir("fin", **resumen)
+
+    def pendientes(self, tramo):
+        """Filas del tramo que no están en un rango confirmado (el índice es la fila del archivo)"""
+        if not self._rangos:
+            return tramo
+        filas = tramo.index.to_numpy(dtype="int64")
+        i = np.searchsorted(self._inicios, filas, side="right") - 1
+        confirmada = (i >= 0) & (self._fines[np.maximum(i, 0)] >= filas)
+        return tramo[~confirmada]
@@ -0,0 +1,247 @@
+"""
+Ingesta por tramos para cargar_datos.py
+========================================
+Lee el Excel (openpyxl en modo solo lectura) o CSV de a N filas y limpia
+cada tramo con operaciones vectorizadas contra el esquema declarado de las
+23 columnas de la tabla. La memoria no crece con el tamaño del archivo:
+solo hay un tramo en memoria a la vez.
+
+- Números: pd.to_numeric; inf/-inf pasan a NULL.
+- Fechas: a texto ISO (YYYY-MM-DD).
+- Texto: sin espacios sobrantes; vacío = NULL.
+- Filas con valores que no se pueden convertir (ej: "abc" en Kg_Neto o una
+  fecha inválida) van al archivo de rechazados con la fila de origen y el
+  motivo, en lugar de cargarse como NULL en silencio.
+- Con un numerador (cargar_datos.NumeradorLineas) la "Linea" de cada fila
+  dentro de su DUA se asigna antes de separar las rechazadas: una fila
+  inválida no corre el número de las siguientes.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+# Esquema declarado de la tabla (mismas columnas que SupabaseClient.COLUMNS)
+ESQUEMA = {
+    "ID": "entero",
+    "DUA": "texto",
+    "Fecha": "fecha",
+    "RUC": "texto",
+    "Importador": "texto",
+    "Embarcador": "texto",
+    "Pais_origen": "texto",
+    "Descripcion": "texto",
+    "Kg_Neto": "decimal",
+    "Qty_2": "decimal",
+    "Und_2": "texto",
+    "CIF_Tot": "decimal",
+    "CIF_und": "decimal",
+    "Marca": "texto",
+    "Formulacion": "texto",
+    "Concentracion": "texto",
+    "Concent_disgregada": "texto",
+    "INGREDIENTE_nuevo": "texto",
+    "CLASE_SIGIA": "texto",
+    "TIPO": "texto",
+    "Estado": "texto",
+    "Presentacion": "texto",
+    "Via": "texto"
+}
+
+FILAS_POR_TRAMO = int(os.getenv("CARGA_FILAS_POR_TRAMO", "20000"))
+
+
+# ========== LECTURA ==========
+
+def es_csv(ruta):
+    return ruta.lower().endswith((".csv", ".txt"))
+
+
+def hojas_disponibles(ruta):
+    """Hojas del libro sin cargarlo completo (un CSV tiene una sola 'hoja')"""
+    if es_csv(ruta):
+        return [os.path.basename(ruta)]
+    from openpyxl import load_workbook
+    libro = load_workbook(ruta, read_only=True)
+    try:
+        return libro.sheetnames
+    finally:
+        libro.close()
+
+
+def leer_por_tramos(ruta, hoja=None, filas_por_tramo=FILAS_POR_TRAMO):
+    """
+    Genera DataFrames crudos de hasta filas_por_tramo filas.
+    El índice de cada tramo es el número de fila en el archivo (para los rechazados).
+    """
+    if es_csv(ruta):
+        primera_fila = 2  # la fila 1 es el encabezado
+        for tramo in pd.read_csv(ruta, dtype=str, chunksize=filas_por_tramo, encoding="utf-8-sig"):
+            tramo.index = range(primera_fila, primera_fila + len(tramo))
+            primera_fila += len(tramo)
+            yield tramo
+        return
+
+    if ruta.lower().endswith(".xls"):
+        # Formato antiguo: openpyxl no lo lee en modo streaming
+        df = pd.read_excel(ruta, sheet_name=hoja or 0, dtype=object)
+        df.index = range(2, len(df) + 2)
+        for i in range(0, len(df), filas_por_tramo):
+            yield df.iloc[i:i + filas_por_tramo]
+        return
+
+    from openpyxl import load_workbook
+    libro = load_workbook(ruta, read_only=True, data_only=True)
+    try:
+        hoja_excel = libro[hoja] if hoja else libro.worksheets[0]
+        filas = hoja_excel.iter_rows(values_only=True)
+        encabezado = next(filas, None)
+        if encabezado is None:
+            return
+        encabezado = [str(c) if c is not None else f"columna_{i}" for i, c in enumerate(encabezado, 1)]
+
+        buffer = []
+        primera_fila = 2
+        for fila in filas:
+            buffer.append(fila)
+            if len(buffer) == filas_por_tramo:
+                yield _tramo(buffer, encabezado, primera_fila)
+                primera_fila += len(buffer)
+                buffer = []
+        if buffer:
+            yield _tramo(buffer, encabezado, primera_fila)
+    finally:
+        libro.close()
+
+
+def _tramo(filas, encabezado, primera_fila):
+    tramo = pd.DataFrame.from_records(filas, columns=encabezado)
+    tramo.index = range(primera_fila, primera_fila + len(tramo))
+    return tramo
+
+
+# ========== LIMPIEZA ==========
+
+def _texto(serie):
+    texto = serie.astype("string").str.strip()
+    return texto.mask(texto == "")
+
+
+def _vacio(serie):
+    """True donde la celda está vacía (None, NaN o texto en blanco)"""
+    return _texto(serie).isna().to_numpy()
+
+
+def limpiar_tramo(crudo, numerador=None):
+    """
+    Aplica el esquema a un tramo crudo.
+    Devuelve (limpio, rechazados): rechazados tiene los valores originales más
+    las columnas "fila" (fila del archivo) y "motivo".
+    Con numerador, ambos llevan "Linea" numerada sobre todas las filas del tramo.
+    """
+    crudo = crudo.rename(columns=lambda c: str(c).strip())
+    # Filas completamente vacías (típicas al final de un Excel)
+    crudo = crudo[~crudo.isna().all(axis=1)]
+
+    limpio = pd.DataFrame(index=crudo.index)
+    motivos = pd.Series("", index=crudo.index, dtype=object)
+
+    for columna, tipo in ESQUEMA.items():
+        if columna not in crudo.columns:
+            continue
+        valores = crudo[columna]
+        vacio = _vacio(valores)
+
+        if tipo == "texto":
+            limpio[columna] = _texto(valores)
+            continue
+
+        if tipo == "fecha":
+            fechas = pd.to_datetime(valores, errors="coerce")
+            fallidas = fechas.isna().to_numpy() & ~vacio
+            if fallidas.any():
+                # Formatos mezclados en la columna (ej: "05/01/2024" entre fechas ISO)
+                fechas[fallidas] = pd.to_datetime(valores[fallidas], errors="coerce", format="mixed", dayfirst=True)
+            invalido = fechas.isna().to_numpy() & ~vacio
+            limpio[columna] = fechas.dt.strftime("%Y-%m-%d").astype("string")
+        else:
+            numeros = pd.to_numeric(valores, errors="coerce").astype("float64")
+            fallidos = numeros.isna().to_numpy() & ~vacio
+            if fallidos.any():
+                # Números guardados como texto con espacios
+                numeros[fallidos] = pd.to_numeric(_texto(valores[fallidos]), errors="coerce").to_numpy(dtype="float64", na_value=np.nan)
+            infinito = np.isinf(numeros.to_numpy())
+            numeros = numeros.mask(infinito)
+            invalido = numeros.isna().to_numpy() & ~vacio & ~infinito
+            if tipo == "entero":
+                invalido |= (numeros.notna() & (numeros % 1 != 0)).to_numpy()
+                numeros = numeros.where(numeros % 1 == 0).astype("Int64")
+            limpio[columna] = numeros
+
+        if invalido.any():
+            motivos[invalido] += f"{columna} inválido; "
+
+    if numerador is not None and "DUA" in limpio.columns:
+        limpio["Linea"] = numerador(limpio["DUA"])
+
+    rechazado = (motivos != "").to_numpy()
+    rechazados = crudo[rechazado].copy()
+    if "Linea" in limpio.columns:
+        rechazados["DUA"] = limpio.loc[rechazado, "DUA"]
+        rechazados["Linea"] = limpio.loc[rechazado, "Linea"]
+    if len(rechazados):
+        rechazados.insert(0, "motivo", motivos[rechazado].str.rstrip("; "))
+        rechazados.insert(0, "fila", rechazados.index)
+    return limpio[~rechazado], rechazados
+
+
+def columnas_desconocidas(crudo):
+    """Columnas del archivo que no están en el esquema (no se cargan)"""
+    return [c for c in (str(c).strip() for c in crudo.columns) if c not in ESQUEMA]
+
+
+class ArchivoRechazos:
+    """
+    CSV de filas rechazadas; se crea solo si hay alguna.
+    al_agregar(rechazados) se llama con cada grupo (ej: para no tratar sus
+    claves como filas que desaparecieron del archivo).
+    """
+
+    def __init__(self, ruta="registros_rechazados.csv", al_agregar=None):
+        self.ruta = ruta
+        self.total = 0
+        self.al_agregar = al_agregar
+        self._con_encabezado = False
+
+    def agregar(self, rechazados):
+        if rechazados is None or not len(rechazados):
+            return
+        if self.al_agregar is not None:
+            self.al_agregar(rechazados)
+        rechazados.to_csv(
+            self.ruta,
+            mode="a" if self._con_encabezado else "w",
+            header=not self._con_encabezado,
+            index=False,
+            encoding="utf-8-sig" if not self._con_encabezado else "utf-8"
+        )
+        self._con_encabezado = True
+        self.total += len(rechazados)
+
+
+def tramos_limpios(ruta, hoja=None, rechazos=None, filas_por_tramo=FILAS_POR_TRAMO, numerador=None):
+    """
+    Generador de tramos limpios; los rechazados se escriben en rechazos (ArchivoRechazos).
+    numerador: asigna "Linea" en orden de archivo, contando las filas rechazadas
+    """
+    avisadas = False
+    for crudo in leer_por_tramos(ruta, hoja, filas_por_tramo):
+        if not avisadas:
+            desconocidas = columnas_desconocidas(crudo)
+            if desconocidas:
+                print(f"⚠️  Columnas fuera del esquema (no se cargan): {desconocidas}")
+            avisadas = True
+        limpio, rechazados = limpiar_tramo(crudo, numerador)
+        if rechazos is not None:
+            rechazos.agregar(rechazados)
+        if len(limpio):
+            yield limpio
@@ -123,6 +123,26 @@ def init_db():
 
 db = init_db()
 
+def get_chatbot_v4(provider):
+    """
+    Registro de chatbots por sesión: se reutiliza la instancia (cliente ya
+    configurado + conversation_history) en lugar de crearla en cada mensaje
+    """
+    if "bots_v4" not in st.session_state:
+        st.session_state.bots_v4 = {}
+    if provider not in st.session_state.bots_v4:
+        st.session_state.bots_v4[provider] = ImportacionesChatbot(db, provider=provider)
+    return st.session_state.bots_v4[provider]
+
+def render_timings(timings):
+    """Desglose de tiempos del turno (spans de utils/tracing.py)"""
+    if not timings:
+        return
+    totals = timings["totals"]
+    tokens = totals["prompt_tokens"] + totals["completion_tokens"]
+    with st.expander(f"⏱️ {timings['duration_ms'] / 1000:.2f} s · {totals['rows']:,} filas · {tokens:,} tokens"):
+        st.dataframe(timings["spans"], hide_index=True, use_container_width=True)
+
 # ========== SIDEBAR: CHATBOT ==========
 with st.sidebar:
     # Título y firma (sin espacio extra)
@@ -147,6 +167,8 @@ with st.sidebar:
     elif "DeepSeek" in model_option: provider = "deepseek"
     else: provider = "openai"
     
+    show_timings = st.toggle("⏱️ Mostrar tiempos", value=False)
+    
     st.markdown("---")
     
     # ====== INPUT DE CHAT (siempre visible) ======
@@ -156,6 +178,7 @@ with st.sidebar:
     if st.button("🗑️ Limpiar conversación", use_container_width=True, type="secondary"):
         st.session_state.chat_v4 = []
         st.session_state.chat_v5 = []
+        st.session_state.bots_v4 = {}
         st.rerun()
     
     st.markdown("---")
@@ -182,19 +205,20 @@ with st.sidebar:
             for msg in current_chat:
                 with st.chat_message(msg["role"]):
                     st.markdown(msg["content"])
+                    if show_timings:
+                        render_timings(msg.get("timings"))
     
     # ====== PROCESAMIENTO DEL PROMPT ======
     if prompt:
         # Añadir mensaje del usuario
         current_chat.append({"role": "user", "content": prompt})
         
-        # Procesar respuesta
+        # Procesar respuesta (se muestra a medida que llegan los tokens)
         try:
-            response = ""
             if chat_mode == "💬 Chat v4.0 (Rápido)":
-                bot = ImportacionesChatbot(db, provider=provider)
-                with st.spinner("🔍 Analizando..."):
-                    response = bot.chat(prompt)
+                bot = get_chatbot_v4(provider)
+                events = bot.chat_stream(prompt)
+                initial_status = "🔍 Analizando..."
             else:
                 # Chat v5.0 - SQL Agent
                 try:
@@ -202,17 +226,43 @@ with st.sidebar:
                 except ImportError:
                     from langchain_chatbot import LangChainChatbot
                 
-                with st.spinner("🧠 Ejecutando consulta SQL..."):
-                    agent = LangChainChatbot(provider=provider)
-                    response = agent.chat(prompt)
+                bot = LangChainChatbot.for_provider(provider)
+                events = bot.chat_stream(prompt)
+                initial_status = "🧠 Ejecutando consulta SQL..."
+            
+            with chat_container:
+                with st.chat_message("user"):
+                    st.markdown(prompt)
+                with st.chat_message("assistant"):
+                    status_placeholder = st.empty()
+                    response_placeholder = st.empty()
+                    status_placeholder.caption(initial_status)
                     
-                    # Limpiar respuesta verbose
-                    if "Thought:" in response:
-                        if "Final Answer:" in response:
-                            response = response.split("Final Answer:")[-1].strip()
+                    response = ""
+                    trace = None
+                    for event in events:
+                        if event["type"] == "status":
+                            status_placeholder.caption(event["content"])
+                        elif event["type"] == "trace":
+                            trace = event["content"]
+                        else:
+                            response += event["content"]
+                            response_placeholder.markdown(response + "▌")
+                    status_placeholder.empty()
+            
+            # Limpiar respuesta verbose
+            if "Thought:" in response and "Final Answer:" in response:
+                response = response.split("Final Answer:")[-1].strip()
             
-            # Añadir respuesta del asistente
-            current_chat.append({"role": "assistant", "content": response})
+            # Añadir respuesta del asistente (con la traza del turno si existe)
+            timings = None
+            if trace is not None:
+                timings = {
+                    "duration_ms": trace.root.duration_ms or 0,
+                    "totals": trace.totals(),
+                    "spans": trace.breakdown()
+                }
+            current_chat.append({"role": "assistant", "content": response, "timings": timings})
             
             # Rerun para actualizar
             st.rerun()
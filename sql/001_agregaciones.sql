@@ -0,0 +1,183 @@
+-- ============================================================
+-- Funciones de agregación en el servidor (pushdown)
+-- Usadas por utils/aggregations.py vía client.rpc(...)
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- ============================================================
+
+-- Valida nombres de columna/función para el SQL dinámico
+CREATE OR REPLACE FUNCTION fn_validar_agregacion(
+    p_table text,
+    p_columns text[],
+    p_agg_function text
+) RETURNS void
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    col text;
+BEGIN
+    IF p_agg_function NOT IN ('sum', 'mean', 'count', 'min', 'max') THEN
+        RAISE EXCEPTION 'Función de agregación no soportada: %', p_agg_function;
+    END IF;
+    FOREACH col IN ARRAY p_columns LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM information_schema.columns
+            WHERE table_name = p_table AND column_name = col
+        ) THEN
+            RAISE EXCEPTION 'Columna inexistente en %: %', p_table, col;
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- Expresión SQL equivalente a la agregación de pandas
+CREATE OR REPLACE FUNCTION fn_expresion_agregacion(p_agg_column text, p_agg_function text)
+RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE p_agg_function
+        WHEN 'sum'   THEN format('COALESCE(SUM(%I), 0)::float8', p_agg_column)
+        WHEN 'mean'  THEN format('AVG(%I)::float8', p_agg_column)
+        WHEN 'count' THEN format('COUNT(%I)::float8', p_agg_column)
+        WHEN 'min'   THEN format('MIN(%I)::float8', p_agg_column)
+        WHEN 'max'   THEN format('MAX(%I)::float8', p_agg_column)
+    END;
+$$;
+
+-- GROUP BY genérico, opcionalmente filtrado por año y limitado a top N
+-- (get_aggregated_by_year, get_top_n_global, comparar_periodos)
+CREATE OR REPLACE FUNCTION fn_agregar_por_grupo(
+    p_table text,
+    p_group_column text,
+    p_agg_column text DEFAULT 'Kg_Neto',
+    p_agg_function text DEFAULT 'sum',
+    p_year int DEFAULT NULL,
+    p_limit int DEFAULT NULL
+) RETURNS TABLE (grupo text, valor float8)
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    sql text;
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_group_column, p_agg_column], p_agg_function);
+
+    sql := format(
+        'SELECT %I::text AS grupo, %s AS valor FROM %I WHERE %I IS NOT NULL',
+        p_group_column, fn_expresion_agregacion(p_agg_column, p_agg_function), p_table, p_group_column
+    );
+    IF p_year IS NOT NULL THEN
+        sql := sql || format(
+            ' AND "Fecha" >= make_date(%s, 1, 1) AND "Fecha" <= make_date(%s, 12, 31)',
+            p_year, p_year
+        );
+    END IF;
+    sql := sql || ' GROUP BY 1';
+    IF p_limit IS NOT NULL THEN
+        sql := sql || format(' ORDER BY valor DESC NULLS LAST LIMIT %s', p_limit);
+    END IF;
+
+    RETURN QUERY EXECUTE sql;
+END;
+$$;
+
+-- Serie anual de una entidad (get_time_series_by_entity)
+CREATE OR REPLACE FUNCTION fn_serie_temporal_entidad(
+    p_table text,
+    p_filter_column text,
+    p_filter_value text,
+    p_agg_column text DEFAULT 'Kg_Neto',
+    p_agg_function text DEFAULT 'sum'
+) RETURNS TABLE (anio int, valor float8)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_filter_column, p_agg_column], p_agg_function);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT EXTRACT(YEAR FROM "Fecha")::int AS anio, %s AS valor
+           FROM %I
+          WHERE %I::text ILIKE $1 AND "Fecha" IS NOT NULL
+          GROUP BY 1
+          ORDER BY 1',
+        fn_expresion_agregacion(p_agg_column, p_agg_function), p_table, p_filter_column
+    ) USING '%' || p_filter_value || '%';
+END;
+$$;
+
+-- Resumen de un año (get_summary_stats_by_year)
+CREATE OR REPLACE FUNCTION fn_resumen_anio(p_table text, p_year int)
+RETURNS TABLE (
+    total_importaciones bigint,
+    total_kg float8,
+    total_cif float8,
+    promedio_cif float8,
+    importadores_unicos bigint,
+    paises_unicos bigint
+)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    RETURN QUERY EXECUTE format(
+        'SELECT COUNT(*),
+                COALESCE(SUM("Kg_Neto"), 0)::float8,
+                COALESCE(SUM("CIF_Tot"), 0)::float8,
+                COALESCE(AVG("CIF_Tot"), 0)::float8,
+                COUNT(DISTINCT "Importador"),
+                COUNT(DISTINCT "Pais_origen")
+           FROM %I
+          WHERE "Fecha" >= make_date($1, 1, 1) AND "Fecha" <= make_date($1, 12, 31)',
+        p_table
+    ) USING p_year;
+END;
+$$;
+
+-- Total histórico de una entidad (get_entity_total_historico)
+CREATE OR REPLACE FUNCTION fn_total_entidad(
+    p_table text,
+    p_filter_column text,
+    p_filter_value text,
+    p_agg_column text DEFAULT 'Kg_Neto',
+    p_agg_function text DEFAULT 'sum'
+) RETURNS TABLE (
+    total float8,
+    registros bigint,
+    promedio float8,
+    minimo float8,
+    maximo float8,
+    anio_inicio int,
+    anio_fin int
+)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_filter_column, p_agg_column], p_agg_function);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT CASE WHEN $2 = ''count'' THEN COUNT(*)::float8 ELSE %s END,
+                COUNT(*),
+                AVG(%I)::float8,
+                MIN(%I)::float8,
+                MAX(%I)::float8,
+                EXTRACT(YEAR FROM MIN("Fecha"))::int,
+                EXTRACT(YEAR FROM MAX("Fecha"))::int
+           FROM %I
+          WHERE %I::text ILIKE $1',
+        fn_expresion_agregacion(p_agg_column, p_agg_function),
+        p_agg_column, p_agg_column, p_agg_column, p_table, p_filter_column
+    ) USING '%' || p_filter_value || '%', p_agg_function;
+END;
+$$;
+
+-- Marcas que aparecen por primera vez en un año (get_new_brands_count)
+CREATE OR REPLACE FUNCTION fn_marcas_nuevas(p_table text, p_year int)
+RETURNS bigint
+LANGUAGE plpgsql STABLE AS $$
+DECLARE
+    resultado bigint;
+BEGIN
+    EXECUTE format(
+        'SELECT COUNT(*) FROM (
+             SELECT "Marca" FROM %I
+              WHERE "Marca" IS NOT NULL AND "Marca" <> ''''
+              GROUP BY "Marca"
+             HAVING MIN("Fecha") >= make_date($1, 1, 1)
+                AND MIN("Fecha") <= make_date($1, 12, 31)
+         ) nuevas',
+        p_table
+    ) INTO resultado USING p_year;
+    RETURN resultado;
+END;
+$$;
@@ -0,0 +1,88 @@
+-- ============================================================
+-- Cubo de agregados año × mes × dimensión
+-- Lo consume utils/cube.py cuando el snapshot local está desactivado.
+-- cargar_datos.py llama a fn_refrescar_cubo() al terminar cada carga.
+-- La vista lee "BD_Import_IQ": si TABLE_NAME es otra tabla, reemplaza el
+-- nombre en todo el script antes de ejecutar (el cubo no recibe la tabla
+-- como parámetro, a diferencia de las funciones de sql/001_agregaciones.sql).
+-- fn_cubo_tabla_origen() lo informa: utils/cube.py no usa la vista si no
+-- coincide con TABLE_NAME.
+-- ============================================================
+
+DROP MATERIALIZED VIEW IF EXISTS mv_cubo_importaciones;
+
+CREATE MATERIALIZED VIEW mv_cubo_importaciones AS
+SELECT
+    ROW_NUMBER() OVER () AS "ID",
+    c.*
+FROM (
+    SELECT
+        CASE
+            WHEN GROUPING("Marca") = 0 THEN 'Marca'
+            WHEN GROUPING("Importador") = 0 THEN 'Importador'
+            WHEN GROUPING("Pais_origen") = 0 THEN 'Pais_origen'
+            WHEN GROUPING("INGREDIENTE_nuevo") = 0 THEN 'INGREDIENTE_nuevo'
+            ELSE '_total'
+        END AS dimension,
+        COALESCE("Marca", "Importador", "Pais_origen", "INGREDIENTE_nuevo", '')::text AS valor,
+        EXTRACT(YEAR FROM "Fecha")::int AS anio,
+        EXTRACT(MONTH FROM "Fecha")::int AS mes,
+        COUNT(*) AS registros,
+        COALESCE(SUM("Kg_Neto"), 0)::float8 AS kg_sum,
+        COUNT("Kg_Neto") AS kg_count,
+        MIN("Kg_Neto")::float8 AS kg_min,
+        MAX("Kg_Neto")::float8 AS kg_max,
+        COALESCE(SUM("CIF_Tot"), 0)::float8 AS cif_sum,
+        COUNT("CIF_Tot") AS cif_count,
+        MIN("CIF_Tot")::float8 AS cif_min,
+        MAX("CIF_Tot")::float8 AS cif_max
+    FROM "BD_Import_IQ"
+    GROUP BY GROUPING SETS (
+        (EXTRACT(YEAR FROM "Fecha"), EXTRACT(MONTH FROM "Fecha"), "Marca"),
+        (EXTRACT(YEAR FROM "Fecha"), EXTRACT(MONTH FROM "Fecha"), "Importador"),
+        (EXTRACT(YEAR FROM "Fecha"), EXTRACT(MONTH FROM "Fecha"), "Pais_origen"),
+        (EXTRACT(YEAR FROM "Fecha"), EXTRACT(MONTH FROM "Fecha"), "INGREDIENTE_nuevo"),
+        (EXTRACT(YEAR FROM "Fecha"), EXTRACT(MONTH FROM "Fecha"))
+    )
+    -- Igual que pandas: los valores NULL de una dimensión no forman grupo
+    HAVING NOT (
+        (GROUPING("Marca") = 0 AND "Marca" IS NULL)
+        OR (GROUPING("Importador") = 0 AND "Importador" IS NULL)
+        OR (GROUPING("Pais_origen") = 0 AND "Pais_origen" IS NULL)
+        OR (GROUPING("INGREDIENTE_nuevo") = 0 AND "INGREDIENTE_nuevo" IS NULL)
+    )
+) c;
+
+-- Tabla de la que sale la vista (la compara utils/cube.py con TABLE_NAME)
+CREATE OR REPLACE FUNCTION fn_cubo_tabla_origen()
+RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT 'BD_Import_IQ'::text;
+$$;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mv_cubo_importaciones_id ON mv_cubo_importaciones ("ID");
+CREATE INDEX IF NOT EXISTS mv_cubo_importaciones_dim ON mv_cubo_importaciones (dimension, anio);
+
+-- Refresco tras cada carga y tras las escrituras del chatbot (se llama vía client.rpc).
+-- Con sql/006_version_datos.sql anota en version_datos la versión de la tabla
+-- con la que se refrescó: utils/cube.py no usa la vista si no coincide con la
+-- versión actual. Se copia antes del REFRESH: una escritura concurrente deja
+-- la vista marcada como desactualizada, nunca al revés.
+CREATE OR REPLACE FUNCTION fn_refrescar_cubo()
+RETURNS void
+LANGUAGE plpgsql SECURITY DEFINER
+SET search_path = public, pg_temp AS $$
+BEGIN
+    IF to_regclass('public.version_datos') IS NOT NULL THEN
+        INSERT INTO version_datos (tabla, version, reescrituras)
+        SELECT 'mv_cubo_importaciones', version, reescrituras
+          FROM version_datos
+         WHERE tabla = 'BD_Import_IQ'
+        ON CONFLICT (tabla) DO UPDATE
+            SET version = EXCLUDED.version,
+                reescrituras = EXCLUDED.reescrituras,
+                actualizado = now();
+    END IF;
+    REFRESH MATERIALIZED VIEW mv_cubo_importaciones;
+END;
+$$;
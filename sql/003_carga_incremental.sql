@@ -0,0 +1,27 @@
+-- ============================================================
+-- Carga incremental (Complemento/cargar_datos.py, modo incremental)
+-- Cada fila se identifica por "DUA" + "Linea" (n° de línea dentro de la
+-- DUA) y guarda row_hash, el hash de su contenido calculado por el loader.
+-- Solo se envían las filas nuevas o con hash distinto (upsert).
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- ============================================================
+
+ALTER TABLE "BD_Import_IQ" ADD COLUMN IF NOT EXISTS "Linea" integer;
+ALTER TABLE "BD_Import_IQ" ADD COLUMN IF NOT EXISTS row_hash text;
+
+-- Líneas de las filas ya cargadas: orden de llegada dentro de cada DUA
+-- (el mismo orden del Excel, que es como el loader numera las líneas)
+UPDATE "BD_Import_IQ" t
+SET "Linea" = n.linea
+FROM (
+    SELECT "ID", ROW_NUMBER() OVER (PARTITION BY "DUA" ORDER BY "ID")::int AS linea
+    FROM "BD_Import_IQ"
+) n
+WHERE t."ID" = n."ID" AND t."Linea" IS NULL;
+
+-- Clave del upsert (on_conflict = "DUA,Linea")
+CREATE UNIQUE INDEX IF NOT EXISTS ux_bd_import_iq_dua_linea
+    ON "BD_Import_IQ" ("DUA", "Linea");
+
+-- Las filas sin row_hash (cargadas antes de esta migración) se reenvían una
+-- sola vez en la primera carga incremental y desde ahí quedan con su hash.
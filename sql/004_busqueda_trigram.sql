@@ -0,0 +1,105 @@
+-- ============================================================
+-- Búsqueda difusa con pg_trgm
+-- Usada por utils/search.py vía client.rpc(...) para search_importaciones
+-- y para reescribir los valores de entidad (Marca, Importador...) que no
+-- aparecen tal cual en la tabla (ej: "BAYR" -> "BAYER S.A.").
+-- Los índices GIN también aceleran los ILIKE '%valor%' existentes
+-- (fn_serie_temporal_entidad, fn_total_entidad y los filtros de PostgREST).
+-- Requiere sql/001_agregaciones.sql (fn_validar_agregacion).
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- ============================================================
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_marca_trgm
+    ON "BD_Import_IQ" USING gin ("Marca" gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_importador_trgm
+    ON "BD_Import_IQ" USING gin ("Importador" gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_descripcion_trgm
+    ON "BD_Import_IQ" USING gin ("Descripcion" gin_trgm_ops);
+
+-- Relevancia de una columna para un valor buscado:
+-- igual (sin mayúsculas) = 2, lo contiene = 1, más la similitud por palabras (0..1)
+CREATE OR REPLACE FUNCTION fn_expresion_relevancia(p_column text, p_value text)
+RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT format(
+        '(CASE WHEN lower(%1$I) = lower(%2$L) THEN 2 WHEN %1$I ILIKE %3$L THEN 1 ELSE 0 END
+          + COALESCE(word_similarity(%2$L, %1$I), 0))',
+        p_column, p_value, '%' || p_value || '%'
+    );
+$$;
+
+-- Condición que puede usar el índice GIN: contiene el valor o se le parece
+CREATE OR REPLACE FUNCTION fn_condicion_difusa(p_column text, p_value text)
+RETURNS text
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT format('(%1$I ILIKE %3$L OR %2$L <%% %1$I)', p_column, p_value, '%' || p_value || '%');
+$$;
+
+-- Valores distintos de una columna que contienen o se parecen a p_value,
+-- primero los que lo contienen y luego por similitud (resolución de entidades)
+CREATE OR REPLACE FUNCTION fn_buscar_valores(
+    p_table text,
+    p_column text,
+    p_value text,
+    p_limit int DEFAULT 5,
+    p_umbral real DEFAULT 0.5
+) RETURNS TABLE (valor text, similitud float8, contiene boolean)
+LANGUAGE plpgsql AS $$
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_column], 'count');
+    PERFORM set_config('pg_trgm.word_similarity_threshold', p_umbral::text, true);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT v, similarity(v, $1)::float8, v ILIKE ''%%'' || $1 || ''%%''
+           FROM (SELECT DISTINCT %I AS v FROM %I WHERE %s) d
+          ORDER BY 3 DESC, word_similarity($1, v) DESC, 2 DESC
+          LIMIT $2',
+        p_column, p_table, fn_condicion_difusa(p_column, p_value)
+    ) USING p_value, p_limit;
+END;
+$$;
+
+-- Filas que cumplen todos los filtros {columna: valor} (contienen o se
+-- parecen a cada valor), ordenadas por relevancia total descendente.
+-- p_columns limita las columnas devueltas (NULL = todas).
+CREATE OR REPLACE FUNCTION fn_buscar_importaciones(
+    p_table text,
+    p_filtros jsonb,
+    p_columns text[] DEFAULT NULL,
+    p_limit int DEFAULT 50,
+    p_umbral real DEFAULT 0.5
+) RETURNS SETOF jsonb
+LANGUAGE plpgsql AS $$
+DECLARE
+    filtro record;
+    condiciones text[] := ARRAY[]::text[];
+    relevancia text[] := ARRAY[]::text[];
+BEGIN
+    FOR filtro IN SELECT key, value FROM jsonb_each_text(p_filtros) WHERE value <> '' LOOP
+        PERFORM fn_validar_agregacion(p_table, ARRAY[filtro.key], 'count');
+        condiciones := condiciones || fn_condicion_difusa(filtro.key, filtro.value);
+        relevancia := relevancia || fn_expresion_relevancia(filtro.key, filtro.value);
+    END LOOP;
+    IF p_columns IS NOT NULL THEN
+        PERFORM fn_validar_agregacion(p_table, p_columns, 'count');
+    END IF;
+    PERFORM set_config('pg_trgm.word_similarity_threshold', p_umbral::text, true);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT CASE WHEN $1 IS NULL THEN fila
+                     ELSE (SELECT jsonb_object_agg(k, v) FROM jsonb_each(fila) AS e(k, v) WHERE k = ANY($1))
+                END || jsonb_build_object(''relevancia'', round(puntaje::numeric, 3))
+           FROM (SELECT to_jsonb(t) AS fila, %s AS puntaje
+                   FROM %I t
+                  WHERE %s
+                  ORDER BY 2 DESC
+                  LIMIT $2) r
+          ORDER BY puntaje DESC',
+        COALESCE(NULLIF(array_to_string(relevancia, ' + '), ''), '0'),
+        p_table,
+        COALESCE(NULLIF(array_to_string(condiciones, ' AND '), ''), 'true')
+    ) USING p_columns, p_limit;
+END;
+$$;
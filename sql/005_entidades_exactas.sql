@@ -0,0 +1,74 @@
+-- ============================================================
+-- Agregaciones por valor exacto de una entidad
+-- Variantes de fn_serie_temporal_entidad y fn_total_entidad que filtran
+-- por igualdad (WHERE columna = valor) en lugar de ILIKE '%valor%'.
+-- Las usa utils/aggregations.py cuando el chatbot ya resolvió el valor
+-- canónico con el diccionario de entidades (utils/entities.py).
+-- Requiere sql/001_agregaciones.sql.
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- ============================================================
+
+-- Igualdad indexable en las columnas de entidad
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_marca ON "BD_Import_IQ" ("Marca");
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_importador ON "BD_Import_IQ" ("Importador");
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_pais_origen ON "BD_Import_IQ" ("Pais_origen");
+CREATE INDEX IF NOT EXISTS ix_bd_import_iq_ingrediente ON "BD_Import_IQ" ("INGREDIENTE_nuevo");
+
+-- Serie anual de un valor exacto (get_time_series_by_entity con exact=True)
+CREATE OR REPLACE FUNCTION fn_serie_temporal_valor(
+    p_table text,
+    p_filter_column text,
+    p_filter_value text,
+    p_agg_column text DEFAULT 'Kg_Neto',
+    p_agg_function text DEFAULT 'sum'
+) RETURNS TABLE (anio int, valor float8)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_filter_column, p_agg_column], p_agg_function);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT EXTRACT(YEAR FROM "Fecha")::int AS anio, %s AS valor
+           FROM %I
+          WHERE %I = $1 AND "Fecha" IS NOT NULL
+          GROUP BY 1
+          ORDER BY 1',
+        fn_expresion_agregacion(p_agg_column, p_agg_function), p_table, p_filter_column
+    ) USING p_filter_value;
+END;
+$$;
+
+-- Total histórico de un valor exacto (get_entity_total_historico con exact=True)
+CREATE OR REPLACE FUNCTION fn_total_valor(
+    p_table text,
+    p_filter_column text,
+    p_filter_value text,
+    p_agg_column text DEFAULT 'Kg_Neto',
+    p_agg_function text DEFAULT 'sum'
+) RETURNS TABLE (
+    total float8,
+    registros bigint,
+    promedio float8,
+    minimo float8,
+    maximo float8,
+    anio_inicio int,
+    anio_fin int
+)
+LANGUAGE plpgsql STABLE AS $$
+BEGIN
+    PERFORM fn_validar_agregacion(p_table, ARRAY[p_filter_column, p_agg_column], p_agg_function);
+
+    RETURN QUERY EXECUTE format(
+        'SELECT CASE WHEN $2 = ''count'' THEN COUNT(*)::float8 ELSE %s END,
+                COUNT(*),
+                AVG(%I)::float8,
+                MIN(%I)::float8,
+                MAX(%I)::float8,
+                EXTRACT(YEAR FROM MIN("Fecha"))::int,
+                EXTRACT(YEAR FROM MAX("Fecha"))::int
+           FROM %I
+          WHERE %I = $1',
+        fn_expresion_agregacion(p_agg_column, p_agg_function),
+        p_agg_column, p_agg_column, p_agg_column, p_table, p_filter_column
+    ) USING p_filter_value, p_agg_function;
+END;
+$$;
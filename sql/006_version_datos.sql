@@ -0,0 +1,48 @@
+-- ============================================================
+-- Versión de los datos
+-- Contador por tabla que sube con cada INSERT, UPDATE, DELETE o TRUNCATE
+-- (trigger por sentencia). Es el token de versión de la caché de
+-- respuestas, de la caché de SQL del agente y del snapshot local: a
+-- diferencia de conteo + ID máximo, también cambia con los UPDATE en el
+-- lugar y con los upserts de la carga incremental (cargar_datos.py).
+-- reescrituras cuenta solo UPDATE, DELETE y TRUNCATE (un upsert con
+-- ON CONFLICT DO UPDATE dispara también el trigger de UPDATE): mientras no
+-- cambie, el snapshot se pone al día trayendo solo los ID nuevos.
+-- Sin esta tabla los clientes usan conteo + ID máximo.
+-- Ejecutar una vez en el SQL Editor de Supabase.
+-- ============================================================
+
+CREATE TABLE IF NOT EXISTS version_datos (
+    tabla text PRIMARY KEY,
+    version bigint NOT NULL DEFAULT 0,
+    reescrituras bigint NOT NULL DEFAULT 0,
+    actualizado timestamptz NOT NULL DEFAULT now()
+);
+
+GRANT SELECT ON version_datos TO anon, authenticated;
+
+-- SECURITY DEFINER: el trigger corre con los permisos de quien escribe en la
+-- tabla (anon con SUPABASE_KEY), que solo puede leer version_datos.
+-- search_path fijo para que nadie pueda colar otra tabla version_datos.
+CREATE OR REPLACE FUNCTION fn_incrementar_version_datos()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public, pg_temp AS $$
+BEGIN
+    INSERT INTO public.version_datos (tabla, version, reescrituras)
+    VALUES (TG_TABLE_NAME, 1, CASE WHEN TG_OP = 'INSERT' THEN 0 ELSE 1 END)
+    ON CONFLICT (tabla) DO UPDATE
+        SET version = version_datos.version + 1,
+            reescrituras = version_datos.reescrituras + EXCLUDED.reescrituras,
+            actualizado = now();
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS tr_version_datos ON "BD_Import_IQ";
+CREATE TRIGGER tr_version_datos
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON "BD_Import_IQ"
+    FOR EACH STATEMENT EXECUTE FUNCTION fn_incrementar_version_datos();
+
+INSERT INTO version_datos (tabla) VALUES ('BD_Import_IQ') ON CONFLICT (tabla) DO NOTHING;
@@ -0,0 +1,15 @@
+"""
+Configuración común de pytest
+Los scripts de Complemento/ se importan entre sí sin paquete
+(from ingesta import ...), así que esa carpeta va al sys.path.
+"""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "Complemento"))
+
+# Los clientes leen estas variables al crearse; ningún test llega a la red
+os.environ.setdefault("SUPABASE_URL", "http://localhost")
+os.environ.setdefault("SUPABASE_KEY", "test")
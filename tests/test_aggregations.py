@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+
+from utils.aggregations import AggregationPushdown
+
+
+class _Rpc:
+    """Función RPC simulada con max-rows como PostgREST"""
+
+    def __init__(self, servidor, count):
+        self.servidor = servidor
+        self.count = count
+        self.desc = False
+        self.offset = 0
+        self.limit = None
+
+    def order(self, columna, desc=False):
+        self.columna, self.desc = columna, desc
+        return self
+
+    def range(self, desde, hasta):
+        self.offset, self.limit = desde, hasta - desde + 1
+        return self
+
+    def execute(self):
+        self.servidor.requests += 1
+        filas = sorted(self.servidor.filas, key=lambda f: f[self.columna], reverse=self.desc)
+        limite = min(self.limit or self.servidor.max_rows, self.servidor.max_rows)
+        pagina = filas[self.offset:self.offset + limite]
+        return SimpleNamespace(data=pagina, count=len(filas) if self.count else None)
+
+
+class _Servidor:
+    def __init__(self, n, max_rows):
+        self.filas = [{"grupo": f"MARCA{i:05d}", "valor": float(i)} for i in range(n)]
+        self.max_rows = max_rows
+        self.requests = 0
+
+    def rpc(self, nombre, params, count=None):
+        return _Rpc(self, count)
+
+
+def test_group_by_sin_limit_trae_todas_las_paginas():
+    servidor = _Servidor(2500, max_rows=1000)
+    resultado = AggregationPushdown(servidor, "BD_Import_IQ", page_size=1000).group_by("Marca", year=2024)
+
+    assert len(resultado) == 2500
+    assert resultado.sum() == sum(range(2500))
+    assert servidor.requests == 3
+
+
+def test_group_by_con_servidor_que_recorta_bajo_page_size():
+    servidor = _Servidor(2500, max_rows=400)
+    resultado = AggregationPushdown(servidor, "BD_Import_IQ", page_size=1000).group_by("Marca")
+
+    assert len(resultado) == 2500
+
+
+def test_top_n_ordenado_descendente():
+    servidor = _Servidor(50, max_rows=1000)
+    resultado = AggregationPushdown(servidor, "BD_Import_IQ").group_by("Marca", limit=50)
+
+    assert list(resultado)[:3] == [49.0, 48.0, 47.0]
@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+from utils.answer_cache import AnswerCache, DataVersion
+from utils.supabase_client import SupabaseClient
+
+
+def test_data_version_respeta_ttl_e_invalidate():
+    valores = iter(["v1", "v2", "v3"])
+    version = DataVersion(lambda: next(valores), ttl=3600)
+
+    assert version.get() == "v1"
+    assert version.get() == "v1"
+    version.invalidate()
+    assert version.get() == "v2"
+
+
+def test_data_version_none_si_falla():
+    def falla():
+        raise RuntimeError("sin red")
+
+    assert DataVersion(falla).get() is None
+
+
+def test_respuesta_se_descarta_al_cambiar_la_version():
+    cache = AnswerCache()
+    cache.set("top 10 marcas 2024", "groq", "v1", "respuesta")
+
+    assert cache.get("top 10 marcas 2024", "groq", "v1") == "respuesta"
+    assert cache.get("top 10 marcas 2024", "groq", "v2") is None
+    assert cache.get("top 10 marcas 2024", "groq", "v1") is None
+
+
+def test_sin_version_no_se_cachea():
+    cache = AnswerCache()
+    cache.set("top 10 marcas 2024", "groq", None, "respuesta")
+
+    assert cache.get("top 10 marcas 2024", "groq", None) is None
+    assert cache.stats()["size"] == 0
+
+
+class _Query:
+    def __init__(self, resultado):
+        self.resultado = resultado
+
+    def __getattr__(self, nombre):
+        return lambda *args, **kwargs: self
+
+    def execute(self):
+        if isinstance(self.resultado, Exception):
+            raise self.resultado
+        return self.resultado
+
+
+def _cliente(version_datos):
+    db = SupabaseClient.__new__(SupabaseClient)
+    db.table_name = "BD_Import_IQ"
+    db._version_table = True
+    tablas = {
+        "version_datos": version_datos,
+        "BD_Import_IQ": SimpleNamespace(data=[{"ID": 9}], count=5),
+    }
+    db.client = SimpleNamespace(table=lambda nombre: _Query(tablas[nombre]))
+    return db
+
+
+def test_version_desde_version_datos():
+    db = _cliente(SimpleNamespace(data=[{"version": 42, "reescrituras": 3}]))
+
+    assert db._fetch_data_version() == "v42:3"
+
+
+def test_sin_version_datos_usa_conteo_e_id_maximo():
+    db = _cliente(Exception("relation version_datos does not exist"))
+
+    assert db._fetch_data_version() == "5:9"
+    assert db._version_table is False
+
+
+def test_casi_duplicado_con_otra_redaccion():
+    cache = AnswerCache()
+    cache.set("¿Cuál es el total histórico de CIF de la marca Mixhor?", "groq", "v1", "respuesta")
+
+    assert cache.get("dame el total histórico del CIF para la marca Mixhor", "groq", "v1") == "respuesta"
+
+
+def test_casi_duplicado_no_cambia_de_entidad_ni_de_metrica():
+    cache = AnswerCache()
+    base = "cuales fueron los principales importadores de la marca {} en el periodo historico completo por {}"
+    cache.set(base.format("mixhor", "kg"), "groq", "v1", "respuesta mixhor")
+
+    assert cache.get(base.format("bayer", "kg"), "groq", "v1") is None
+    assert cache.get(base.format("mixhor", "cif"), "groq", "v1") is None
+    assert cache.get(base.format("mixhor", "kg"), "groq", "v1") == "respuesta mixhor"
+
+
+def test_casi_duplicado_no_cambia_de_dimension():
+    cache = AnswerCache()
+    base = "cuales son las top 10 {} con mayor volumen importado durante todo el periodo historico registrado"
+    cache.set(base.format("marcas"), "groq", "v1", "respuesta marcas")
+
+    assert cache.get(base.format("importadores"), "groq", "v1") is None
+    assert cache.get(base.format("paises"), "groq", "v1") is None
+    assert cache.get(base.format("marca"), "groq", "v1") == "respuesta marcas"
+
+
+def test_sinonimos_de_dimension_coinciden():
+    cache = AnswerCache()
+    base = "cuales son los top 10 {} con mayor volumen importado durante todo el periodo historico registrado"
+    cache.set(base.format("importadores"), "groq", "v1", "respuesta importadores")
+
+    assert cache.get(base.format("empresas"), "groq", "v1") == "respuesta importadores"
+
+
+def test_casi_duplicado_no_cambia_de_anio():
+    cache = AnswerCache()
+    cache.set("top 10 marcas 2024", "groq", "v1", "respuesta 2024")
+
+    assert cache.get("top 10 marcas del año 2023", "groq", "v1") is None
+
+
+def test_preguntas_que_remiten_al_historial_no_se_cachean():
+    cache = AnswerCache()
+    cache.set("total historico de esa marca", "groq", "v1", "respuesta")
+
+    assert cache.stats()["size"] == 0
+    assert cache.get("total historico de esa marca", "groq", "v1") is None
@@ -0,0 +1,115 @@
+import asyncio
+import threading
+
+import pandas as pd
+
+import utils.async_supabase_client as async_module
+from utils.async_supabase_client import AsyncSupabaseClient
+from utils.supabase_client import SupabaseClient
+
+
+class _Sync:
+    """SupabaseClient simulado: anota los filtros con que se piden las filas"""
+
+    table_name = "BD_Import_IQ"
+    page_size = 1000
+    result_cache = None
+    _entity_filters = staticmethod(SupabaseClient._entity_filters)
+    _year_filters = staticmethod(SupabaseClient._year_filters)
+    _compare_grouped = staticmethod(SupabaseClient._compare_grouped)
+    _year_comparison = staticmethod(SupabaseClient._year_comparison)
+
+    def __init__(self, snapshot=None):
+        self.snapshot = snapshot
+        self.pedidos = []
+
+    def _collect_records(self, filters=None, columns=None):
+        self.pedidos.append(("snapshot", filters))
+        return [{"ID": 1}]
+
+    def _resolve_entity(self, filter_column, filter_value):
+        return "BAYER S.A." if filter_value == "bayr" else filter_value
+
+
+def _cliente(snapshot=None):
+    db = AsyncSupabaseClient(_Sync(snapshot))
+
+    async def fetch_importaciones(filters=None, columns=None, page_size=None):
+        db.sync.pedidos.append(("remoto", filters))
+        return [{"ID": 2}]
+
+    db.fetch_importaciones = fetch_importaciones
+    return db
+
+
+def test_por_pais_con_snapshot_usa_el_cliente_sincrono():
+    db = _cliente(snapshot=object())
+    assert asyncio.run(db.get_importaciones_by_pais("CHINA")) == [{"ID": 1}]
+    assert db.sync.pedidos == [("snapshot", {"Pais_origen": "CHINA"})]
+
+
+def test_por_importador_sin_snapshot_resuelve_y_descarga_async():
+    db = _cliente()
+    assert asyncio.run(db.get_importaciones_by_importador("bayr")) == [{"ID": 2}]
+    assert asyncio.run(db.get_importaciones_by_importador("BAYER S.A.", exact=True)) == [{"ID": 2}]
+    assert db.sync.pedidos == [
+        ("remoto", [("Importador", "ilike", "%BAYER S.A.%")]),
+        ("remoto", [("Importador", "eq", "BAYER S.A.")])
+    ]
+
+
+def test_por_rango_de_fechas():
+    db = _cliente()
+    asyncio.run(db.get_importaciones_by_date_range("2024-01-01", "2024-03-31"))
+    assert db.sync.pedidos == [("remoto", [("Fecha", "gte", "2024-01-01"), ("Fecha", "lte", "2024-03-31")])]
+
+
+class _SyncParalelo(_Sync):
+    """Cada consulta espera a que la otra empiece: en serie, la barrera vence"""
+
+    def __init__(self):
+        super().__init__(snapshot=object())
+        self.barrera = threading.Barrier(2, timeout=2)
+
+    def _grouped_year(self, year, group_column, agg_column):
+        self.barrera.wait()
+        return pd.Series({"A": 10.0 * (year - 2022), "B": 5.0})
+
+    def get_summary_stats_by_year(self, year):
+        self.barrera.wait()
+        return {"total_kg": 100.0 * (year - 2022)}
+
+    def _pushed_new_brands(self, year):
+        return None
+
+    def _brand_set(self, filters):
+        self.barrera.wait()
+        return {"A", "B"} if filters[0][1] == "gte" else {"A"}
+
+
+def test_con_snapshot_las_consultas_independientes_se_solapan():
+    db = AsyncSupabaseClient(_SyncParalelo())
+    comparacion = asyncio.run(db.comparar_periodos(2023, 2024, "Marca"))
+    assert (comparacion["total_year1"], comparacion["total_year2"]) == (15.0, 25.0)
+    assert asyncio.run(db.get_year_comparison(2023, 2024))["change"] == 100.0
+    assert asyncio.run(db.get_new_brands_count(2024)) == 1
+
+
+def test_un_cliente_async_por_event_loop(monkeypatch):
+    creados = []
+
+    async def acreate_client(url, key):
+        creados.append(asyncio.get_running_loop())
+        return object()
+
+    monkeypatch.setattr(async_module, "acreate_client", acreate_client)
+    db = _cliente()
+
+    async def dos_pedidos():
+        return await asyncio.gather(db._get_client(), db._get_client())
+
+    primero = asyncio.run(dos_pedidos())
+    segundo = asyncio.run(dos_pedidos())
+    assert primero[0] is primero[1] and segundo[0] is segundo[1]
+    assert primero[0] is not segundo[0]
+    assert len(creados) == 2 and creados[0] is not creados[1]
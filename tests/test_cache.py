@@ -0,0 +1,27 @@
+from utils.cache import TTLCache, cached_result
+
+
+class _Db:
+    def __init__(self):
+        self.result_cache = TTLCache()
+        self.llamadas = []
+
+    @cached_result(casefold=("filter_value",))
+    def total(self, filter_column, filter_value, exact=False):
+        self.llamadas.append((filter_value, exact))
+        return {"total": len(self.llamadas)}
+
+
+def test_ilike_comparte_clave_sin_mayusculas():
+    db = _Db()
+    assert db.total("Marca", "Mixhor") == db.total("Marca", " MIXHOR ")
+    assert db.llamadas == [("Mixhor", False)]
+
+
+def test_filtro_exacto_distingue_mayusculas():
+    db = _Db()
+    db.total("Marca", "MIXHOR")
+    db.total("Marca", "MIXHOR", exact=True)
+    db.total("Marca", "Mixhor", exact=True)
+    db.total("Marca", "MIXHOR", exact=True)
+    assert db.llamadas == [("MIXHOR", False), ("MIXHOR", True), ("Mixhor", True)]
@@ -0,0 +1,100 @@
+from postgrest.exceptions import APIError
+
+import cargar_datos
+from cargar_datos import TamanoLote, _es_error_de_filas, _es_transitorio, _subir_lote
+
+
+def _error(code, status_http=None):
+    error = APIError({"message": f"error {code}", "code": code})
+    error.status_http = status_http
+    return error
+
+
+class _Diario:
+    def __init__(self):
+        self.confirmados = []
+
+    def confirmar(self, desde, hasta, filas):
+        self.confirmados.append((desde, hasta, filas))
+
+
+def test_tamano_crece_con_latencia_baja_y_respeta_el_maximo():
+    tamano = TamanoLote(inicial=500, maximo=1000, max_bytes=10 ** 9, latencia_objetivo=2.0)
+    tamano.observar(500, 50_000, 0.5)
+    assert tamano.actual() == 750
+    tamano.observar(750, 75_000, 0.5)
+    assert tamano.actual() == 1000
+
+
+def test_tamano_se_achica_con_latencia_alta():
+    tamano = TamanoLote(inicial=1000, maximo=5000, max_bytes=10 ** 9, latencia_objetivo=2.0)
+    tamano.observar(1000, 100_000, 4.0)
+    assert tamano.actual() == 500
+
+
+def test_tamano_limitado_por_bytes_y_minimo():
+    tamano = TamanoLote(inicial=1000, maximo=5000, max_bytes=100_000, latencia_objetivo=2.0)
+    tamano.observar(1000, 1_000_000, 1.5)
+    assert tamano.actual() == 100
+    for _ in range(5):
+        tamano.reducir()
+    assert tamano.actual() == cargar_datos.LOTE_MIN
+
+
+def test_clasificacion_de_errores():
+    assert _es_error_de_filas(_error("22P02"))
+    assert _es_error_de_filas(_error("23502"))
+    assert _es_error_de_filas(_error("57014"))
+    assert _es_error_de_filas(_error(None, status_http=413))
+    assert not _es_error_de_filas(_error("23505"))
+    assert not _es_error_de_filas(_error("42703"))
+
+    assert _es_transitorio(_error("40001"))
+    assert _es_transitorio(_error(503))
+    assert _es_transitorio(_error(None, status_http=429))
+    assert _es_transitorio(_error("PGRST002", status_http=503))
+    assert not _es_transitorio(_error("23505", status_http=500))
+    assert not _es_transitorio(_error(None, status_http=400))
+
+
+def test_duplicados_no_se_dividen(monkeypatch):
+    envios = []
+
+    def enviar(client, table_name, registros, modo):
+        envios.append(len(registros))
+        raise _error("23505", status_http=409)
+
+    monkeypatch.setattr(cargar_datos, "_enviar", enviar)
+    registros = [{"DUA": f"D{i}"} for i in range(8)]
+    cargados, errores = _subir_lote(None, "t", registros, "agregar", TamanoLote(), list(range(8)))
+    assert envios == [8]
+    assert cargados == 0 and len(errores) == 8
+    assert "--modo incremental" in errores[0]["error"]
+
+
+def test_fila_invalida_se_aisla_dividiendo(monkeypatch):
+    def enviar(client, table_name, registros, modo):
+        if any(r["DUA"] == "D5" for r in registros):
+            raise _error("22P02", status_http=400)
+
+    monkeypatch.setattr(cargar_datos, "_enviar", enviar)
+    diario = _Diario()
+    registros = [{"DUA": f"D{i}"} for i in range(8)]
+    cargados, errores = _subir_lote(None, "t", registros, "agregar", TamanoLote(), list(range(8)), diario)
+    assert cargados == 7
+    assert [e["DUA"] for e in errores] == ["D5"]
+    assert sum(filas for _, _, filas in diario.confirmados) == 7
+
+
+def test_429_sin_code_se_reintenta(monkeypatch):
+    intentos = []
+
+    def enviar(client, table_name, registros, modo):
+        intentos.append(1)
+        if len(intentos) < 3:
+            raise _error(None, status_http=429)
+
+    monkeypatch.setattr(cargar_datos, "_enviar", enviar)
+    monkeypatch.setattr(cargar_datos.time, "sleep", lambda segundos: None)
+    cargados, errores = _subir_lote(None, "t", [{"DUA": "D1"}], "agregar", TamanoLote(), [0])
+    assert (cargados, errores, len(intentos)) == (1, [], 3)
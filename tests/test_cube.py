@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+
+import pandas as pd
+
+from utils.cube import RollupCube
+
+
+class _Snapshot:
+    def add_listener(self, callback):
+        self.callback = callback
+
+
+class _Db:
+    """Cliente simulado con snapshot local"""
+
+    def __init__(self, df):
+        self.df = df
+        self.snapshot = _Snapshot()
+
+    def _snapshot_df(self):
+        return self.df
+
+
+def test_tabla_vacia_devuelve_totales_en_cero():
+    cube = RollupCube(_Db(pd.DataFrame()))
+    assert cube.summary_by_year() == {
+        'total_importaciones': 0, 'total_kg': 0.0, 'total_cif': 0.0, 'promedio_cif': 0,
+        'importadores_unicos': 0, 'paises_unicos': 0
+    }
+    assert cube.summary_by_year(2024)['total_importaciones'] == 0
+    assert cube.group_by('Marca').empty
+
+
+def test_resumen_por_anio():
+    df = pd.DataFrame({
+        'Fecha': ['2024-01-10', '2024-02-01', '2025-03-05'],
+        'Marca': ['A', 'B', 'A'],
+        'Importador': ['X', 'X', 'Y'],
+        'Pais_origen': ['CHINA', 'INDIA', 'CHINA'],
+        'INGREDIENTE_nuevo': ['G', 'G', 'H'],
+        'Kg_Neto': [10.0, 20.0, 5.0],
+        'CIF_Tot': [100.0, 300.0, 50.0]
+    })
+    cube = RollupCube(_Db(df))
+    resumen = cube.summary_by_year(2024)
+    assert resumen['total_importaciones'] == 2
+    assert resumen['total_kg'] == 30.0
+    assert resumen['promedio_cif'] == 200.0
+    assert (resumen['importadores_unicos'], resumen['paises_unicos']) == (1, 2)
+    assert cube.summary_by_year()['total_importaciones'] == 3
+
+
+def test_filas_nuevas_del_snapshot_parchean_el_cubo_vacio():
+    db = _Db(pd.DataFrame())
+    cube = RollupCube(db)
+    cube.ensure_ready()
+    db.snapshot.callback('append', pd.DataFrame({
+        'Fecha': ['2024-01-10'], 'Marca': ['A'], 'Kg_Neto': [7.0], 'CIF_Tot': [70.0]
+    }))
+    assert cube.summary_by_year(2024)['total_kg'] == 7.0
+
+
+class _DbVista:
+    """Cliente simulado sin snapshot: el cubo sale de la vista materializada"""
+
+    snapshot = None
+    table_name = "BD_Import_IQ"
+
+    def __init__(self, version, version_vista, filas):
+        self.version = version
+        self.versiones = {"mv_cubo_importaciones": version_vista}
+        self.filas = filas
+        self.descargas = 0
+        self.refrescos = []
+        self.client = self
+
+    def data_version(self):
+        return self.version
+
+    def _fetch_version(self, tabla):
+        return self.versiones.get(tabla)
+
+    def _iter_pages(self, table=None):
+        self.descargas += 1
+        yield self.filas
+
+    def rpc(self, nombre):
+        if nombre == "fn_cubo_tabla_origen":
+            return SimpleNamespace(execute=lambda: SimpleNamespace(data="BD_Import_IQ"))
+        self.refrescos.append(nombre)
+        self.versiones["mv_cubo_importaciones"] = self.version
+        return SimpleNamespace(execute=lambda: None)
+
+
+_FILA_VISTA = {
+    "ID": 1, "dimension": "_total", "valor": "", "anio": 2024, "mes": 1, "registros": 3,
+    "kg_sum": 30.0, "kg_count": 3, "kg_min": 5.0, "kg_max": 15.0,
+    "cif_sum": 300.0, "cif_count": 3, "cif_min": 50.0, "cif_max": 150.0
+}
+
+
+def test_vista_al_dia_se_usa_y_no_se_recarga():
+    db = _DbVista("v5:1", "v5:1", [_FILA_VISTA])
+    cube = RollupCube(db)
+    assert cube.summary_by_year(2024)['total_kg'] == 30.0
+    assert cube.summary_by_year(2024)['total_kg'] == 30.0
+    assert db.descargas == 1
+
+
+def test_vista_desactualizada_no_se_usa():
+    db = _DbVista("v6:1", "v5:1", [_FILA_VISTA])
+    cube = RollupCube(db)
+    assert cube.summary_by_year(2024) is None
+    assert cube.group_by('Marca') is None
+    assert db.descargas == 0
+
+
+def test_escritura_propia_refresca_la_vista():
+    db = _DbVista("v5:1", "v5:1", [_FILA_VISTA])
+    cube = RollupCube(db)
+    cube.ensure_ready()
+    db.version = "v6:2"
+    cube.refresh_view()
+    assert db.refrescos == ["fn_refrescar_cubo"]
+    assert cube.ensure_ready()
+    assert db.descargas == 2
+
+
+def test_vista_de_otra_tabla_desactiva_el_cubo():
+    db = _DbVista("v5:1", "v5:1", [_FILA_VISTA])
+    db.table_name = "importaciones"
+    cube = RollupCube(db)
+    assert cube.summary_by_year(2024) is None
+    assert not cube.available
+    assert db.descargas == 0
@@ -0,0 +1,71 @@
+import pandas as pd
+
+from diario_carga import DiarioCarga
+
+
+def _archivo(tmp_path, contenido="DUA,Kg_Neto\nD1,10\n"):
+    ruta = tmp_path / "datos.csv"
+    ruta.write_text(contenido, encoding="utf-8")
+    return ruta
+
+
+def _tramo(desde, hasta):
+    return pd.DataFrame({"DUA": [f"D{i}" for i in range(desde, hasta + 1)]}, index=range(desde, hasta + 1))
+
+
+def test_resume_salta_los_rangos_confirmados(tmp_path):
+    archivo, ruta_diario = _archivo(tmp_path), tmp_path / "diario.jsonl"
+    diario = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    diario.iniciar("agregar")
+    diario.confirmar(2, 5, 4)
+    diario.confirmar(9, 10, 2)
+
+    reanudado = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    assert reanudado.pendiente and reanudado.modo == "agregar"
+    assert reanudado.filas_confirmadas == 6
+    assert reanudado.pendientes(_tramo(2, 11)).index.tolist() == [6, 7, 8, 11]
+
+
+def test_carga_terminada_no_queda_pendiente(tmp_path):
+    archivo, ruta_diario = _archivo(tmp_path), tmp_path / "diario.jsonl"
+    diario = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    diario.iniciar("incremental")
+    diario.confirmar(2, 3, 2)
+    diario.terminar(cargados=2)
+
+    assert not DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario)).pendiente
+
+
+def test_nuevo_inicio_descarta_el_progreso_anterior(tmp_path):
+    archivo, ruta_diario = _archivo(tmp_path), tmp_path / "diario.jsonl"
+    diario = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    diario.iniciar("agregar")
+    diario.confirmar(2, 5, 4)
+    diario.iniciar("agregar")
+    diario.confirmar(2, 3, 2)
+
+    reanudado = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    assert reanudado.pendientes(_tramo(2, 5)).index.tolist() == [4, 5]
+
+
+def test_otro_archivo_hoja_o_tabla_empieza_de_cero(tmp_path):
+    archivo, ruta_diario = _archivo(tmp_path), tmp_path / "diario.jsonl"
+    diario = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    diario.iniciar("agregar")
+    diario.confirmar(2, 5, 4)
+
+    assert not DiarioCarga(archivo, "Hoja2", "t", ruta_diario=str(ruta_diario)).pendiente
+    assert not DiarioCarga(archivo, "Hoja1", "otra", ruta_diario=str(ruta_diario)).pendiente
+    _archivo(tmp_path, "DUA,Kg_Neto\nD1,11\n")
+    assert not DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario)).pendiente
+
+
+def test_linea_cortada_se_ignora(tmp_path):
+    archivo, ruta_diario = _archivo(tmp_path), tmp_path / "diario.jsonl"
+    diario = DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario))
+    diario.iniciar("agregar")
+    diario.confirmar(2, 3, 2)
+    with open(ruta_diario, "a", encoding="utf-8") as f:
+        f.write('{"clave": "corta')
+
+    assert DiarioCarga(archivo, "Hoja1", "t", ruta_diario=str(ruta_diario)).pendientes(_tramo(2, 4)).index.tolist() == [4]
@@ -0,0 +1,66 @@
+import pandas as pd
+
+from utils.entities import EntityDictionary
+
+
+class _Snapshot:
+    def add_listener(self, callback):
+        pass
+
+
+class _Db:
+    """Cliente simulado con snapshot local"""
+
+    cube = None
+    data_version_token = None
+
+    def __init__(self, df):
+        self.df = df
+        self.snapshot = _Snapshot()
+
+    def _snapshot_df(self):
+        return self.df
+
+
+def _diccionario():
+    df = pd.DataFrame({
+        "Importador": ["BAYER S.A.", "BAYER S.A.", "SYNGENTA CROP PROTECTION", "FARMEX"],
+        "Marca": ["MIXHOR PLUS", "MIXHOR PLUS", "MIXHOR 50", None],
+    })
+    return EntityDictionary(_Db(df), columns=["Importador", "Marca"])
+
+
+def test_closest_conserva_el_valor_si_alguno_lo_contiene():
+    diccionario = _diccionario()
+    assert diccionario.closest("Importador", "bayer") == "bayer"
+    assert diccionario.closest("Importador", "crop") == "crop"
+    assert diccionario.closest("Importador", "yer s") == "yer s"
+
+
+def test_closest_reescribe_nombres_mal_escritos():
+    diccionario = _diccionario()
+    assert diccionario.closest("Importador", "BAYR") == "BAYER S.A."
+    assert diccionario.closest("Importador", "singenta") == "SYNGENTA CROP PROTECTION"
+    assert diccionario.closest("Importador", "zzzz") is None
+
+
+def test_contiene_solo_revisa_valores_con_sus_trigramas():
+    diccionario = _diccionario()
+    diccionario.ensure_ready()
+    index = diccionario.indexes["Importador"]
+    revisados = []
+
+    class _Vigilado(list):
+        def __getitem__(self, i):
+            revisados.append(i)
+            return list.__getitem__(self, i)
+
+    index.folded = _Vigilado(index.folded)
+    assert diccionario.closest("Importador", "arme") == "arme"
+    assert revisados == [index.values.index("FARMEX")]
+
+
+def test_columna_no_indexada():
+    diccionario = _diccionario()
+    assert not diccionario.covers("Pais_origen")
+    assert diccionario.closest("Pais_origen", "china") is None
@@ -0,0 +1,99 @@
+import pandas as pd
+
+from cargar_datos import ComparadorIncremental, NumeradorLineas, _canonico, agregar_hash_filas
+from ingesta import ArchivoRechazos, limpiar_tramo
+
+
+def _crudo(filas, primera_fila=2):
+    crudo = pd.DataFrame(filas, columns=["DUA", "Fecha", "Kg_Neto"])
+    crudo.index = range(primera_fila, primera_fila + len(crudo))
+    return crudo
+
+
+def test_linea_no_se_corre_con_filas_rechazadas():
+    crudo = _crudo([
+        ["D1", "2024-01-05", "10"],
+        ["D1", "2024-01-05", "abc"],
+        ["D1", "2024-01-05", "30"],
+    ])
+    limpio, rechazados = limpiar_tramo(crudo, NumeradorLineas())
+
+    assert limpio["Linea"].tolist() == [1, 3]
+    assert rechazados["Linea"].tolist() == [2]
+    assert rechazados["fila"].tolist() == [3]
+
+
+def test_linea_continua_entre_tramos():
+    numerador = NumeradorLineas()
+    limpiar_tramo(_crudo([["D1", "2024-01-05", "x"], ["D2", "2024-01-05", "1"]]), numerador)
+    limpio, _ = limpiar_tramo(_crudo([["D1", "2024-01-05", "5"]], primera_fila=4), numerador)
+
+    assert limpio["Linea"].tolist() == [2]
+
+
+def test_agregar_hash_respeta_linea_de_la_limpieza():
+    limpio, _ = limpiar_tramo(_crudo([["D1", "2024-01-05", "x"], ["D1", "2024-01-05", "2"]]), NumeradorLineas())
+    con_hash = agregar_hash_filas(limpio)
+
+    assert con_hash["Linea"].tolist() == [2]
+    assert con_hash["row_hash"].str.len().tolist() == [16]
+
+
+def test_rechazadas_no_cuentan_como_desaparecidas(tmp_path):
+    guardadas = pd.DataFrame({
+        "ID": [1, 2, 3],
+        "DUA": ["D1", "D1", "D1"],
+        "Linea": [1, 2, 3],
+        "Fecha": ["2024-01-05"] * 3,
+        "row_hash": ["a", "b", "c"],
+    })
+    comparador = ComparadorIncremental(guardadas)
+    rechazos = ArchivoRechazos(str(tmp_path / "rechazados.csv"), al_agregar=comparador.excluir)
+
+    limpio, rechazados = limpiar_tramo(_crudo([
+        ["D1", "2024-01-05", "10"],
+        ["D1", "2024-01-05", "abc"],
+        ["D1", "2024-01-05", "30"],
+    ]), NumeradorLineas())
+    rechazos.agregar(rechazados)
+    comparador.filtrar(agregar_hash_filas(limpio))
+
+    assert comparador.desaparecidos() == []
+
+
+def test_desaparecida_de_verdad_se_elimina():
+    guardadas = pd.DataFrame({
+        "ID": [1, 2],
+        "DUA": ["D1", "D1"],
+        "Linea": [1, 2],
+        "Fecha": ["2024-01-05"] * 2,
+        "row_hash": ["a", "b"],
+    })
+    comparador = ComparadorIncremental(guardadas)
+    limpio, _ = limpiar_tramo(_crudo([["D1", "2024-01-05", "10"]]), NumeradorLineas())
+    comparador.filtrar(agregar_hash_filas(limpio))
+
+    assert comparador.desaparecidos() == [2]
+
+
+def test_canonico_unifica_numeros_y_texto():
+    assert _canonico(pd.Series([12, 12.0, 12.5, None], dtype="object")).tolist() == ["12", "12", "12.5", ""]
+    assert _canonico(pd.Series([12, "12", None], dtype="object")).tolist() == ["12", "12", ""]
+    # Columnas de texto tal cual (sin espacios): "007" no es el número 7
+    assert _canonico(pd.Series([" 007 ", "12.0", None])).tolist() == ["007", "12.0", ""]
+    assert _canonico(pd.Series([0.1 + 0.2])).tolist() == ["0.3"]
+
+
+def test_hash_igual_si_solo_cambia_el_tipo():
+    a = pd.DataFrame({"DUA": ["D1"], "Linea": [1], "Kg_Neto": [12], "Marca": ["X"]})
+    b = pd.DataFrame({"DUA": ["D1"], "Linea": [1], "Kg_Neto": [12.0], "Marca": ["X"]})
+    c = pd.DataFrame({"DUA": ["D1"], "Linea": [1], "Kg_Neto": [13], "Marca": ["X"]})
+
+    assert agregar_hash_filas(a)["row_hash"][0] == agregar_hash_filas(b)["row_hash"][0]
+    assert agregar_hash_filas(a)["row_hash"][0] != agregar_hash_filas(c)["row_hash"][0]
+
+
+def test_numerador_nulos_y_orden_de_archivo():
+    numerador = NumeradorLineas()
+    assert numerador(pd.Series(["D2", "D1", "D2", None])).tolist() == [1, 1, 2, 1]
+    assert numerador(pd.Series([None, "D2"])).tolist() == [2, 3]
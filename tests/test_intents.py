@@ -0,0 +1,96 @@
+from utils.intents import IntentRouter
+
+
+class _Entities:
+    columns = ("Marca", "Importador", "Pais_origen", "INGREDIENTE_nuevo")
+
+    def __init__(self, resoluciones):
+        self.resoluciones = resoluciones
+
+    def resolve(self, column, value):
+        return self.resoluciones.get((column, value))
+
+
+class _Db:
+    """Cliente simulado que anota con qué valor y modo se consultó"""
+
+    def __init__(self, entities=None):
+        self.entities = entities
+        self.llamadas = []
+
+    def get_time_series_by_entity(self, filter_column, filter_value, group_by_time='year',
+                                  agg_column='Kg_Neto', agg_function='sum', exact=False):
+        self.llamadas.append((filter_column, filter_value, exact))
+        return {2023: 100.0, 2024: 150.0}
+
+    def get_entity_total_historico(self, filter_column, filter_value, agg_column='Kg_Neto',
+                                   agg_function='sum', exact=False):
+        self.llamadas.append((filter_column, filter_value, exact))
+        return {"total": 250.0, "registros": 3, "promedio": 83.3, "anio_inicio": 2023, "anio_fin": 2024}
+
+
+def test_evolucion_usa_el_valor_canonico_y_filtro_exacto():
+    entities = _Entities({("Marca", "mixhor"): {
+        "valor": "MIXHOR PLUS", "coincidencia": "prefijo", "alternativas": ["MIXHOR 50"]
+    }})
+    db = _Db(entities)
+    respuesta = IntentRouter(db).answer("evolución de la marca mixhor")
+    assert db.llamadas == [("Marca", "MIXHOR PLUS", True)]
+    assert "MIXHOR PLUS pasó de" in respuesta
+    assert "Otras coincidencias: MIXHOR 50." in respuesta
+
+
+def test_total_historico_usa_el_valor_canonico():
+    entities = _Entities({("Importador", "bayer"): {
+        "valor": "BAYER S.A.", "coincidencia": "exacta", "alternativas": []
+    }})
+    db = _Db(entities)
+    respuesta = IntentRouter(db).answer("total histórico del importador bayer")
+    assert db.llamadas == [("Importador", "BAYER S.A.", True)]
+    assert "Otras coincidencias" not in respuesta
+
+
+def test_sin_diccionario_sigue_con_ilike():
+    db = _Db()
+    IntentRouter(db).answer("evolución de la marca mixhor")
+    assert db.llamadas == [("Marca", "mixhor", False)]
+
+
+def test_sin_candidatos_sigue_con_ilike():
+    db = _Db(_Entities({}))
+    IntentRouter(db).answer("total histórico de la marca desconocida")
+    assert db.llamadas == [("Marca", "desconocida", False)]
+
+
+def test_parse_top_con_anio_y_metrica():
+    assert IntentRouter(None).parse("top 5 marcas 2024 por CIF") == ("top", {
+        "group_column": "Marca", "agg_column": "CIF_Tot", "n": 5, "year": 2024
+    })
+
+
+def test_parse_top_por_defecto_diez_en_kg():
+    assert IntentRouter(None).parse("¿Cuáles son los principales importadores?") == ("top", {
+        "group_column": "Importador", "agg_column": "Kg_Neto", "n": 10, "year": None
+    })
+
+
+def test_parse_resumen_de_anio():
+    assert IntentRouter(None).parse("resumen 2024") == ("summary", {"year": 2024})
+    assert IntentRouter(None).parse("total CIF 2025") == ("summary", {"year": 2025})
+
+
+def test_parse_evolucion_conserva_el_texto_original():
+    assert IntentRouter(None).parse("Evolución de la marca Mixhor Plus en kg") == ("entity_history", {
+        "filter_column": "Marca", "filter_value": "Mixhor Plus", "agg_column": "Kg_Neto"
+    })
+    intent, params = IntentRouter(None).parse("total histórico del país China")
+    assert intent == "entity_total" and params["filter_column"] == "Pais_origen" and params["filter_value"] == "China"
+
+
+def test_parse_deja_al_llm_lo_que_no_entiende():
+    router = IntentRouter(None)
+    assert router.parse("top marcas 2023 vs 2024") is None
+    assert router.parse("top marcas de china con glifosato") is None
+    assert router.parse("top 500 marcas") is None
+    assert router.parse("resumen 2024 por CIF y kg") is None
+    assert router.parse("hola, ¿cómo estás?") is None
@@ -0,0 +1,107 @@
+from types import SimpleNamespace
+
+from sqlalchemy import create_engine
+
+from utils.langchain_chatbot import (
+    SQL_STATEMENT_TIMEOUT_MS, CachedQuerySQLDatabaseTool, CachedSQLDatabase, normalize_sql
+)
+
+
+def test_espacios_mayusculas_y_punto_y_coma_no_cambian_la_clave():
+    a = normalize_sql('SELECT  "Marca", SUM("Kg_Neto") FROM t\n GROUP BY "Marca";')
+    b = normalize_sql('select "Marca",sum( "Kg_Neto" ) from t group by "Marca"')
+    assert a == b
+
+
+def test_literales_se_conservan():
+    assert normalize_sql("""SELECT * FROM t WHERE "Marca" = 'A , B'""") != \
+        normalize_sql("""SELECT * FROM t WHERE "Marca" = 'A,B'""")
+    assert normalize_sql("""SELECT * FROM t WHERE "Marca" = 'X (Y)'""") != \
+        normalize_sql("""SELECT * FROM t WHERE "Marca" = 'X(Y)'""")
+    assert normalize_sql("""SELECT * FROM t WHERE "Marca" = 'Bayer'""") != \
+        normalize_sql("""SELECT * FROM t WHERE "Marca" = 'BAYER'""")
+
+
+def test_literal_con_comillas_escapadas():
+    assert "'o''higgins  s.a'" in normalize_sql("""SELECT 1 WHERE x = 'o''higgins  s.a'""")
+
+
+def test_identificadores_entre_comillas_conservan_mayusculas():
+    assert '"Pais_origen"' in normalize_sql('SELECT "Pais_origen" FROM t')
+
+
+class _Db:
+    """SQLDatabase simulado: devuelve n filas y anota el SQL ejecutado"""
+
+    _engine = None
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.ejecutado = []
+
+    def run_read_only(self, sql):
+        self.ejecutado.append(sql)
+        return str([(i,) for i in range(self.filas)])
+
+
+def _herramienta(filas, row_cap=3):
+    return CachedQuerySQLDatabaseTool.model_construct(
+        db=_Db(filas), row_cap=row_cap, max_cost=float("inf"), query_cache=None, data_version=None
+    )
+
+
+def test_comentario_final_no_anula_el_tope():
+    sql, capped = _herramienta(0)._capped("SELECT * FROM t; -- todas las filas")
+    assert capped
+    assert "--" not in sql and sql.endswith(") AS consulta LIMIT 3")
+
+
+def test_comentarios_dentro_de_literales_se_conservan():
+    sql, _ = _herramienta(0)._capped("SELECT * FROM t WHERE x = 'a -- b' /* nota */ LIMIT 2")
+    assert sql == "SELECT * FROM t WHERE x = 'a -- b'   LIMIT 2"
+
+
+def test_resultado_truncado_lleva_nota():
+    herramienta = _herramienta(3)
+    assert "resultado truncado a 3 filas" in herramienta._guarded_run("SELECT x FROM t")
+    assert "truncado" not in _herramienta(2)._guarded_run("SELECT x FROM t")
+    # Con un LIMIT propio menor al tope no se agrega nada
+    assert "truncado" not in herramienta._guarded_run("SELECT x FROM t LIMIT 3")
+
+
+def test_escrituras_disfrazadas_se_rechazan():
+    herramienta = _herramienta(0)
+    for consulta in (
+        "SELECT * INTO nueva_tabla FROM t",
+        "SELECT set_config('statement_timeout', '0', false)",
+        "WITH x AS (DELETE FROM t RETURNING *) SELECT * FROM x",
+    ):
+        assert herramienta._guarded_run(consulta).startswith("Error: Solo se permiten")
+    assert herramienta.db.ejecutado == []
+
+
+def _base_sqlite(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'datos.db'}")
+    with engine.begin() as connection:
+        connection.exec_driver_sql("CREATE TABLE t (x integer)")
+        connection.exec_driver_sql("INSERT INTO t VALUES (1), (2)")
+    return engine, CachedSQLDatabase(engine, include_tables=["t"], sample_rows_in_table_info=0)
+
+
+def test_consulta_del_agente_termina_en_rollback(tmp_path):
+    engine, db = _base_sqlite(tmp_path)
+    assert db.run_read_only("SELECT x FROM t ORDER BY x") == "[(1,), (2,)]"
+    # Aunque algo pase el filtro, nada de lo que haga la consulta queda confirmado
+    db.run_read_only("INSERT INTO t VALUES (3)")
+    with engine.connect() as connection:
+        assert connection.exec_driver_sql("SELECT count(*) FROM t").scalar() == 2
+    assert db.run_read_only("SELECT nada FROM t").startswith("Error:")
+
+
+def test_postgres_usa_transaccion_read_only_con_timeout_local(tmp_path):
+    _, db = _base_sqlite(tmp_path)
+    db._engine = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+    assert db._read_only_statements() == [
+        "SET TRANSACTION READ ONLY",
+        f"SET LOCAL statement_timeout = {SQL_STATEMENT_TIMEOUT_MS}"
+    ]
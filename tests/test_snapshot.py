@@ -0,0 +1,77 @@
+from utils.snapshot import TableSnapshot
+
+
+class _Version:
+    def __init__(self, valor):
+        self.valor = valor
+
+    def get(self):
+        return self.valor
+
+
+class _Db:
+    """Tabla remota simulada con el token de version_datos"""
+
+    table_name = "importaciones"
+
+    def __init__(self, filas, version):
+        self.filas = filas
+        self.data_version_token = _Version(version)
+        self.descargas = []
+
+    def iter_importaciones(self, filters=None):
+        desde = filters[0][2] if filters else None
+        self.descargas.append(desde)
+        return iter([dict(f) for f in self.filas if desde is None or f["ID"] > desde])
+
+    def count_importaciones(self):
+        return len(self.filas)
+
+
+def _snapshot(tmp_path, db):
+    snapshot = TableSnapshot(db, path=str(tmp_path / "snap.parquet"))
+    snapshot.refresh()
+    return snapshot
+
+
+def test_sin_cambios_de_version_no_descarga(tmp_path):
+    db = _Db([{"ID": 1, "Marca": "A"}], "v1:0")
+    snapshot = _snapshot(tmp_path, db)
+    assert snapshot.refresh() == 0
+    assert db.descargas == [None]
+
+
+def test_filas_nuevas_se_agregan_por_marca_de_agua(tmp_path):
+    db = _Db([{"ID": 1, "Marca": "A"}], "v1:0")
+    snapshot = _snapshot(tmp_path, db)
+    db.filas.append({"ID": 2, "Marca": "B"})
+    db.data_version_token.valor = "v2:0"
+    assert snapshot.refresh() == 1
+    assert db.descargas == [None, 1]
+    assert list(snapshot.df["Marca"]) == ["A", "B"]
+
+
+def test_actualizacion_en_el_lugar_recarga_todo(tmp_path):
+    db = _Db([{"ID": 1, "Marca": "A"}, {"ID": 2, "Marca": "B"}], "v1:0")
+    snapshot = _snapshot(tmp_path, db)
+    eventos = []
+    snapshot.add_listener(lambda kind, rows: eventos.append(kind))
+
+    db.filas[0]["Marca"] = "A2"
+    db.data_version_token.valor = "v2:1"
+    snapshot.refresh()
+    assert db.descargas == [None, None]
+    assert list(snapshot.df["Marca"]) == ["A2", "B"]
+    assert eventos == ["reset"]
+
+
+def test_version_persistida_detecta_reescrituras_al_arrancar(tmp_path):
+    db = _Db([{"ID": 1, "Marca": "A"}], "v1:0")
+    _snapshot(tmp_path, db)
+
+    db.filas[0]["Marca"] = "A2"
+    db.data_version_token.valor = "v2:1"
+    snapshot = TableSnapshot(db, path=str(tmp_path / "snap.parquet"))
+    assert snapshot.version == "v1:0"
+    snapshot.refresh()
+    assert list(snapshot.df["Marca"]) == ["A2"]
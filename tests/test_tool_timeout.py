@@ -0,0 +1,64 @@
+import json
+import time
+import threading
+
+from utils import chatbot
+from utils.chatbot import ImportacionesChatbot
+
+
+def _bot(funciones):
+    bot = ImportacionesChatbot.__new__(ImportacionesChatbot)
+    bot.get_available_functions = lambda: funciones
+    return bot
+
+
+def _llamada(i, nombre):
+    return {"id": f"call_{i}", "function": {"name": nombre, "arguments": "{}"}}
+
+
+def test_tiempo_en_cola_no_cuenta_para_el_timeout(monkeypatch):
+    monkeypatch.setattr(chatbot, "TOOL_WORKERS", 1)
+    monkeypatch.setattr(chatbot, "TOOL_TIMEOUT", 0.5)
+    lenta = lambda: time.sleep(0.3) or json.dumps({"ok": "lenta"})
+    bot = _bot({"lenta": lenta})
+    # Con un solo worker la segunda espera 0.3 s en cola y aun así entra en su plazo
+    mensajes = bot._dispatch_tool_calls([_llamada(1, "lenta"), _llamada(2, "lenta")])
+    assert [m["content"] for m in mensajes] == ['{"ok": "lenta"}'] * 2
+
+
+def test_herramienta_que_supera_el_timeout(monkeypatch):
+    monkeypatch.setattr(chatbot, "TOOL_WORKERS", 2)
+    monkeypatch.setattr(chatbot, "TOOL_TIMEOUT", 0.2)
+    bot = _bot({"colgada": lambda: time.sleep(0.5), "rapida": lambda: "1"})
+    mensajes = bot._dispatch_tool_calls([_llamada(1, "colgada"), _llamada(2, "rapida"), _llamada(3, "no_existe")])
+    assert "tardó demasiado" in json.loads(mensajes[0]["content"])["error"]
+    assert mensajes[1]["content"] == "1"
+    assert "inválidos" in json.loads(mensajes[2]["content"])["error"]
+    assert [m["tool_call_id"] for m in mensajes] == ["call_1", "call_2", "call_3"]
+
+
+def test_sin_worker_libre_se_cancela(monkeypatch):
+    monkeypatch.setattr(chatbot, "TOOL_WORKERS", 1)
+    monkeypatch.setattr(chatbot, "TOOL_TIMEOUT", 0.2)
+    ejecutadas = []
+    bot = _bot({"colgada": lambda: time.sleep(0.6), "otra": lambda: ejecutadas.append(1)})
+    mensajes = bot._dispatch_tool_calls([_llamada(1, "colgada"), _llamada(2, "otra")])
+    assert "no se ejecutó" in json.loads(mensajes[1]["content"])["error"]
+    time.sleep(0.5)
+    assert ejecutadas == []
+
+
+def test_herramienta_vencida_libera_su_worker(monkeypatch):
+    monkeypatch.setattr(chatbot, "TOOL_WORKERS", 1)
+    monkeypatch.setattr(chatbot, "TOOL_TIMEOUT", 0.2)
+    soltar = threading.Event()
+    bot = _bot({"colgada": lambda: soltar.wait(5), "rapida": lambda: "1"})
+    try:
+        primero = bot._dispatch_tool_calls([_llamada(1, "colgada")])
+        assert "tardó demasiado" in json.loads(primero[0]["content"])["error"]
+        # Otro turno (otra sesión) no espera a la herramienta colgada
+        inicio = time.monotonic()
+        assert bot._dispatch_tool_calls([_llamada(2, "rapida")])[0]["content"] == "1"
+        assert time.monotonic() - inicio < 0.2
+    finally:
+        soltar.set()
@@ -1,6 +1,7 @@
 # Utils module for Chatbot Importaciones IA
 from .supabase_client import SupabaseClient
+from .async_supabase_client import AsyncSupabaseClient
 from .chatbot import ImportacionesChatbot
 from .langchain_chatbot import LangChainChatbot
 
-__all__ = ['SupabaseClient', 'ImportacionesChatbot', 'LangChainChatbot']
+__all__ = ['SupabaseClient', 'AsyncSupabaseClient', 'ImportacionesChatbot', 'LangChainChatbot']
@@ -0,0 +1,149 @@
+"""
+Pushdown de agregaciones a Postgres
+Llama a las funciones de sql/001_agregaciones.sql vía client.rpc para que
+GROUP BY / SUM / COUNT / ORDER BY / LIMIT se ejecuten en la base de datos
+y solo viajen las filas ya agregadas.
+
+Con exact=True las consultas por entidad usan las variantes por igualdad de
+sql/005_entidades_exactas.sql (valor canónico ya resuelto).
+
+Los GROUP BY sin top N pueden devolver más filas que el max-rows de
+PostgREST (1000 en Supabase): se piden por páginas con .range(), con el
+conteo exacto en la primera, igual que SupabaseClient._iter_pages.
+"""
+import pandas as pd
+from .tracing import record, payload_bytes
+
+
+class AggregationPushdown:
+    """Capa de agregación en el servidor con degradación al cálculo local"""
+
+    AGG_FUNCTIONS = ('sum', 'mean', 'count', 'min', 'max')
+    EXACT_FUNCTIONS = ('fn_serie_temporal_valor', 'fn_total_valor')
+
+    def __init__(self, client, table_name, page_size=1000):
+        self.client = client
+        self.table_name = table_name
+        self.page_size = page_size
+        self.available = True
+        self.exact_available = True
+
+    def _fetch_all(self, function_name, params, order, desc=False):
+        """
+        Todas las filas de una función que devuelve un conjunto, por páginas
+        ordenadas por order. La primera pide el conteo exacto; si el servidor
+        recorta las páginas (max-rows) se sigue hasta cubrir ese total.
+        """
+        rows = []
+        total = None
+        while True:
+            query = self.client.rpc(function_name, params, count="exact" if total is None else None)
+            response = query.order(order, desc=desc).range(len(rows), len(rows) + self.page_size - 1).execute()
+            page = response.data or []
+            if total is None:
+                total = response.count
+            rows.extend(page)
+            if not page or (total is not None and len(rows) >= total) or (total is None and len(page) < self.page_size):
+                return rows
+
+    def _call(self, function_name, params, order=None, desc=False):
+        """
+        Ejecuta una función RPC (con order, paginada con _fetch_all).
+        Si la función no está instalada se desactiva el pushdown; ante otros
+        errores solo se devuelve None para que el llamador calcule localmente.
+        """
+        if not self.available:
+            return None
+        exact = function_name in self.EXACT_FUNCTIONS
+        if exact and not self.exact_available:
+            return None
+        try:
+            if order is not None:
+                data = self._fetch_all(function_name, params, order, desc)
+            else:
+                data = self.client.rpc(function_name, params).execute().data
+            record(rows=len(data or []), bytes=payload_bytes(data))
+            return data or []
+        except Exception as e:
+            error_msg = str(e)
+            if exact and ("PGRST202" in error_msg or "Could not find the function" in error_msg):
+                # Solo faltan las variantes exactas: el resto del pushdown sigue activo
+                print(f"⚠️ Función {function_name} no instalada (sql/005_entidades_exactas.sql), agregando en pandas")
+                self.exact_available = False
+            elif "PGRST202" in error_msg or "Could not find the function" in error_msg:
+                print(f"⚠️ Función {function_name} no instalada (sql/001_agregaciones.sql), agregando en pandas")
+                self.available = False
+            else:
+                print(f"⚠️ Error en pushdown {function_name}: {e}")
+            return None
+
+    def group_by(self, group_column, agg_column='Kg_Neto', agg_function='sum', year=None, limit=None):
+        """
+        Agregación por grupo en el servidor
+
+        Returns:
+            pd.Series | None: valores indexados por grupo (orden descendente si hay limit)
+        """
+        if agg_function not in self.AGG_FUNCTIONS:
+            return None
+        rows = self._call("fn_agregar_por_grupo", {
+            "p_table": self.table_name,
+            "p_group_column": group_column,
+            "p_agg_column": agg_column,
+            "p_agg_function": agg_function,
+            "p_year": int(year) if year else None,
+            "p_limit": int(limit) if limit else None
+        }, order="valor" if limit else "grupo", desc=bool(limit))
+        if rows is None:
+            return None
+        return pd.Series({row['grupo']: row['valor'] for row in rows}, dtype=float)
+
+    def time_series(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
+        """
+        Serie anual de una entidad calculada en el servidor
+        (exact=True: filter_column = filter_value en lugar de ILIKE)
+
+        Returns:
+            pd.Series | None: valores indexados por año
+        """
+        if agg_function not in self.AGG_FUNCTIONS:
+            return None
+        rows = self._call("fn_serie_temporal_valor" if exact else "fn_serie_temporal_entidad", {
+            "p_table": self.table_name,
+            "p_filter_column": filter_column,
+            "p_filter_value": str(filter_value),
+            "p_agg_column": agg_column,
+            "p_agg_function": agg_function
+        })
+        if rows is None:
+            return None
+        return pd.Series({int(row['anio']): row['valor'] for row in rows}, dtype=float)
+
+    def summary_by_year(self, year):
+        """Resumen anual calculado en el servidor (dict | None)"""
+        rows = self._call("fn_resumen_anio", {"p_table": self.table_name, "p_year": int(year)})
+        if not rows:
+            return None
+        return rows[0]
+
+    def entity_total(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
+        """Totales históricos de una entidad calculados en el servidor (dict | None)"""
+        if agg_function not in self.AGG_FUNCTIONS:
+            return None
+        rows = self._call("fn_total_valor" if exact else "fn_total_entidad", {
+            "p_table": self.table_name,
+            "p_filter_column": filter_column,
+            "p_filter_value": str(filter_value),
+            "p_agg_column": agg_column,
+            "p_agg_function": agg_function
+        })
+        if not rows:
+            return None
+        return rows[0]
+
+    def new_brands_count(self, year):
+        """Cantidad de marcas nuevas en un año (int | None)"""
+        result = self._call("fn_marcas_nuevas", {"p_table": self.table_name, "p_year": int(year)})
+        if result is None:
+            return None
+        return int(result or 0)
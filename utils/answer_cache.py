@@ -0,0 +1,225 @@
+"""
+Caché de respuestas del chat por pregunta normalizada
+Las preguntas frecuentes ("top 10 marcas 2024", "total CIF 2025") se
+responden desde memoria sin llamar al LLM ni a la base de datos.
+
+La clave es (provider, versión de datos, pregunta normalizada):
+- Versión de datos: token que cambia cuando cambia la tabla (contador de
+  sql/006_version_datos.sql, que sube con cada escritura; sin él, conteo +
+  ID máximo), re-consultado como máximo cada DATA_VERSION_TTL segundos.
+- Coincidencia exacta sobre la pregunta normalizada (sin tildes, signos
+  ni palabras vacías) o casi-duplicada: mismos números en el mismo orden,
+  mismas palabras clave (dimensión, métricas y entidades: todo lo que no
+  es vocabulario genérico de la pregunta) y similitud de Jaccard entre
+  palabras >= ANSWER_CACHE_SIMILARITY. Así solo cambia la redacción,
+  nunca la marca, el importador o la métrica.
+Preguntas de seguimiento con poco contenido ("¿y en 2023?") o que remiten
+al historial ("¿y de esa marca?") dependen de la conversación y no se cachean.
+"""
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+STOPWORDS = {
+    "a", "al", "cual", "cuales", "cuanto", "cuantos", "cuanta", "cuantas", "como",
+    "con", "de", "del", "dame", "dime", "el", "en", "es", "esta", "este", "fue",
+    "hay", "la", "las", "lo", "los", "me", "mi", "muestra", "muestrame", "para",
+    "por", "que", "quiero", "saber", "se", "ser", "son", "su", "sus", "un", "una",
+    "unos", "y", "o", "favor", "podrias", "puedes", "ver", "sobre", "segun"
+}
+
+
+# Palabras de redacción: pueden variar entre casi-duplicados (ya con _stem)
+GENERIC_WORDS = {
+    "top", "ranking", "principal", "mayor", "mayore", "menor", "mejor", "primer", "primero",
+    "origen", "producto",
+    "importacion", "importado", "importada", "dato", "informacion", "detalle",
+    "ano", "anual", "anio", "periodo", "historico", "historica", "evolucion", "tendencia",
+    "resumen", "comparar", "comparacion", "comparativa", "entre", "versu", "vs",
+    "tabla", "lista", "listado", "cuadro", "grafico", "general", "todo", "toda",
+    "mas", "menos", "cada", "durante", "desde", "hasta", "hace", "tiene", "tuvo",
+    "fueron", "han", "ha", "sido", "registrado", "registrada", "hubo",
+}
+
+# Palabras de dimensión (ya con _stem) -> columna: los sinónimos coinciden,
+# pero "marcas" e "importadores" son preguntas distintas
+DIMENSION_WORDS = {
+    "marca": "Marca",
+    "importador": "Importador", "empresa": "Importador",
+    "pais": "Pais_origen",
+    "ingrediente": "INGREDIENTE_nuevo", "ingredient": "INGREDIENTE_nuevo",
+}
+
+# Palabras que remiten a la conversación anterior (la pregunta no es autocontenida)
+CONTEXT_WORDS = {"ese", "esa", "eso", "esos", "esas", "aquel", "aquella", "anterior", "mismo", "misma", "ello"}
+
+
+def _stem(token):
+    """Singular aproximado para que "marca" y "marcas" coincidan"""
+    if token.isdigit() or len(token) <= 4:
+        return token
+    if token.endswith("es") and len(token) > 5:
+        return token[:-2]
+    if token.endswith("s"):
+        return token[:-1]
+    return token
+
+
+def tokenize(question):
+    """Palabras de contenido de la pregunta: minúsculas, sin tildes ni signos"""
+    text = unicodedata.normalize("NFKD", question or "")
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    tokens = re.findall(r"\d+(?:[.,]\d+)?|[a-z]+", text)
+    return [_stem(t) for t in tokens if t not in STOPWORDS]
+
+
+class DataVersion:
+    """Token de versión de los datos, re-consultado como máximo cada ttl segundos"""
+
+    def __init__(self, fetch, ttl=60):
+        self.fetch = fetch
+        self.ttl = ttl
+        self._value = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Versión actual (None si no se pudo obtener: en ese caso no se usa la caché)"""
+        with self._lock:
+            if self._value is not None and time.time() - self._checked_at < self.ttl:
+                return self._value
+        try:
+            value = self.fetch()
+        except Exception as e:
+            print(f"⚠️ No se pudo obtener la versión de los datos: {e}")
+            value = None
+        with self._lock:
+            self._value = value
+            self._checked_at = time.time()
+        return value
+
+    def invalidate(self):
+        """Fuerza a re-consultar la versión (tras una escritura de este proceso)"""
+        with self._lock:
+            self._value = None
+
+
+class AnswerCache:
+    """LRU de respuestas con TTL, descartadas también al cambiar la versión de datos"""
+
+    def __init__(self, max_size=500, ttl=86400, similarity=0.8, min_tokens=2):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.similarity = similarity
+        # Mínimo de palabras (no numéricas) para considerar la pregunta autocontenida
+        self.min_tokens = min_tokens
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _signature(self, question):
+        tokens = tokenize(question)
+        words = [t for t in tokens if not t[0].isdigit()]
+        if len(words) < self.min_tokens or CONTEXT_WORDS & set(words):
+            return None
+        numbers = tuple(t for t in tokens if t[0].isdigit())
+        key_words = frozenset(
+            DIMENSION_WORDS.get(w, w) for w in words if w not in GENERIC_WORDS
+        )
+        return " ".join(tokens), numbers, frozenset(words), key_words
+
+    def _drop_stale(self, version):
+        """Quita las entradas de otras versiones de datos o vencidas"""
+        now = time.time()
+        stale = [k for k, e in self._data.items() if e["version"] != version or e["expires_at"] < now]
+        for key in stale:
+            del self._data[key]
+        self.evictions += len(stale)
+
+    def get(self, question, provider, version):
+        """Respuesta cacheada o None"""
+        signature = self._signature(question)
+        if signature is None or version is None:
+            return None
+        text, numbers, words, key_words = signature
+        with self._lock:
+            self._drop_stale(version)
+            key = (provider, text)
+            entry = self._data.get(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry["answer"]
+
+            # Casi-duplicados: mismos números y palabras clave, casi las mismas palabras
+            best_key, best_score = None, 0.0
+            for (entry_provider, entry_text), entry in self._data.items():
+                if entry_provider != provider or entry["numbers"] != numbers or entry["key_words"] != key_words:
+                    continue
+                score = len(words & entry["words"]) / len(words | entry["words"])
+                if score > best_score:
+                    best_key, best_score = (entry_provider, entry_text), score
+            if best_key is not None and best_score >= self.similarity:
+                self._data.move_to_end(best_key)
+                self.near_hits += 1
+                return self._data[best_key]["answer"]
+
+            self.misses += 1
+            return None
+
+    def set(self, question, provider, version, answer):
+        """Guarda la respuesta (las respuestas de error o vacías no se guardan)"""
+        signature = self._signature(question)
+        if signature is None or version is None or not answer or answer.startswith("❌"):
+            return
+        text, numbers, words, key_words = signature
+        with self._lock:
+            key = (provider, text)
+            self._data[key] = {
+                "answer": answer,
+                "version": version,
+                "numbers": numbers,
+                "words": words,
+                "key_words": key_words,
+                "expires_at": time.time() + self.ttl
+            }
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        total = self.hits + self.near_hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": (self.hits + self.near_hits) / total if total else 0.0
+        }
+
+
+# Instancia compartida por todas las sesiones del proceso (None = desactivada)
+answer_cache = None
+if os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true":
+    answer_cache = AnswerCache(
+        max_size=int(os.getenv("ANSWER_CACHE_SIZE", "500")),
+        ttl=int(os.getenv("ANSWER_CACHE_TTL", "86400")),
+        similarity=float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.8"))
+    )
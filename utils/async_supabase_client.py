@@ -0,0 +1,253 @@
+"""
+Cliente asíncrono de Supabase
+Misma superficie analítica que SupabaseClient para usar desde un pipeline
+de chat async. Los métodos que necesitan varias consultas (comparar años,
+comparar periodos, marcas nuevas) las lanzan en paralelo con
+asyncio.gather: la latencia es la de un solo round trip en vez de N.
+
+- Con snapshot local o cubo/pushdown disponibles, las analíticas se
+  calculan con el SupabaseClient síncrono en hilos (asyncio.to_thread),
+  compartiendo snapshot, cubo y caché de resultados; las consultas
+  independientes corren en hilos distintos a la vez.
+- Sin ellos, las filas se descargan con el cliente async (httpx) de supabase.
+  El AsyncClient y su lock son por event loop: la misma instancia sirve a
+  varios asyncio.run sin reutilizar conexiones de un loop cerrado.
+
+Uso:
+    db = AsyncSupabaseClient()
+    comparacion = await db.get_year_comparison(2023, 2024)
+"""
+import asyncio
+import os
+import threading
+import weakref
+import pandas as pd
+from supabase import acreate_client, AsyncClient
+from .supabase_client import SupabaseClient
+from .cache import cached_result
+
+
+class AsyncSupabaseClient:
+    def __init__(self, sync_client=None):
+        # El cliente síncrono aporta configuración, snapshot, cubo, caché y
+        # la lógica de agregación (que recibe los frames ya descargados)
+        self.sync = sync_client or SupabaseClient()
+        self.table_name = self.sync.table_name
+        self.page_size = self.sync.page_size
+        self.result_cache = self.sync.result_cache
+        # Event loop -> AsyncClient / asyncio.Lock (se liberan al cerrarse el loop)
+        self._clients = weakref.WeakKeyDictionary()
+        self._client_locks = weakref.WeakKeyDictionary()
+        self._loops_lock = threading.Lock()
+
+    async def _get_client(self) -> AsyncClient:
+        """AsyncClient del event loop actual, creado en su primer uso"""
+        loop = asyncio.get_running_loop()
+        with self._loops_lock:
+            lock = self._client_locks.get(loop)
+            if lock is None:
+                lock = self._client_locks[loop] = asyncio.Lock()
+        async with lock:
+            client = self._clients.get(loop)
+            if client is None:
+                client = await acreate_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
+                self._clients[loop] = client
+        return client
+
+    def _local(self):
+        """True si las analíticas se resuelven con snapshot/cubo/pushdown del cliente síncrono"""
+        return self.sync.snapshot is not None or bool(self.sync._engines())
+
+    # ========== PAGINACIÓN ASYNC ==========
+
+    async def _aiter_pages(self, filters=None, columns=None, page_size=None):
+        """Equivalente async de SupabaseClient._iter_pages (keyset sobre "ID")"""
+        client = await self._get_client()
+        page_size = page_size or self.page_size
+        filters = self.sync._normalize_filters(filters)
+        select = self.sync._select_clause(columns)
+
+        last_id = None
+        total = None
+        fetched = 0
+        while True:
+            query = client.table(self.table_name).select(select, count="exact" if last_id is None else None)
+            for column, op, value in filters:
+                query = getattr(query, op)(column, value)
+            if last_id is not None:
+                query = query.gt("ID", last_id)
+            response = await query.order("ID").limit(page_size).execute()
+
+            page = response.data or []
+            if last_id is None:
+                total = response.count
+            if not page:
+                break
+
+            yield page
+            fetched += len(page)
+            last_id = page[-1]["ID"]
+
+            if len(page) < page_size and (total is None or fetched >= total):
+                break
+
+    async def fetch_importaciones(self, filters=None, columns=None, page_size=None):
+        """Todas las filas que cumplen los filtros (mismo formato de filtros que iter_importaciones)"""
+        rows = []
+        async for page in self._aiter_pages(filters, columns, page_size):
+            rows.extend(page)
+        return rows
+
+    async def count_importaciones(self, filters=None):
+        """Cantidad exacta de filas que cumplen los filtros (None si falla)"""
+        try:
+            client = await self._get_client()
+            query = client.table(self.table_name).select("ID", count="exact")
+            for column, op, value in self.sync._normalize_filters(filters):
+                query = getattr(query, op)(column, value)
+            return (await query.limit(1).execute()).count
+        except Exception as e:
+            print(f"⚠️ No se pudo contar registros: {e}")
+            return None
+
+    async def _frames(self, filters, columns):
+        """Páginas remotas como DataFrames, listas para _group_agg/_summary"""
+        return [pd.DataFrame(page) async for page in self._aiter_pages(filters, columns)]
+
+    # ========== CONSULTAS DE FILAS ==========
+
+    async def _records(self, filters, columns=None):
+        """Filas que cumplen los filtros: del snapshot en un hilo, o descargadas con el cliente async"""
+        if self.sync.snapshot is not None:
+            return await asyncio.to_thread(self.sync._collect_records, filters, columns)
+        return await self.fetch_importaciones(filters, columns)
+
+    async def get_importaciones_by_pais(self, pais, columns=None):
+        """Obtener importaciones por país de origen"""
+        try:
+            return await self._records({"Pais_origen": pais}, columns)
+        except Exception as e:
+            print(f"Error: {e}")
+            return []
+
+    async def get_importaciones_by_importador(self, importador, columns=None, exact=False):
+        """
+        Obtener importaciones por importador (el nombre puede estar mal escrito)
+        exact: True si importador ya es el valor canónico (filtro por igualdad)
+        """
+        try:
+            if not exact:
+                importador = await asyncio.to_thread(self.sync._resolve_entity, "Importador", importador)
+            return await self._records(self.sync._entity_filters("Importador", importador, exact), columns)
+        except Exception as e:
+            print(f"Error: {e}")
+            return []
+
+    async def get_importaciones_by_date_range(self, fecha_inicio, fecha_fin, columns=None):
+        """Obtener importaciones en rango de fechas"""
+        try:
+            return await self._records([("Fecha", "gte", fecha_inicio), ("Fecha", "lte", fecha_fin)], columns)
+        except Exception as e:
+            print(f"Error: {e}")
+            return []
+
+    # ========== ANALÍTICAS DE UNA CONSULTA ==========
+    # Una sola consulta cuesta un round trip en cualquier caso: se delega
+    # al cliente síncrono en un hilo para no bloquear el event loop.
+
+    async def get_summary_stats(self):
+        return await asyncio.to_thread(self.sync.get_summary_stats)
+
+    async def get_importaciones_by_year(self, year, columns=None):
+        return await asyncio.to_thread(self.sync.get_importaciones_by_year, year, columns)
+
+    async def get_unique_values_by_year(self, column, year):
+        return await asyncio.to_thread(self.sync.get_unique_values_by_year, column, year)
+
+    async def get_aggregated_by_year(self, year, group_column, agg_column='Kg_Neto', agg_function='sum'):
+        return await asyncio.to_thread(self.sync.get_aggregated_by_year, year, group_column, agg_column, agg_function)
+
+    async def get_time_series_by_entity(self, filter_column, filter_value, group_by_time='year', agg_column='Kg_Neto', agg_function='sum', exact=False):
+        return await asyncio.to_thread(
+            self.sync.get_time_series_by_entity, filter_column, filter_value, group_by_time, agg_column, agg_function, exact
+        )
+
+    async def get_top_n_global(self, group_column, agg_column='Kg_Neto', agg_function='sum', n=10, year=None):
+        return await asyncio.to_thread(self.sync.get_top_n_global, group_column, agg_column, agg_function, n, year)
+
+    async def get_entity_total_historico(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
+        return await asyncio.to_thread(
+            self.sync.get_entity_total_historico, filter_column, filter_value, agg_column, agg_function, exact
+        )
+
+    # ========== ANALÍTICAS CON VARIAS CONSULTAS (EN PARALELO) ==========
+
+    @cached_result()
+    async def get_summary_stats_by_year(self, year):
+        """Estadísticas resumidas de un año (mismas claves que SupabaseClient)"""
+        if self._local():
+            return await asyncio.to_thread(self.sync.get_summary_stats_by_year, year)
+        try:
+            frames = await self._frames(self.sync._year_filters(year), self.sync.SUMMARY_COLUMNS)
+            return self.sync._summary(None, frames=frames)
+        except Exception as e:
+            print(f"Error obteniendo stats de {year}: {e}")
+            return {}
+
+    @cached_result()
+    async def get_year_comparison(self, year1, year2, metric='Kg_Neto'):
+        """Compara métricas entre dos años consultando ambos a la vez"""
+        try:
+            stats_year1, stats_year2 = await asyncio.gather(
+                self.get_summary_stats_by_year(year1),
+                self.get_summary_stats_by_year(year2)
+            )
+            return self.sync._year_comparison(year1, year2, stats_year1, stats_year2, metric)
+        except Exception as e:
+            print(f"Error comparando {year1} vs {year2}: {e}")
+            return {}
+
+    @cached_result()
+    async def comparar_periodos(self, year1, year2, group_column, agg_column='Kg_Neto'):
+        """Compara dos años por grupo descargando ambos periodos a la vez"""
+        try:
+            if self._local():
+                grouped1, grouped2 = await asyncio.gather(
+                    asyncio.to_thread(self.sync._grouped_year, year1, group_column, agg_column),
+                    asyncio.to_thread(self.sync._grouped_year, year2, group_column, agg_column)
+                )
+                return self.sync._compare_grouped(year1, year2, grouped1, grouped2)
+            columns = [group_column, agg_column]
+            frames1, frames2 = await asyncio.gather(
+                self._frames(self.sync._year_filters(year1), columns),
+                self._frames(self.sync._year_filters(year2), columns)
+            )
+            grouped1 = self.sync._group_agg(None, group_column, agg_column, 'sum', frames=frames1)
+            grouped2 = self.sync._group_agg(None, group_column, agg_column, 'sum', frames=frames2)
+            return self.sync._compare_grouped(year1, year2, grouped1, grouped2)
+        except Exception as e:
+            print(f"Error: {e}")
+            return {}
+
+    @cached_result()
+    async def get_new_brands_count(self, year):
+        """Marcas nuevas del año: marcas del año y de años anteriores se piden a la vez"""
+        previous_filters = [("Fecha", "lt", f"{year}-01-01")]
+        try:
+            if self._local():
+                pushed = await asyncio.to_thread(self.sync._pushed_new_brands, year)
+                if pushed is not None:
+                    return pushed
+                current, previous = await asyncio.gather(
+                    asyncio.to_thread(self.sync._brand_set, self.sync._year_filters(year)),
+                    asyncio.to_thread(self.sync._brand_set, previous_filters)
+                )
+                return len(current - previous)
+            current_frames, previous_frames = await asyncio.gather(
+                self._frames(self.sync._year_filters(year), ["Marca"]),
+                self._frames(previous_filters, ["Marca"])
+            )
+            return len(self.sync._brands(current_frames) - self.sync._brands(previous_frames))
+        except Exception as e:
+            print(f"Error contando marcas nuevas de {year}: {e}")
+            return 0
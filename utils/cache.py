@@ -0,0 +1,140 @@
+"""
+Caché de resultados con TTL + LRU
+Memoriza las analíticas de SupabaseClient para que la misma pregunta de
+distintos usuarios/turnos se responda desde memoria.
+"""
+import copy
+import functools
+import inspect
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """Diccionario LRU acotado en tamaño, con expiración por TTL y métricas"""
+
+    def __init__(self, max_size=256, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+
+def _normalize(value, casefold=False):
+    """Normaliza argumentos para que llamadas equivalentes compartan clave"""
+    if isinstance(value, str):
+        value = value.strip()
+        return value.lower() if casefold else value
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v, casefold) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _normalize(v, casefold)) for k, v in value.items()))
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def cached_result(casefold=()):
+    """
+    Decorador para métodos de SupabaseClient (y corrutinas de AsyncSupabaseClient).
+    Usa self.result_cache (TTLCache o None para desactivar). La clave es el
+    nombre del método + argumentos con defaults aplicados; los parámetros en
+    casefold se comparan sin mayúsculas (filtros ilike), salvo si la llamada
+    trae exact=True (filtro por igualdad, que distingue mayúsculas).
+    Los resultados vacíos no se guardan (pueden venir de un error).
+    """
+    def decorator(method):
+        signature = inspect.signature(method)
+
+        def make_key(self, args, kwargs):
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            fold = () if bound.arguments.get("exact") else casefold
+            return (method.__name__,) + tuple(
+                (name, _normalize(value, name in fold))
+                for name, value in bound.arguments.items() if name != "self"
+            )
+
+        if inspect.iscoroutinefunction(method):
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                cache = getattr(self, "result_cache", None)
+                if cache is None:
+                    return await method(self, *args, **kwargs)
+
+                key = make_key(self, args, kwargs)
+                result = cache.get(key)
+                if result is not None:
+                    return copy.deepcopy(result)
+
+                result = await method(self, *args, **kwargs)
+                if result:
+                    cache.set(key, copy.deepcopy(result))
+                return result
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            cache = getattr(self, "result_cache", None)
+            if cache is None:
+                return method(self, *args, **kwargs)
+
+            key = make_key(self, args, kwargs)
+            result = cache.get(key)
+            if result is not None:
+                return copy.deepcopy(result)
+
+            result = method(self, *args, **kwargs)
+            if result:
+                cache.set(key, copy.deepcopy(result))
+            return result
+
+        return wrapper
+    return decorator
@@ -1,10 +1,50 @@
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from dotenv import load_dotenv
 import json
 import pandas as pd
+from .providers import provider_health
+from .history import HistoryManager
+from .answer_cache import answer_cache
+from .intents import IntentRouter
+from .tracing import start_trace, span, record, bind
 
 load_dotenv()
 
+# Tool_calls de un turno en paralelo: pool propio del turno (hasta TOOL_WORKERS
+# hilos), así una herramienta colgada no retiene workers de otras sesiones
+TOOL_WORKERS = int(os.getenv("TOOL_WORKERS", "4"))
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "30"))
+
+
+class _ToolTask:
+    """Herramienta enviada al pool que anota cuándo empezó a ejecutarse"""
+
+    def __init__(self, func):
+        self.func = func
+        self.start = None
+        self.started = threading.Event()
+
+    def __call__(self, **kwargs):
+        self.start = time.monotonic()
+        self.started.set()
+        return self.func(**kwargs)
+
+    def result(self, future):
+        """
+        Resultado de la herramienta. TOOL_TIMEOUT corre desde que empieza a
+        ejecutarse: el tiempo en cola (otras herramientas del turno) no
+        cuenta. Si en TOOL_TIMEOUT no consiguió un worker se cancela y se
+        lanza FutureTimeoutError con start en None.
+        """
+        if not self.started.wait(TOOL_TIMEOUT) and future.cancel():
+            raise FutureTimeoutError()
+        self.started.wait()
+        return future.result(timeout=max(0, self.start + TOOL_TIMEOUT - time.monotonic()))
+
+
 class ImportacionesChatbot:
     def __init__(self, supabase_client, provider="groq"):
         """
@@ -12,7 +52,17 @@ class ImportacionesChatbot:
         """
         self.db = supabase_client
         self.conversation_history = []
+        # Presupuesto de tokens del historial que se reenvía en cada llamada
+        self.history_manager = HistoryManager(
+            max_tokens=int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+        )
+        # Ruta rápida sin LLM para top N, resumen de año y evolución de entidades
+        self.intent_router = None
+        if os.getenv("INTENT_FAST_PATH", "true").lower() == "true":
+            self.intent_router = IntentRouter(supabase_client)
         self.provider = provider
+        self.requested_provider = provider
+        self._needs_setup = False
         
         # Configurar cliente según provider
         self._setup_client()
@@ -73,23 +123,14 @@ Las 3 principales marcas en 2024 sumaron 113,000 kg importados.
                     "mixtral-8x7b-32768"        # (Si volviera a estar disponible, o bórralo)
                 ]
                 
-                # Probar modelos en orden
-                for model in available_models:
-                    try:
-                        # Test rápido del modelo
-                        test_response = self.client.chat.completions.create(
-                            model=model,
-                            messages=[{"role": "user", "content": "test"}],
-                            max_tokens=5,
-                            temperature=0
-                        )
-                        self.model = model
-                        self.provider_name = f"Groq ({model.split('/')[-1]})"
-                        print(f"✅ Groq configurado con modelo: {model}")
-                        return
-                    except Exception as e:
-                        print(f"⚠️ Groq modelo {model} no funciona: {e}")
-                        continue
+                # Modelo sano según la caché de salud del proceso
+                # (solo se prueba en vivo la primera vez; luego se re-valida en background)
+                model = provider_health.get_model("groq", available_models, self._probe_model)
+                if model:
+                    self.model = model
+                    self.provider_name = f"Groq ({model.split('/')[-1]})"
+                    print(f"✅ Groq configurado con modelo: {model}")
+                    return
                 
                 # Si ningún modelo funciona, usar OpenAI
                 print("⚠️ Ningún modelo Groq funciona, usando OpenAI...")
@@ -136,6 +177,15 @@ Las 3 principales marcas en 2024 sumaron 113,000 kg importados.
             except Exception as e:
                 raise Exception(f"Error OpenAI: {e}")
 
+    def _probe_model(self, model):
+        """Test rápido del modelo (lanza excepción si no responde)"""
+        self.client.chat.completions.create(
+            model=model,
+            messages=[{"role": "user", "content": "test"}],
+            max_tokens=5,
+            temperature=0
+        )
+
     # ... (el resto de las funciones se mantienen igual)
 
     def get_available_functions(self):
@@ -199,26 +249,65 @@ Las 3 principales marcas en 2024 sumaron 113,000 kg importados.
             }
         ]
     
+    # ========== RESOLUCIÓN DE ENTIDADES ==========
+    
+    def _canonical(self, column, value):
+        """
+        Traduce el texto que manda el modelo ("mixhor") al valor canónico de la
+        columna con el diccionario de entidades (utils/entities.py).
+        Devuelve (valor, resolución); resolución es None si no hay diccionario
+        o candidatos, y entonces la consulta sigue con ilike sobre el texto original.
+        """
+        entities = getattr(self.db, "entities", None)
+        if entities is None or column not in entities.columns:
+            return value, None
+        resolution = entities.resolve(column, value)
+        if resolution is None:
+            return value, None
+        if resolution["valor"] != value:
+            record(resolved=f"{value} -> {resolution['valor']}", match=resolution["coincidencia"])
+        return resolution["valor"], resolution
+    
+    @staticmethod
+    def _with_entity(result, resolution):
+        """Si el valor no coincidió tal cual, indica al modelo qué entidad se usó y cuáles más había"""
+        if resolution is None or (resolution["coincidencia"] == "exacta" and not resolution["alternativas"]):
+            return result
+        return {
+            "entidad": resolution["valor"],
+            "resultado": result,
+            "otras_coincidencias": resolution["alternativas"]
+        }
+    
     # Implementación de funciones (se mantienen igual)
     def buscar_importaciones(self, **kwargs):
         filters = {k: v for k, v in kwargs.items() if v}
-        results = self.db.search_importaciones(filters)
+        exact = []
+        for column in ("Marca", "Importador", "Pais_origen"):
+            if column in filters:
+                filters[column], resolution = self._canonical(column, filters[column])
+                if resolution is not None:
+                    exact.append(column)
+        results = self.db.search_importaciones(filters, exact=exact)
         return json.dumps({"total": len(results), "data": results[:5]} if results else {"total": 0})
     
     def obtener_por_id(self, id):
         return json.dumps(self.db.get_importacion_by_id(id) or {"mensaje": "No encontrado"})
     
     def buscar_por_pais(self, pais):
+        pais, _ = self._canonical("Pais_origen", pais)
         return json.dumps(self.db.get_importaciones_by_pais(pais)[:5])
         
     def buscar_por_importador(self, importador):
-        return json.dumps(self.db.get_importaciones_by_importador(importador)[:5])
+        value, resolution = self._canonical("Importador", importador)
+        res = self.db.get_importaciones_by_importador(value, exact=resolution is not None)[:5]
+        return json.dumps(self._with_entity(res, resolution))
         
     def obtener_estadisticas(self):
         return json.dumps(self.db.get_summary_stats())
         
     def obtener_por_anio(self, year):
-        results = self.db.get_importaciones_by_year(year)
+        results = self.db.get_importaciones_by_year(year, columns=['Kg_Neto', 'CIF_Tot'])
         if not results: return json.dumps({"year": year, "mensaje": "No hay datos"})
         df = pd.DataFrame(results)
         return json.dumps({
@@ -237,75 +326,257 @@ Las 3 principales marcas en 2024 sumaron 113,000 kg importados.
         return json.dumps(res if res else {"mensaje": "Sin datos"})
 
     def analisis_temporal_entidad(self, filter_column, filter_value, agg_column="Kg_Neto", agg_function="sum"):
-        res = self.db.get_time_series_by_entity(filter_column, filter_value, 'year', agg_column, agg_function)
-        return json.dumps(res if res else {"mensaje": "Sin datos"})
+        value, resolution = self._canonical(filter_column, filter_value)
+        res = self.db.get_time_series_by_entity(filter_column, value, 'year', agg_column, agg_function, exact=resolution is not None)
+        return json.dumps(self._with_entity(res, resolution) if res else {"mensaje": "Sin datos"})
         
     def top_n_global(self, group_column, agg_column="Kg_Neto", agg_function="sum", n=10, year=None):
         res = self.db.get_top_n_global(group_column, agg_column, agg_function, n, year)
         return json.dumps(res if res else {"mensaje": "Sin datos"})
 
     def total_historico_entidad(self, filter_column, filter_value, agg_column="Kg_Neto", agg_function="sum"):
-        res = self.db.get_entity_total_historico(filter_column, filter_value, agg_column, agg_function)
-        return json.dumps(res if res else {"mensaje": "Sin datos"})
+        value, resolution = self._canonical(filter_column, filter_value)
+        res = self.db.get_entity_total_historico(filter_column, value, agg_column, agg_function, exact=resolution is not None)
+        return json.dumps(self._with_entity(res, resolution) if res else {"mensaje": "Sin datos"})
         
     def comparar_periodos(self, year1, year2, group_column, agg_column="Kg_Neto"):
         res = self.db.comparar_periodos(year1, year2, group_column, agg_column)
         return json.dumps(res if res else {"mensaje": "Error"})
 
     def chat(self, user_message):
-        """Procesa mensaje con function calling"""
+        """Procesa mensaje con function calling (respuesta completa)"""
+        return "".join(
+            event["content"] for event in self.chat_stream(user_message)
+            if event["type"] == "token"
+        )
+    
+    def _run_tool_calls(self, tool_calls):
+        """
+        Ejecuta los tool_calls de un turno en paralelo (pool del turno) y
+        devuelve los mensajes "tool" en el orden original.
+        Cada herramienta tiene TOOL_TIMEOUT segundos desde que empieza a
+        ejecutarse (ver _ToolTask); si vence, falla o no
+        existe, su resultado es un JSON de error para que el modelo lo informe
+        (cada tool_call_id necesita su mensaje "tool").
+        """
+        with span("tools", kind="tool", count=len(tool_calls)):
+            return self._dispatch_tool_calls(tool_calls)
+    
+    def _dispatch_tool_calls(self, tool_calls):
+        available_functions = self.get_available_functions()
+        executor = ThreadPoolExecutor(
+            max_workers=max(1, min(TOOL_WORKERS, len(tool_calls))), thread_name_prefix="tool"
+        )
+        futures = []
+        for tool_call in tool_calls:
+            fname = tool_call["function"]["name"]
+            try:
+                fargs = json.loads(tool_call["function"]["arguments"] or "{}")
+                # bind: el hilo del pool hereda la traza y abre el span de la herramienta
+                task = _ToolTask(bind(available_functions[fname], name=fname, kind="tool"))
+                future = executor.submit(task, **fargs)
+            except (KeyError, ValueError):
+                task, future = None, None
+            futures.append((tool_call, task, future))
+        
+        try:
+            return self._collect_tool_results(futures)
+        finally:
+            # Sin esperar: una herramienta vencida termina sola (las consultas a
+            # Supabase tienen SUPABASE_HTTP_TIMEOUT) sin frenar el turno
+            executor.shutdown(wait=False, cancel_futures=True)
+    
+    @staticmethod
+    def _collect_tool_results(futures):
+        messages = []
+        for tool_call, task, future in futures:
+            fname = tool_call["function"]["name"]
+            try:
+                if future is None:
+                    raise ValueError(f"Herramienta o argumentos inválidos: {fname}")
+                func_result = task.result(future)
+            except FutureTimeoutError:
+                if task.start is None:
+                    print(f"⚠️ {fname} no consiguió un worker libre en {TOOL_TIMEOUT:.0f}s")
+                    func_result = json.dumps({"error": f"Hay demasiadas consultas en curso, {fname} no se ejecutó"})
+                else:
+                    print(f"⚠️ {fname} superó {TOOL_TIMEOUT:.0f}s")
+                    func_result = json.dumps({"error": f"La consulta {fname} tardó demasiado"})
+            except Exception as e:
+                print(f"❌ Error en {fname}: {e}")
+                func_result = json.dumps({"error": str(e)})
+            
+            messages.append({
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "name": fname,
+                "content": str(func_result)
+            })
+        return messages
+    
+    @staticmethod
+    def _consume_stream(stream):
+        """
+        Recorre una respuesta con stream=True.
+        Emite ("token", texto) por cada fragmento de contenido y al final
+        ("message", dict) con el mensaje completo, reconstruyendo los
+        tool_calls que llegan fragmentados por índice.
+        """
+        content = []
+        tool_calls = {}
+        usage = None
+        for chunk in stream:
+            # OpenAI/DeepSeek envían el uso en un chunk final sin choices; Groq en x_groq
+            chunk_usage = getattr(chunk, "usage", None) or getattr(getattr(chunk, "x_groq", None), "usage", None)
+            if chunk_usage is not None:
+                usage = chunk_usage
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta
+            if delta.content:
+                content.append(delta.content)
+                yield "token", delta.content
+            for tc in delta.tool_calls or []:
+                entry = tool_calls.setdefault(tc.index, {
+                    "id": None,
+                    "type": "function",
+                    "function": {"name": "", "arguments": ""}
+                })
+                if tc.id:
+                    entry["id"] = tc.id
+                if tc.function and tc.function.name:
+                    entry["function"]["name"] += tc.function.name
+                if tc.function and tc.function.arguments:
+                    entry["function"]["arguments"] += tc.function.arguments
+        
+        message = {"role": "assistant", "content": "".join(content) or None}
+        if tool_calls:
+            message["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls)]
+        if usage is not None:
+            yield "usage", {
+                "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+                "completion_tokens": getattr(usage, "completion_tokens", 0)
+            }
+        yield "message", message
+    
+    def _completion(self, span_name, **kwargs):
+        """
+        Llamada streaming al modelo dentro de un span "llm". Emite los mismos
+        eventos que _consume_stream y registra el tiempo al primer token y
+        los tokens usados.
+        """
+        with span(span_name, kind="llm", model=self.model):
+            if self.provider != "groq":
+                kwargs["stream_options"] = {"include_usage": True}
+            stream = self.client.chat.completions.create(model=self.model, stream=True, **kwargs)
+            started = time.perf_counter()
+            first_token = True
+            for kind, value in self._consume_stream(stream):
+                if kind == "usage":
+                    record(**value)
+                    continue
+                if kind == "token" and first_token:
+                    first_token = False
+                    record(ttft_ms=round((time.perf_counter() - started) * 1000, 1))
+                yield kind, value
+    
+    def chat_stream(self, user_message):
+        """
+        Versión streaming de chat(). Generador de eventos:
+        - {"type": "status", "content": ...} mientras se ejecutan herramientas
+        - {"type": "token", "content": ...} con cada fragmento de la respuesta
+        - {"type": "trace", "content": Trace} al final, con los tiempos del turno (ver utils/tracing.py)
+        """
+        with start_trace("chat", provider=self.requested_provider, question=user_message) as trace:
+            yield from self._chat_stream(user_message)
+        if trace is not None:
+            yield {"type": "trace", "content": trace}
+    
+    def _chat_stream(self, user_message):
+        if self._needs_setup:
+            # El modelo falló en el turno anterior: volver a elegir uno sano
+            self._needs_setup = False
+            self.provider = self.requested_provider
+            with span("llm.setup", kind="llm"):
+                self._setup_client()
+        
+        # Preguntas repetidas: respuesta desde caché, sin LLM ni base de datos
+        data_version = self.db.data_version() if answer_cache is not None else None
+        if answer_cache is not None:
+            cached = answer_cache.get(user_message, self.requested_provider, data_version)
+            if cached is not None:
+                record(path="cache")
+                self.conversation_history.append({"role": "user", "content": user_message})
+                self.conversation_history.append({"role": "assistant", "content": cached})
+                yield {"type": "status", "content": "⚡ Respuesta desde caché"}
+                yield {"type": "token", "content": cached}
+                return
+        
+        # Preguntas con forma conocida: consulta directa y tabla sin pasar por el LLM
+        if self.intent_router is not None:
+            with span("intent_router"):
+                direct = self.intent_router.answer(user_message)
+            if direct is not None:
+                record(path="intent")
+                self.conversation_history.append({"role": "user", "content": user_message})
+                self.conversation_history.append({"role": "assistant", "content": direct})
+                yield {"type": "status", "content": "⚡ Respuesta directa"}
+                yield {"type": "token", "content": direct}
+                return
+        
+        record(path="llm", model=self.model)
         self.conversation_history.append({"role": "user", "content": user_message})
+        with span("history.compact"):
+            self.conversation_history = self.history_manager.compact(self.conversation_history)
         
         messages = [{"role": "system", "content": self.system_prompt}] + self.conversation_history
         
-# Modifica la lógica de tool_choice para DeepSeek
-
         try:
-            # CAMBIO IMPORTANTE: Usar "auto" para DeepSeek también.
-            # Forzar "required" rompe el chat si el usuario solo saluda o pide explicaciones sin datos.
-            tool_choice = "auto" 
-            
-            response = self.client.chat.completions.create(
-                model=self.model,
+            # "auto" también para DeepSeek: forzar "required" rompe el chat
+            # si el usuario solo saluda o pide explicaciones sin datos.
+            response_message = None
+            for kind, value in self._completion(
+                "llm.tools",
                 messages=messages,
                 tools=self.get_function_definitions(),
-                tool_choice=tool_choice, # Antes tenías un if para Deepseek aquí, quítalo
+                tool_choice="auto",
                 temperature=0,
                 max_tokens=500
-            )
-            
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
+            ):
+                if kind == "token":
+                    yield {"type": "token", "content": value}
+                else:
+                    response_message = value
+            tool_calls = response_message.get("tool_calls")
             
             if tool_calls:
                 self.conversation_history.append(response_message)
-                available_functions = self.get_available_functions()
-                
-                for tool_call in tool_calls:
-                    fname = tool_call.function.name
-                    fargs = json.loads(tool_call.function.arguments)
-                    
-                    if fname in available_functions:
-                        func_result = available_functions[fname](**fargs)
-                        
-                        self.conversation_history.append({
-                            "tool_call_id": tool_call.id,
-                            "role": "tool",
-                            "name": fname,
-                            "content": str(func_result)
-                        })
+                names = ", ".join(tc["function"]["name"] for tc in tool_calls)
+                yield {"type": "status", "content": f"🔧 Ejecutando {names}..."}
+                self.conversation_history.extend(self._run_tool_calls(tool_calls))
                 
-                second_response = self.client.chat.completions.create(
-                    model=self.model,
+                yield {"type": "status", "content": "✍️ Redactando respuesta..."}
+                final_message = None
+                for kind, value in self._completion(
+                    "llm.answer",
                     messages=[{"role": "system", "content": self.system_prompt}] + self.conversation_history,
                     temperature=0
-                )
-                final_text = second_response.choices[0].message.content
+                ):
+                    if kind == "token":
+                        yield {"type": "token", "content": value}
+                    else:
+                        final_message = value
+                final_text = final_message["content"] or ""
             else:
-                final_text = response_message.content
+                final_text = response_message["content"] or ""
             
             self.conversation_history.append({"role": "assistant", "content": final_text})
-            return final_text
+            if answer_cache is not None:
+                answer_cache.set(user_message, self.requested_provider, data_version, final_text)
             
         except Exception as e:
-            return f"❌ Error con {self.provider_name}: {str(e)}"
\ No newline at end of file
+            record(path="error")
+            if self.provider == "groq":
+                provider_health.mark_failed("groq")
+                self._needs_setup = True
+            yield {"type": "token", "content": f"❌ Error con {self.provider_name}: {str(e)}"}
@@ -0,0 +1,326 @@
+"""
+Cubo de agregados año × mes × dimensión
+Pre-calcula sumas, conteos, mínimos y máximos de Kg_Neto y CIF_Tot por
+Marca, Importador, Pais_origen e INGREDIENTE_nuevo, para que las preguntas
+típicas (top, resumen de año, comparar años, evolución) se respondan en
+O(grupos) en lugar de O(filas).
+
+Fuentes:
+- Snapshot local: el cubo se construye desde el DataFrame y se parchea
+  con las filas nuevas de cada refresco incremental.
+- Vista materializada mv_cubo_importaciones (sql/002_cubo.sql) cuando el
+  snapshot está desactivado. Con version_datos (sql/006_version_datos.sql)
+  la vista solo se usa si fn_refrescar_cubo la refrescó con la versión
+  actual de la tabla; si no, las consultas siguen por RPC o streaming.
+"""
+import threading
+import time
+import pandas as pd
+
+
+class RollupCube:
+    """Cubo en memoria con la misma interfaz que AggregationPushdown"""
+
+    DIMENSIONS = ['Marca', 'Importador', 'Pais_origen', 'INGREDIENTE_nuevo']
+    TOTAL = '_total'
+    MEASURES = {'Kg_Neto': 'kg', 'CIF_Tot': 'cif'}
+    AGG_FUNCTIONS = ('sum', 'mean', 'count', 'min', 'max')
+    KEYS = ['dimension', 'valor', 'anio', 'mes']
+    # Tabla que lee la vista de sql/002_cubo.sql si no tiene fn_cubo_tabla_origen()
+    VIEW_SOURCE_TABLE = 'BD_Import_IQ'
+    CELLS = ['registros', 'kg_sum', 'kg_count', 'kg_min', 'kg_max', 'cif_sum', 'cif_count', 'cif_min', 'cif_max']
+
+    def __init__(self, db, view_name="mv_cubo_importaciones", refresh_interval=300):
+        self.db = db
+        self.view_name = view_name
+        self.refresh_interval = refresh_interval
+
+        self.frames = None
+        self.dirty = True
+        self.available = True
+        self.last_refresh = 0.0
+        # Vista: versión de la tabla con la que se cargó, y última vez que se
+        # la encontró desactualizada (versión, momento) para no re-consultar en cada pregunta
+        self.version = None
+        self._stale_check = (None, 0.0)
+        # Sin version_datos: un refresco fallido tras una escritura deja la vista fuera de uso
+        self._view_stale = False
+        self._source_checked = False
+        self._lock = threading.Lock()
+
+        if db.snapshot is not None:
+            db.snapshot.add_listener(self.on_snapshot_change)
+
+    # ========== CONSTRUCCIÓN ==========
+
+    @classmethod
+    def aggregate(cls, df):
+        """Agrega filas crudas al formato largo del cubo"""
+        fechas = pd.to_datetime(df['Fecha'], errors='coerce') if 'Fecha' in df.columns else pd.Series(pd.NaT, index=df.index)
+        base = pd.DataFrame({
+            'anio': fechas.dt.year,
+            'mes': fechas.dt.month,
+            'Kg_Neto': pd.to_numeric(df['Kg_Neto'], errors='coerce') if 'Kg_Neto' in df.columns else float('nan'),
+            'CIF_Tot': pd.to_numeric(df['CIF_Tot'], errors='coerce') if 'CIF_Tot' in df.columns else float('nan')
+        }, index=df.index)
+
+        parts = []
+        for dimension in cls.DIMENSIONS + [cls.TOTAL]:
+            if dimension == cls.TOTAL:
+                frame = base.assign(valor='')
+            elif dimension in df.columns:
+                frame = base.assign(valor=df[dimension])
+                frame = frame[frame['valor'].notna()]
+            else:
+                continue
+            grouped = frame.groupby(['valor', 'anio', 'mes'], dropna=False).agg(
+                registros=('Kg_Neto', 'size'),
+                kg_sum=('Kg_Neto', 'sum'),
+                kg_count=('Kg_Neto', 'count'),
+                kg_min=('Kg_Neto', 'min'),
+                kg_max=('Kg_Neto', 'max'),
+                cif_sum=('CIF_Tot', 'sum'),
+                cif_count=('CIF_Tot', 'count'),
+                cif_min=('CIF_Tot', 'min'),
+                cif_max=('CIF_Tot', 'max')
+            ).reset_index()
+            grouped.insert(0, 'dimension', dimension)
+            parts.append(grouped)
+        return pd.concat(parts, ignore_index=True)
+
+    @classmethod
+    def merge(cls, cube, patch):
+        """Combina dos cubos sumando conteos/sumas y tomando mín/máx"""
+        combined = pd.concat([cube, patch], ignore_index=True)
+        return combined.groupby(cls.KEYS, dropna=False).agg({
+            'registros': 'sum',
+            'kg_sum': 'sum', 'kg_count': 'sum', 'kg_min': 'min', 'kg_max': 'max',
+            'cif_sum': 'sum', 'cif_count': 'sum', 'cif_min': 'min', 'cif_max': 'max'
+        }).reset_index()
+
+    def _set_cube(self, cube):
+        """Separa el cubo por dimensión para que cada consulta recorra solo sus grupos"""
+        self.frames = {dimension: frame.reset_index(drop=True) for dimension, frame in cube.groupby('dimension')}
+        self.dirty = False
+        self.last_refresh = time.time()
+
+    def _cube(self):
+        return pd.concat(self.frames.values(), ignore_index=True) if self.frames else None
+
+    def on_snapshot_change(self, kind, rows):
+        """Listener del snapshot: 'append' parchea el cubo, 'reset' lo invalida"""
+        with self._lock:
+            if kind == 'append' and self.frames is not None and not self.dirty:
+                self._set_cube(self.merge(self._cube(), self.aggregate(rows)))
+            else:
+                self.dirty = True
+
+    def _load_from_view(self):
+        """Descarga la vista materializada del servidor (pocas filas por grupo)"""
+        try:
+            rows = []
+            for page in self.db._iter_pages(table=self.view_name):
+                rows.extend(page)
+            cube = pd.DataFrame(rows).drop(columns=['ID'], errors='ignore')
+            if cube.empty:
+                cube = pd.DataFrame(columns=self.KEYS)
+            self._set_cube(cube)
+            return True
+        except Exception as e:
+            print(f"⚠️ Cubo {self.view_name} no disponible (sql/002_cubo.sql): {e}")
+            self.available = False
+            return False
+
+    def ensure_ready(self):
+        """Construye o refresca el cubo si hace falta. Devuelve False si no hay cubo"""
+        if not self.available:
+            return False
+        if self.db.snapshot is not None:
+            df = self.db._snapshot_df()
+            if df is None:
+                return False
+            with self._lock:
+                if self.dirty or self.frames is None:
+                    self._set_cube(self.aggregate(df) if not df.empty else pd.DataFrame(columns=self.KEYS))
+            return True
+        if not self._check_view_source():
+            return False
+        version = self.db.data_version()
+        with self._lock:
+            if version is not None and version.startswith("v"):
+                return self._ensure_view_version(version)
+            if self._view_stale:
+                return False
+            if self.frames is None or self.dirty or (time.time() - self.last_refresh) > self.refresh_interval:
+                return self._load_from_view()
+        return True
+
+    def _check_view_source(self):
+        """La vista se arma desde una tabla fija: si no es TABLE_NAME el cubo se desactiva"""
+        if self._source_checked:
+            return self.available
+        try:
+            source = self.db.client.rpc("fn_cubo_tabla_origen").execute().data
+        except Exception:
+            source = None
+        source = source or self.VIEW_SOURCE_TABLE
+        if source != self.db.table_name:
+            print(f"⚠️ {self.view_name} se calcula sobre {source}, no sobre {self.db.table_name}: cubo desactivado")
+            self.available = False
+        self._source_checked = True
+        return self.available
+
+    def _ensure_view_version(self, version):
+        """Carga la vista solo si se refrescó con la versión actual de la tabla (version_datos)"""
+        if self.frames is not None and not self.dirty and self.version == version:
+            return True
+        checked_version, checked_at = self._stale_check
+        if checked_version == version and time.time() - checked_at < self.refresh_interval:
+            return False
+        try:
+            view_version = self.db._fetch_version(self.view_name)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer la versión de {self.view_name}: {e}")
+            view_version = None
+        if view_version != version:
+            print(f"⚠️ {self.view_name} desactualizada ({view_version} vs {version}), se consulta la tabla hasta que se refresque")
+            self._stale_check = (version, time.time())
+            return False
+        if not self._load_from_view():
+            return False
+        self.version = version
+        return True
+
+    def refresh_view(self):
+        """Refresca la vista tras una escritura de este proceso (fn_refrescar_cubo)"""
+        with self._lock:
+            self.dirty = True
+            try:
+                self.db.client.rpc("fn_refrescar_cubo").execute()
+                self._view_stale = False
+            except Exception as e:
+                print(f"⚠️ No se pudo refrescar {self.view_name}, el cubo no se usa hasta el próximo refresco: {e}")
+                self._view_stale = True
+
+    def invalidate(self):
+        self.dirty = True
+
+    # ========== CONSULTAS ==========
+
+    def _frame(self, dimension, year=None):
+        frame = self.frames.get(dimension) if self.frames else None
+        if frame is None:
+            # Tabla vacía o dimensión sin valores: cubo vacío con todas sus columnas
+            return pd.DataFrame(columns=self.KEYS + self.CELLS)
+        if year:
+            frame = frame[frame['anio'] == int(year)]
+        return frame
+
+    @staticmethod
+    def _reduce(grouped, prefix, agg_function):
+        """Aplica la función de agregación sobre las celdas ya agrupadas"""
+        if agg_function == 'sum':
+            return grouped[f'{prefix}_sum'].sum()
+        if agg_function == 'count':
+            return grouped[f'{prefix}_count'].sum().astype(float)
+        if agg_function == 'mean':
+            return grouped[f'{prefix}_sum'].sum() / grouped[f'{prefix}_count'].sum()
+        if agg_function == 'min':
+            return grouped[f'{prefix}_min'].min()
+        return grouped[f'{prefix}_max'].max()
+
+    def _entity_mask(self, frame, filter_value, exact=False):
+        """Equivalente de ilike '%valor%' (o de = valor con exact=True) sobre los valores de la dimensión"""
+        if exact:
+            return frame['valor'].astype(str) == str(filter_value)
+        return frame['valor'].astype(str).str.contains(str(filter_value), case=False, regex=False, na=False)
+
+    def group_by(self, group_column, agg_column='Kg_Neto', agg_function='sum', year=None, limit=None):
+        """Agregación por grupo desde el cubo (pd.Series | None si no aplica)"""
+        prefix = self.MEASURES.get(agg_column)
+        if group_column not in self.DIMENSIONS or prefix is None or agg_function not in self.AGG_FUNCTIONS:
+            return None
+        if not self.ensure_ready():
+            return None
+        frame = self._frame(group_column, year)
+        result = self._reduce(frame.groupby('valor'), prefix, agg_function).rename_axis(group_column)
+        if limit:
+            result = result.nlargest(int(limit))
+        return result
+
+    def time_series(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
+        """Serie anual de una entidad desde el cubo (pd.Series | None si no aplica)"""
+        prefix = self.MEASURES.get(agg_column)
+        if filter_column not in self.DIMENSIONS or prefix is None or agg_function not in self.AGG_FUNCTIONS:
+            return None
+        if not self.ensure_ready():
+            return None
+        frame = self._frame(filter_column)
+        frame = frame[self._entity_mask(frame, filter_value, exact) & frame['anio'].notna()]
+        result = self._reduce(frame.groupby('anio'), prefix, agg_function)
+        result.index = result.index.astype(int)
+        return result
+
+    def entity_total(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
+        """Totales históricos de una entidad (mismas claves que fn_total_entidad)"""
+        prefix = self.MEASURES.get(agg_column)
+        if filter_column not in self.DIMENSIONS or prefix is None or agg_function not in self.AGG_FUNCTIONS:
+            return None
+        if not self.ensure_ready():
+            return None
+        frame = self._frame(filter_column)
+        frame = frame[self._entity_mask(frame, filter_value, exact)]
+        registros = int(frame['registros'].sum())
+        if not registros:
+            return {'registros': 0}
+
+        suma = float(frame[f'{prefix}_sum'].sum())
+        valores = int(frame[f'{prefix}_count'].sum())
+        promedio = suma / valores if valores else None
+        if agg_function == 'sum':
+            total = suma
+        elif agg_function == 'mean':
+            total = promedio
+        elif agg_function == 'count':
+            total = float(registros)
+        else:
+            total = frame[f'{prefix}_{agg_function}'].agg(agg_function)
+        anios = frame['anio'].dropna()
+        return {
+            'total': total,
+            'registros': registros,
+            'promedio': promedio,
+            'minimo': frame[f'{prefix}_min'].min(),
+            'maximo': frame[f'{prefix}_max'].max(),
+            'anio_inicio': int(anios.min()) if not anios.empty else None,
+            'anio_fin': int(anios.max()) if not anios.empty else None
+        }
+
+    def summary_by_year(self, year=None):
+        """Resumen de un año, o histórico si year es None (mismas claves que fn_resumen_anio)"""
+        if not self.ensure_ready():
+            return None
+        total = self._frame(self.TOTAL, year)
+        if total.empty:
+            return {
+                'total_importaciones': 0, 'total_kg': 0.0, 'total_cif': 0.0, 'promedio_cif': 0,
+                'importadores_unicos': 0, 'paises_unicos': 0
+            }
+        cif_count = total['cif_count'].sum()
+        return {
+            'total_importaciones': int(total['registros'].sum()),
+            'total_kg': float(total['kg_sum'].sum()),
+            'total_cif': float(total['cif_sum'].sum()),
+            'promedio_cif': float(total['cif_sum'].sum() / cif_count) if cif_count else 0,
+            'importadores_unicos': int(self._frame('Importador', year)['valor'].nunique()),
+            'paises_unicos': int(self._frame('Pais_origen', year)['valor'].nunique())
+        }
+
+    def new_brands_count(self, year):
+        """Marcas cuya primera aparición es en el año indicado"""
+        if not self.ensure_ready():
+            return None
+        marcas = self._frame('Marca')
+        marcas = marcas[(marcas['valor'] != '') & marcas['anio'].notna()]
+        primera_aparicion = marcas.groupby('valor')['anio'].min()
+        return int((primera_aparicion == int(year)).sum())
@@ -0,0 +1,261 @@
+"""
+Diccionario de entidades en memoria
+Valores distintos de Marca, Importador, Pais_origen e INGREDIENTE_nuevo
+(con su cantidad de registros) para traducir el texto libre que manda el
+LLM ("mixhor", "bayer", "china") al valor canónico de la tabla, y así
+filtrar por igualdad en lugar de ilike '%valor%' (que además mezcla
+entidades distintas que comparten un pedazo de nombre).
+
+Por columna se guardan:
+- índice exacto: texto normalizado (sin tildes, mayúsculas ni signos) -> valor
+- índice de prefijos: trie compacto como arreglo ordenado de las claves que
+  empiezan en cada palabra del valor ("crop" encuentra
+  "SYNGENTA CROP PROTECTION"); un prefijo es un rango contiguo (bisect)
+- índice de trigramas: trigrama -> valores, para nombres mal escritos
+
+Fuentes, en orden: snapshot local, cubo (que ya agrupa por estas columnas)
+o un recorrido de la tabla con solo estas columnas. Se reconstruye cuando
+cambia el snapshot o la versión de los datos (DataVersion).
+"""
+import bisect
+import os
+import re
+import threading
+import unicodedata
+from collections import Counter
+import pandas as pd
+from .tracing import span
+
+FUZZY_THRESHOLD = float(os.getenv("ENTITY_FUZZY_THRESHOLD", "0.5"))
+MAX_ALTERNATIVES = 5
+
+
+def fold(text):
+    """Texto normalizado para comparar: sin tildes, en minúsculas y solo letras/dígitos"""
+    text = unicodedata.normalize("NFKD", str(text))
+    text = "".join(c for c in text if not unicodedata.combining(c)).casefold()
+    return " ".join(re.sub(r"[^0-9a-zñ]+", " ", text).split())
+
+
+def trigrams(folded):
+    """Trigramas por palabra con relleno, como pg_trgm ("  ba", " bay", ...)"""
+    grams = set()
+    for word in folded.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class ColumnIndex:
+    """Índices exacto, de prefijos y de trigramas de los valores de una columna"""
+
+    def __init__(self, counts):
+        # Más registros primero: ante empates gana la entidad más frecuente
+        counts = counts[counts.index.astype(str).str.strip() != ""].sort_values(ascending=False)
+        self.values = [str(v) for v in counts.index]
+        self.counts = [int(c) for c in counts.to_numpy()]
+        self.folded = [fold(v) for v in self.values]
+
+        self.exact = {}
+        prefix_entries = []
+        self.ngrams = {}
+        self.ngram_sizes = []
+        for i, key in enumerate(self.folded):
+            self.exact.setdefault(key, i)
+            words = key.split()
+            for w in range(len(words)):
+                prefix_entries.append((" ".join(words[w:]), w, i))
+            grams = trigrams(key)
+            self.ngram_sizes.append(len(grams))
+            for gram in grams:
+                self.ngrams.setdefault(gram, []).append(i)
+        prefix_entries.sort()
+        self.prefix_keys = [entry[0] for entry in prefix_entries]
+        self.prefix_entries = prefix_entries
+
+    def __len__(self):
+        return len(self.values)
+
+    def by_prefix(self, key, limit=50):
+        """
+        Valores con alguna palabra que empieza con key. Primero los que tienen
+        key como palabras completas, luego los que empiezan con key, y a igual
+        rango los de más registros.
+        """
+        found = {}
+        start = bisect.bisect_left(self.prefix_keys, key)
+        for prefix, word, i in self.prefix_entries[start:]:
+            if not prefix.startswith(key):
+                break
+            rank = (prefix != key and not prefix.startswith(key + " "), word > 0)
+            if i not in found or rank < found[i]:
+                found[i] = rank
+            if len(found) >= limit:
+                break
+        return sorted(found, key=lambda i: (found[i], -self.counts[i]))
+
+    def by_similarity(self, key, threshold=FUZZY_THRESHOLD):
+        """
+        Valores parecidos, de mayor a menor: fracción de los trigramas de key
+        presentes en el valor (como word_similarity, así "singenta" encuentra
+        "SYNGENTA CROP PROTECTION") y a igual fracción el coeficiente de Dice
+        """
+        grams = trigrams(key)
+        if not grams:
+            return []
+        shared = Counter()
+        for gram in grams:
+            shared.update(self.ngrams.get(gram, ()))
+        scored = []
+        for i, common in shared.items():
+            score = common / len(grams)
+            if score >= threshold:
+                dice = 2 * common / (len(grams) + self.ngram_sizes[i])
+                scored.append((score, dice, self.counts[i], i))
+        scored.sort(reverse=True)
+        return [i for *_, i in scored]
+
+    def containing(self, key):
+        """
+        Valores que contienen key. Los trigramas internos de las palabras de key
+        (sin relleno) están en todo valor que la contiene: se revisan solo los
+        valores que los tienen todos
+        """
+        candidates = None
+        for gram in {w[i:i + 3] for w in key.split() for i in range(len(w) - 2)}:
+            posting = set(self.ngrams.get(gram, ()))
+            candidates = posting if candidates is None else candidates & posting
+            if not candidates:
+                return []
+        if candidates is None:
+            candidates = range(len(self.folded))
+        return [i for i in candidates if key in self.folded[i]]
+
+
+class EntityDictionary:
+    """Resolución de valores de entidad a su forma canónica, compartida entre sesiones"""
+
+    COLUMNS = ['Marca', 'Importador', 'Pais_origen', 'INGREDIENTE_nuevo']
+
+    def __init__(self, db, columns=None):
+        self.db = db
+        self.columns = columns or self.COLUMNS
+        self.indexes = None
+        self.version = None
+        self.dirty = True
+        self._lock = threading.Lock()
+        if db.snapshot is not None:
+            db.snapshot.add_listener(self.on_snapshot_change)
+
+    def on_snapshot_change(self, kind, rows):
+        """Listener del snapshot: cualquier cambio reconstruye el diccionario en el próximo uso"""
+        self.dirty = True
+
+    def invalidate(self):
+        self.dirty = True
+
+    # ========== CONSTRUCCIÓN ==========
+
+    def _value_counts(self):
+        """{columna: pd.Series valor -> registros} desde snapshot, cubo o la tabla"""
+        df = self.db._snapshot_df()
+        if df is not None:
+            return {c: df[c].dropna().value_counts() for c in self.columns if c in df.columns}
+
+        cube = self.db.cube
+        if cube is not None and cube.available and set(self.columns) <= set(cube.DIMENSIONS) and cube.ensure_ready():
+            return {
+                c: cube._frame(c).groupby('valor')['registros'].sum()
+                for c in self.columns
+            }
+
+        partials = {c: [] for c in self.columns}
+        for frame in self.db._iter_frames(None, self.columns):
+            for c in self.columns:
+                if c in frame.columns:
+                    partials[c].append(frame[c].dropna().value_counts())
+        return {
+            c: pd.concat(parts).groupby(level=0).sum() if parts else pd.Series(dtype="int64")
+            for c, parts in partials.items()
+        }
+
+    def _current_version(self):
+        token = getattr(self.db, "data_version_token", None)
+        return token.get() if token is not None else None
+
+    def ensure_ready(self):
+        """Construye o reconstruye los índices si cambiaron los datos. False si no se pudo"""
+        version = self._current_version()
+        with self._lock:
+            stale = self.indexes is None or self.dirty or (version is not None and version != self.version)
+            if not stale:
+                return True
+            try:
+                with span("entities.build", kind="db"):
+                    counts = self._value_counts()
+                    self.indexes = {column: ColumnIndex(series) for column, series in counts.items()}
+                self.version = version
+                self.dirty = False
+                return True
+            except Exception as e:
+                # Se reintenta cuando cambie la versión de los datos
+                print(f"⚠️ No se pudo construir el diccionario de entidades: {e}")
+                self.indexes = self.indexes or {}
+                self.version = version
+                self.dirty = False
+                return bool(self.indexes)
+
+    # ========== RESOLUCIÓN ==========
+
+    def resolve(self, column, value):
+        """
+        Valor canónico de la entidad que mejor corresponde a value
+
+        Returns:
+            dict | None: {"valor", "coincidencia": "exacta" | "prefijo" | "similar",
+                          "alternativas": [otros valores candidatos]}
+                         o None si la columna no está indexada o no hay candidatos
+        """
+        if not value or not self.ensure_ready():
+            return None
+        index = self.indexes.get(column)
+        key = fold(value)
+        if index is None or not key:
+            return None
+
+        if key in index.exact:
+            candidates, match = [index.exact[key]], "exacta"
+        else:
+            candidates, match = index.by_prefix(key), "prefijo"
+            if not candidates:
+                candidates, match = index.by_similarity(key), "similar"
+        if not candidates:
+            return None
+        return {
+            "valor": index.values[candidates[0]],
+            "coincidencia": match,
+            "alternativas": [index.values[i] for i in candidates[1:MAX_ALTERNATIVES + 1]]
+        }
+
+    def covers(self, column):
+        """True si la columna está indexada (construyendo los índices si hace falta)"""
+        return self.ensure_ready() and column in self.indexes
+
+    def closest(self, column, value, threshold=FUZZY_THRESHOLD):
+        """
+        Como search.closest_value pero con los índices de la columna: value si
+        algún valor lo contiene (el filtro ilike ya lo encuentra), si no el más
+        parecido por trigramas (>= threshold), si no None
+        """
+        index = self.indexes.get(column) if self.covers(column) else None
+        key = fold(value)
+        if index is None or not key:
+            return None
+        if key in index.exact or index.containing(key):
+            return value
+        similar = index.by_similarity(key, threshold)
+        return index.values[similar[0]] if similar else None
+
+    def stats(self):
+        """Cantidad de valores indexados por columna"""
+        return {column: len(index) for column, index in (self.indexes or {}).items()}
@@ -0,0 +1,159 @@
+"""
+Compactación del historial de conversación con presupuesto de tokens
+El historial se reenvía completo en cada llamada al LLM; para que el tamaño
+del prompt no crezca con la sesión:
+1. Los resultados de herramientas de turnos anteriores se reemplazan por
+   un extracto corto (la respuesta del asistente ya resume esos datos).
+2. Si aún se excede el presupuesto, los turnos más antiguos se pliegan en
+   un mensaje de resumen (pregunta → respuesta abreviadas).
+Los turnos se eliminan completos, así cada tool_call conserva su mensaje
+"tool" y el historial sigue siendo válido para la API.
+"""
+import json
+
+try:
+    import tiktoken
+    _ENCODING = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _ENCODING = None
+
+
+def count_tokens(text):
+    """Tokens aproximados de un texto (tiktoken si está disponible, si no ~4 caracteres por token)"""
+    if not text:
+        return 0
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1
+
+
+def _field(message, name):
+    """Lee un campo de un mensaje dict u objeto del SDK de OpenAI"""
+    if isinstance(message, dict):
+        return message.get(name)
+    return getattr(message, name, None)
+
+
+class HistoryManager:
+    """Mantiene conversation_history dentro de un presupuesto de tokens"""
+
+    SUMMARY_HEADER = "Resumen de la conversación anterior:"
+
+    def __init__(self, max_tokens=3000, tool_digest_chars=400, summary_ratio=0.25):
+        self.max_tokens = max_tokens
+        self.tool_digest_chars = tool_digest_chars
+        # Fracción del presupuesto que puede ocupar el resumen de turnos plegados
+        self.summary_ratio = summary_ratio
+
+    # ========== CONTEO ==========
+
+    def message_tokens(self, message):
+        tokens = 4 + count_tokens(_field(message, "content") or "")
+        for tool_call in _field(message, "tool_calls") or []:
+            function = _field(tool_call, "function")
+            tokens += count_tokens(_field(function, "name") or "") + count_tokens(_field(function, "arguments") or "")
+        return tokens
+
+    def total_tokens(self, messages):
+        return sum(self.message_tokens(m) for m in messages)
+
+    # ========== EXTRACTOS ==========
+
+    def digest_tool_result(self, content):
+        """Versión compacta del resultado de una herramienta"""
+        if content is None or len(content) <= self.tool_digest_chars:
+            return content
+        try:
+            data = json.loads(content)
+        except (TypeError, ValueError):
+            return content[:self.tool_digest_chars] + "…"
+
+        def shrink(value, items=5):
+            if isinstance(value, dict):
+                keys = list(value)
+                reduced = {k: shrink(value[k], 3) for k in keys[:items]}
+                if len(keys) > items:
+                    reduced["…"] = f"+{len(keys) - items} más"
+                return reduced
+            if isinstance(value, list):
+                reduced = [shrink(v, 3) for v in value[:items]]
+                if len(value) > items:
+                    reduced.append(f"+{len(value) - items} más")
+                return reduced
+            return value
+
+        digest = json.dumps(shrink(data), ensure_ascii=False, default=str)
+        if len(digest) > self.tool_digest_chars:
+            digest = digest[:self.tool_digest_chars] + "…"
+        return digest
+
+    @staticmethod
+    def _shorten(text, limit):
+        text = " ".join((text or "").split())
+        return text if len(text) <= limit else text[:limit] + "…"
+
+    def _turn_gist(self, turn):
+        """Una línea por turno: pregunta del usuario y respuesta final abreviadas"""
+        question = _field(turn[0], "content")
+        answer = ""
+        for message in reversed(turn):
+            if _field(message, "role") == "assistant" and _field(message, "content"):
+                answer = _field(message, "content")
+                break
+        # Las filas de tablas markdown no aportan al resumen: se prefiere el texto
+        prose = [line for line in answer.splitlines() if not line.lstrip().startswith("|")]
+        answer = "\n".join(prose) if any(line.strip() for line in prose) else answer
+        return f"- Usuario: {self._shorten(question, 150)} → Asistente: {self._shorten(answer, 250)}"
+
+    # ========== COMPACTACIÓN ==========
+
+    def _split(self, history):
+        """Separa el resumen previo (si existe) y agrupa los mensajes por turno"""
+        summary_lines = []
+        turns = []
+        for message in history:
+            role = _field(message, "role")
+            content = _field(message, "content") or ""
+            if role == "system" and content.startswith(self.SUMMARY_HEADER):
+                summary_lines = content.splitlines()[1:]
+            elif role == "user" or not turns:
+                turns.append([message])
+            else:
+                turns[-1].append(message)
+        return summary_lines, turns
+
+    def _summary_message(self, summary_lines):
+        if not summary_lines:
+            return []
+        return [{"role": "system", "content": "\n".join([self.SUMMARY_HEADER] + summary_lines)}]
+
+    def compact(self, history):
+        """
+        Devuelve el historial compactado dentro de max_tokens.
+        El último turno (la pregunta en curso y sus herramientas) nunca se toca.
+        """
+        summary_lines, turns = self._split(history)
+        if not turns:
+            return list(history)
+
+        # 1. Extractos de herramientas en turnos anteriores
+        for turn in turns[:-1]:
+            for i, message in enumerate(turn):
+                if _field(message, "role") == "tool" and isinstance(message, dict):
+                    digest = self.digest_tool_result(message.get("content"))
+                    if digest != message.get("content"):
+                        turn[i] = dict(message, content=digest)
+
+        # 2. Plegar los turnos más antiguos en el resumen
+        def size():
+            return self.total_tokens(self._summary_message(summary_lines)) + sum(self.total_tokens(t) for t in turns)
+
+        while len(turns) > 1 and size() > self.max_tokens:
+            summary_lines.append(self._turn_gist(turns.pop(0)))
+
+        # El resumen también tiene tope: se descartan sus líneas más antiguas
+        summary_budget = int(self.max_tokens * self.summary_ratio)
+        while summary_lines and self.total_tokens(self._summary_message(summary_lines)) > summary_budget:
+            summary_lines.pop(0)
+
+        return self._summary_message(summary_lines) + [m for turn in turns for m in turn]
@@ -0,0 +1,255 @@
+"""
+Ruta rápida sin LLM para las preguntas más comunes
+Reconoce en español tres formas de pregunta y llama directo a SupabaseClient:
+- Top N por Marca / Importador / Pais_origen / INGREDIENTE_nuevo (opcional: año, Kg o CIF)
+- Resumen de un año o histórico ("resumen 2024", "total CIF 2025")
+- Evolución o total histórico de una entidad nombrada ("evolución de la marca X")
+La respuesta se arma como tabla markdown, igual que pide el system prompt.
+Si la pregunta tiene algo que el parser no entiende (filtros extra, varios
+años, comparaciones...) devuelve None y el chatbot sigue con el LLM.
+"""
+import re
+import unicodedata
+
+
+def _fold(char):
+    """Minúscula sin tilde, conservando un carácter por carácter (los índices no cambian)"""
+    base = unicodedata.normalize("NFKD", char)[0].lower()
+    if base.isalnum() or base.isspace():
+        return base
+    return " "
+
+
+def _fmt(value, decimals=2):
+    return f"{float(value or 0):,.{decimals}f}"
+
+
+class IntentRouter:
+    GROUPS = {
+        "marca": "Marca", "marcas": "Marca",
+        "importador": "Importador", "importadores": "Importador",
+        "empresa": "Importador", "empresas": "Importador",
+        "pais": "Pais_origen", "paises": "Pais_origen",
+        "ingrediente": "INGREDIENTE_nuevo", "ingredientes": "INGREDIENTE_nuevo"
+    }
+    GROUP_LABELS = {
+        "Marca": ("Marca", "Las", "marcas"),
+        "Importador": ("Importador", "Los", "importadores"),
+        "Pais_origen": ("País", "Los", "países de origen"),
+        "INGREDIENTE_nuevo": ("Ingrediente", "Los", "ingredientes")
+    }
+    METRICS = {
+        "cif": "CIF_Tot", "valor": "CIF_Tot", "usd": "CIF_Tot", "dolares": "CIF_Tot", "monto": "CIF_Tot",
+        "kg": "Kg_Neto", "kilos": "Kg_Neto", "kilogramos": "Kg_Neto", "peso": "Kg_Neto", "volumen": "Kg_Neto"
+    }
+    METRIC_LABELS = {"Kg_Neto": ("Total Kg", "kg"), "CIF_Tot": ("Total CIF (USD)", "USD")}
+
+    TOP_WORDS = {"top", "ranking", "principales", "mayores", "primeros", "primeras", "lideres"}
+    SUMMARY_WORDS = {"resumen", "estadisticas", "balance"}
+    # Solo acompañan a un resumen ("resumen histórico"); la evolución de una entidad usa su propio regex
+    HISTORY_WORDS = {"evolucion", "historico", "historial", "tendencia"}
+
+    # Palabras que pueden acompañar a cada forma sin cambiar su significado
+    FILLER = {
+        "cual", "cuales", "son", "es", "fue", "fueron", "el", "la", "los", "las", "de", "del",
+        "en", "por", "para", "segun", "ano", "anio", "que", "dame", "dime", "muestra",
+        "muestrame", "quiero", "ver", "me", "mas", "importadas", "importados", "importadoras",
+        "importadores", "importado", "importada", "importaciones", "importacion", "total",
+        "general", "como", "a", "un", "una", "sobre", "hasta", "ahora", "datos", "y",
+        "favor", "podrias", "puedes", "mostrar", "con", "su", "sus", "al", "origen"
+    }
+
+    def __init__(self, db):
+        self.db = db
+
+    # ========== PARSEO ==========
+
+    @staticmethod
+    def _normalize(question):
+        return "".join(_fold(c) for c in question or "")
+
+    def _common(self, text):
+        """Años, métrica y palabras de la pregunta normalizada"""
+        words = text.split()
+        years = [int(w) for w in words if re.fullmatch(r"20\d\d", w)]
+        metrics = {self.METRICS[w] for w in words if w in self.METRICS}
+        return words, years, metrics
+
+    def _leftover(self, words, known):
+        """Palabras que ninguna regla reconoce (si hay, la pregunta no es de la forma esperada)"""
+        return [w for w in words if w not in known and w not in self.FILLER and not w.isdigit()]
+
+    def parse(self, question):
+        """
+        Devuelve (intent, params) o None.
+        intent: 'top', 'summary', 'entity_history' o 'entity_total'
+        """
+        text = self._normalize(question)
+        words, years, metrics = self._common(text)
+        if len(years) > 1 or len(metrics) > 1:
+            return None
+        year = years[0] if years else None
+        agg_column = metrics.pop() if metrics else "Kg_Neto"
+        word_set = set(words)
+
+        # Evolución / total histórico de una entidad nombrada explícitamente
+        match = re.search(
+            r"\b(total\s+)?(evolucion|historico|historial|tendencia)\s+(?:de\s+|del\s+)?(?:la\s+|el\s+)?"
+            r"(marca|importador|empresa|pais|ingrediente)\s+(?P<value>.+)$",
+            text
+        )
+        if match and year is None:
+            start, end = match.span("value")
+            value_words = text[start:end].split()
+            # La métrica puede venir al final: "... en kg", "... por cif"
+            while value_words and (value_words[-1] in self.METRICS or value_words[-1] in {"en", "por"}):
+                value_words.pop()
+            if not value_words or len(value_words) > 6:
+                return None
+            prefix = text[:match.start()].split()
+            if self._leftover(prefix, set()):
+                return None
+            value = question[start:start + len(" ".join(value_words))].strip()
+            params = {
+                "filter_column": self.GROUPS[match.group(3)],
+                "filter_value": value,
+                "agg_column": agg_column
+            }
+            return ("entity_total" if match.group(1) else "entity_history"), params
+
+        groups = {self.GROUPS[w] for w in words if w in self.GROUPS}
+        known = set(self.GROUPS) | set(self.METRICS) | self.TOP_WORDS | self.SUMMARY_WORDS
+
+        # Top N por grupo
+        if word_set & self.TOP_WORDS and len(groups) == 1:
+            if self._leftover(words, known):
+                return None
+            numbers = [int(w) for w in words if w.isdigit() and int(w) != year]
+            if len(numbers) > 1 or (numbers and not 1 <= numbers[0] <= 100):
+                return None
+            return "top", {
+                "group_column": groups.pop(),
+                "agg_column": agg_column,
+                "n": numbers[0] if numbers else 10,
+                "year": year
+            }
+
+        # Resumen de un año o histórico ("resumen 2024", "total CIF 2025")
+        asks_summary = word_set & self.SUMMARY_WORDS or ("total" in word_set and year is not None)
+        if asks_summary and not groups:
+            if self._leftover(words, known | self.HISTORY_WORDS):
+                return None
+            if any(w.isdigit() and int(w) != year for w in words):
+                return None
+            return "summary", {"year": year}
+
+        return None
+
+    # ========== RESPUESTAS ==========
+
+    def _canonical(self, column, value):
+        """
+        Valor canónico de la entidad según el diccionario (utils/entities.py).
+        Devuelve (valor, resolución); sin diccionario o sin candidatos la
+        resolución es None y la consulta sigue con ilike sobre el texto original.
+        """
+        entities = getattr(self.db, "entities", None)
+        if entities is None or column not in entities.columns:
+            return value, None
+        resolution = entities.resolve(column, value)
+        if resolution is None:
+            return value, None
+        return resolution["valor"], resolution
+
+    @staticmethod
+    def _alternatives(resolution):
+        """Nota con las otras entidades parecidas cuando el nombre no coincidió tal cual"""
+        if resolution is None or resolution["coincidencia"] == "exacta" or not resolution["alternativas"]:
+            return ""
+        return "\n\nOtras coincidencias: " + ", ".join(resolution["alternativas"]) + "."
+
+    def answer(self, question):
+        """Respuesta markdown lista para mostrar, o None si hay que usar el LLM"""
+        parsed = self.parse(question)
+        if parsed is None:
+            return None
+        intent, params = parsed
+        try:
+            if intent == "top":
+                return self._answer_top(**params)
+            if intent == "summary":
+                return self._answer_summary(**params)
+            if intent == "entity_history":
+                return self._answer_history(**params)
+            return self._answer_total(**params)
+        except Exception as e:
+            print(f"⚠️ Ruta rápida falló ({intent}), se usa el LLM: {e}")
+            return None
+
+    def _answer_top(self, group_column, agg_column, n, year):
+        result = self.db.get_top_n_global(group_column, agg_column, 'sum', n, year)
+        if not result:
+            return None
+        label, article, plural = self.GROUP_LABELS[group_column]
+        metric_label, unit = self.METRIC_LABELS[agg_column]
+        rows = [f"| # | {label} | {metric_label} |", "|---|---|---|"]
+        for i, (name, value) in enumerate(result.items(), 1):
+            rows.append(f"| {i} | {name} | {_fmt(value)} |")
+        periodo = f"en {year}" if year else "en el histórico"
+        total = sum(float(v or 0) for v in result.values())
+        conclusion = f"{article} {len(result)} principales {plural} {periodo} suman {_fmt(total)} {unit}."
+        return "\n".join(rows) + "\n\n" + conclusion
+
+    def _answer_summary(self, year):
+        stats = self.db.get_summary_stats_by_year(year) if year else self.db.get_summary_stats()
+        if not stats or not stats.get('total_importaciones'):
+            return None
+        rows = [
+            "| Métrica | Valor |", "|---|---|",
+            f"| Importaciones | {int(stats['total_importaciones']):,} |",
+            f"| Total Kg | {_fmt(stats['total_kg'])} |",
+            f"| Total CIF (USD) | {_fmt(stats['total_cif'])} |",
+            f"| CIF promedio (USD) | {_fmt(stats['promedio_cif'])} |",
+            f"| Importadores únicos | {int(stats['importadores_unicos']):,} |",
+            f"| Países de origen | {int(stats['paises_unicos']):,} |"
+        ]
+        periodo = f"En {year}" if year else "En total"
+        conclusion = (f"{periodo} se registraron {int(stats['total_importaciones']):,} importaciones "
+                      f"por {_fmt(stats['total_kg'])} kg y {_fmt(stats['total_cif'])} USD CIF.")
+        return "\n".join(rows) + "\n\n" + conclusion
+
+    def _answer_history(self, filter_column, filter_value, agg_column):
+        filter_value, resolution = self._canonical(filter_column, filter_value)
+        series = self.db.get_time_series_by_entity(filter_column, filter_value, 'year', agg_column, 'sum',
+                                                   exact=resolution is not None)
+        if not series:
+            return None
+        metric_label, unit = self.METRIC_LABELS[agg_column]
+        rows = ["| Año | " + metric_label + " |", "|---|---|"]
+        years = sorted(series)
+        for y in years:
+            rows.append(f"| {y} | {_fmt(series[y])} |")
+        first, last = float(series[years[0]] or 0), float(series[years[-1]] or 0)
+        if len(years) > 1 and first > 0:
+            cambio = (last - first) / first * 100
+            conclusion = f"{filter_value.upper()} pasó de {_fmt(first)} {unit} en {years[0]} a {_fmt(last)} {unit} en {years[-1]} ({cambio:+.1f}%)."
+        else:
+            conclusion = f"{filter_value.upper()} registra {_fmt(last)} {unit} en {years[-1]}."
+        return "\n".join(rows) + "\n\n" + conclusion + self._alternatives(resolution)
+
+    def _answer_total(self, filter_column, filter_value, agg_column):
+        filter_value, resolution = self._canonical(filter_column, filter_value)
+        total = self.db.get_entity_total_historico(filter_column, filter_value, agg_column, 'sum',
+                                                   exact=resolution is not None)
+        if not total:
+            return None
+        metric_label, unit = self.METRIC_LABELS[agg_column]
+        rows = [
+            "| Métrica | Valor |", "|---|---|",
+            f"| {metric_label} | {_fmt(total['total'])} |",
+            f"| Registros | {int(total['registros']):,} |",
+            f"| Promedio por registro | {_fmt(total['promedio'])} |",
+            f"| Periodo | {total['anio_inicio']} - {total['anio_fin']} |"
+        ]
+        conclusion = f"{filter_value.upper()} acumula {_fmt(total['total'])} {unit} entre {total['anio_inicio']} y {total['anio_fin']}."
+        return "\n".join(rows) + "\n\n" + conclusion + self._alternatives(resolution)
@@ -3,13 +3,34 @@ LangChain SQL Agent v5.2 - FIX DEEPSEEK
 Cambio a estructura ReAct para forzar ejecución
 """
 import os
+import re
+import json
+import hashlib
 import logging
-from typing import Dict, Any, Optional
+import queue
+import threading
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from dotenv import load_dotenv
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
 from langchain_community.utilities import SQLDatabase
+from langchain_community.utilities.sql_database import truncate_word
 from langchain_openai import ChatOpenAI
 from langchain_community.agent_toolkits import create_sql_agent, SQLDatabaseToolkit
+from langchain_community.tools.sql_database.tool import QuerySQLDatabaseTool
 from langchain.agents.agent_types import AgentType
+from langchain_core.callbacks import BaseCallbackHandler
+try:
+    from .answer_cache import DataVersion, answer_cache
+    from .cache import TTLCache
+    from .tracing import start_trace, span, begin_span, record, bind
+except ImportError:
+    # Ejecución directa del módulo (python utils/langchain_chatbot.py)
+    from answer_cache import DataVersion, answer_cache
+    from cache import TTLCache
+    from tracing import start_trace, span, begin_span, record, bind
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
@@ -17,6 +38,407 @@ logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# ========== RECURSOS COMPARTIDOS POR PROCESO ==========
+# Engine (pool de conexiones), schema reflejado y agentes se crean una vez
+# y se reutilizan en todas las preguntas y sesiones de Streamlit.
+_ENGINES: Dict[str, Engine] = {}
+_DATABASES: Dict[tuple, "CachedSQLDatabase"] = {}
+_CHATBOTS: Dict[str, "LangChainChatbot"] = {}
+_cache_lock = threading.RLock()
+
+# Resultados de sql_db_query compartidos por todos los agentes (None = desactivada)
+_QUERY_CACHE: Optional[TTLCache] = None
+if os.getenv("SQL_CACHE_ENABLED", "true").lower() == "true":
+    _QUERY_CACHE = TTLCache(
+        max_size=int(os.getenv("SQL_CACHE_SIZE", "256")),
+        ttl=int(os.getenv("SQL_CACHE_TTL", "600"))
+    )
+
+# Límites de las consultas que genera el agente (protegen la base compartida)
+SQL_STATEMENT_TIMEOUT_MS = int(os.getenv("SQL_STATEMENT_TIMEOUT_MS", "15000"))
+SQL_ROW_CAP = int(os.getenv("SQL_ROW_CAP", "200"))
+SQL_MAX_COST = float(os.getenv("SQL_MAX_COST", "1000000"))
+
+
+def get_engine(connection_string: str) -> Engine:
+    """Engine SQLAlchemy compartido con pool de conexiones y pre-ping"""
+    with _cache_lock:
+        engine = _ENGINES.get(connection_string)
+        if engine is None:
+            connect_args = {}
+            if connection_string.startswith("postgres"):
+                # Ninguna consulta del agente puede ocupar la base más de este tiempo
+                connect_args["options"] = f"-c statement_timeout={SQL_STATEMENT_TIMEOUT_MS}"
+            engine = create_engine(
+                connection_string,
+                connect_args=connect_args,
+                pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+                max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "5")),
+                pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+                pool_pre_ping=True
+            )
+            _ENGINES[connection_string] = engine
+        return engine
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase que cachea get_table_info (DDL + filas de ejemplo).
+    La caché solo se descarta cuando cambia la huella del schema
+    (columnas y tipos en information_schema), revisada cada cierto intervalo.
+    """
+
+    def __init__(self, *args, schema_check_interval: int = 300, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._table_info_cache: Dict[Optional[tuple], str] = {}
+        self._schema_check_interval = schema_check_interval
+        self._schema_fingerprint = self._fetch_schema_fingerprint()
+        self._last_schema_check = time.time()
+
+    def _fetch_schema_fingerprint(self) -> Optional[str]:
+        try:
+            tables = list(self.get_usable_table_names())
+            with self._engine.connect() as connection:
+                rows = connection.execute(
+                    text(
+                        "SELECT table_name, column_name, data_type "
+                        "FROM information_schema.columns "
+                        "WHERE table_name = ANY(:tables) ORDER BY 1, 2"
+                    ),
+                    {"tables": tables}
+                ).fetchall()
+            return hashlib.sha1(repr(rows).encode()).hexdigest()
+        except Exception as e:
+            logger.warning(f"No se pudo obtener la huella del schema: {e}")
+            return None
+
+    def schema_changed(self) -> bool:
+        """True si el schema cambió desde la reflexión (revisa como máximo cada intervalo)"""
+        if time.time() - self._last_schema_check < self._schema_check_interval:
+            return False
+        self._last_schema_check = time.time()
+        fingerprint = self._fetch_schema_fingerprint()
+        return fingerprint is not None and fingerprint != self._schema_fingerprint
+
+    def get_table_info(self, table_names: Optional[List[str]] = None) -> str:
+        key = tuple(sorted(table_names)) if table_names else None
+        info = self._table_info_cache.get(key)
+        if info is None:
+            info = super().get_table_info(table_names)
+            self._table_info_cache[key] = info
+        return info
+
+    def _read_only_statements(self) -> List[str]:
+        """Ajustes de la transacción de cada consulta del agente (solo en Postgres)"""
+        if self._engine.dialect.name != "postgresql":
+            return []
+        return [
+            "SET TRANSACTION READ ONLY",
+            f"SET LOCAL statement_timeout = {int(SQL_STATEMENT_TIMEOUT_MS)}"
+        ]
+
+    def run_read_only(self, command: str) -> str:
+        """
+        Como run_no_throw, pero dentro de una transacción READ ONLY con
+        statement_timeout local que siempre termina en ROLLBACK: ni un
+        SELECT ... INTO ni un set_config() sobreviven a la consulta ni
+        quedan en la conexión del pool.
+        """
+        try:
+            with self._engine.connect() as connection:
+                transaction = connection.begin()
+                try:
+                    for statement in self._read_only_statements():
+                        connection.exec_driver_sql(statement)
+                    cursor = connection.execute(text(command))
+                    rows = cursor.fetchall() if cursor.returns_rows else []
+                finally:
+                    transaction.rollback()
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+        if not rows:
+            return ""
+        return str([
+            tuple(truncate_word(value, length=self._max_string_length) for value in row)
+            for row in rows
+        ])
+
+
+def get_database(connection_string: str, table_name: str) -> CachedSQLDatabase:
+    """SQLDatabase compartido; se vuelve a reflejar solo si cambió el schema"""
+    key = (connection_string, table_name)
+    with _cache_lock:
+        db = _DATABASES.get(key)
+        if db is None or db.schema_changed():
+            if db is not None:
+                logger.info("🔄 Schema modificado, reflejando tabla de nuevo")
+            db = CachedSQLDatabase(
+                get_engine(connection_string),
+                include_tables=[table_name],
+                sample_rows_in_table_info=2,
+                schema_check_interval=int(os.getenv("SCHEMA_CHECK_SECONDS", "300"))
+            )
+            _DATABASES[key] = db
+        return db
+
+
+def normalize_sql(query: str) -> str:
+    """
+    Forma canónica de una consulta para la clave de caché: espacios colapsados,
+    sin ';' final y palabras clave en minúsculas. Los literales ('...') y los
+    identificadores entre comillas ("Marca") se conservan tal cual.
+    """
+    parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", query.strip().rstrip(";").strip())
+    normalized = []
+    for i, part in enumerate(parts):
+        if i % 2:
+            normalized.append(part)
+        else:
+            # Solo fuera de los literales: 'A , B' y 'A,B' son valores distintos
+            code = " ".join(part.lower().split())
+            normalized.append(re.sub(r"\s*([(),=<>])\s*", r"\1", code))
+    return " ".join(p for p in normalized if p)
+
+
+class CachedQuerySQLDatabaseTool(QuerySQLDatabaseTool):
+    """
+    sql_db_query con límites y caché:
+    - Solo lectura (SELECT/WITH), con tope de filas (LIMIT externo).
+    - EXPLAIN previo: si el costo estimado supera max_cost se rechaza con una
+      observación que le dice al agente cómo acotar la consulta.
+    - Cada consulta corre en una transacción READ ONLY con statement_timeout
+      local que termina en ROLLBACK (CachedSQLDatabase.run_read_only).
+    - Caché por SQL normalizado + versión de datos.
+    """
+
+    query_cache: Any = None
+    data_version: Any = None
+    row_cap: int = SQL_ROW_CAP
+    max_cost: float = SQL_MAX_COST
+
+    @staticmethod
+    def _strip_comments(query: str) -> str:
+        """Quita comentarios -- y /* */ fuera de los literales (un -- final anularía el cierre del LIMIT)"""
+        parts = re.split(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")""", query)
+        for i in range(0, len(parts), 2):
+            parts[i] = re.sub(r"--[^\n]*|/\*.*?\*/", " ", parts[i], flags=re.DOTALL)
+        return "".join(parts)
+
+    def _capped(self, query: str) -> Tuple[str, bool]:
+        """
+        Agrega el tope de filas salvo que la consulta ya tenga un LIMIT menor.
+        Devuelve (sql, True si se agregó el tope).
+        """
+        sql = self._strip_comments(query).strip().rstrip(";").strip()
+        limit = re.search(r"\blimit\s+(\d+)\s*$", sql, re.IGNORECASE)
+        if limit and int(limit.group(1)) <= self.row_cap:
+            return sql, False
+        # Cierre en otra línea: ningún resto de la consulta puede comentarlo
+        return f"SELECT * FROM (\n{sql}\n) AS consulta LIMIT {self.row_cap}", True
+
+    def _estimated_cost(self, sql: str) -> Optional[float]:
+        """Costo total estimado por el planner (None si EXPLAIN falla)"""
+        try:
+            with self.db._engine.connect() as connection:
+                plan = connection.execute(text(f"EXPLAIN (FORMAT JSON) {sql}")).scalar()
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return float(plan[0]["Plan"]["Total Cost"])
+        except Exception as e:
+            logger.warning(f"EXPLAIN no disponible: {e}")
+            return None
+
+    def _guarded_run(self, query: str) -> str:
+        # Palabras de escritura fuera de literales (incluye CTEs con DELETE/UPDATE)
+        # Primera barrera; la que vale es la transacción READ ONLY de run_read_only
+        code = re.sub(r"'(?:[^']|'')*'", "''", self._strip_comments(query))
+        if not re.match(r"\s*(select|with)\b", code, re.IGNORECASE) or re.search(
+            r"\b(insert|update|delete|drop|alter|truncate|create|grant|revoke|into|set_config)\b",
+            code, re.IGNORECASE
+        ):
+            return "Error: Solo se permiten consultas de lectura (SELECT)."
+        sql, capped = self._capped(query)
+        cost = self._estimated_cost(sql)
+        record(estimated_cost=cost)
+        if cost is not None and cost > self.max_cost:
+            logger.warning(f"Consulta rechazada por costo {cost:,.0f}: {query}")
+            return (
+                f"Error: La consulta es demasiado costosa (costo estimado {cost:,.0f}, máximo {self.max_cost:,.0f}). "
+                "Reescríbela: filtra por año con \"Fecha\", agrupa con GROUP BY y agrega LIMIT, "
+                "y evita JOINs o productos cruzados de la tabla consigo misma."
+            )
+        result = self.db.run_read_only(sql)
+        if isinstance(result, str) and result.startswith("Error:") and "statement timeout" in result:
+            return (
+                f"Error: La consulta superó el límite de {SQL_STATEMENT_TIMEOUT_MS / 1000:.0f} segundos. "
+                "Acótala con filtros (año, marca, importador) o agregaciones más simples."
+            )
+        if capped and self._row_count(result) >= self.row_cap:
+            # Sin la nota el agente tomaría las primeras filas como el total
+            result += (
+                f"\n(resultado truncado a {self.row_cap} filas: para totales usa GROUP BY o "
+                "agregaciones, o filtra más la consulta)"
+            )
+        return result
+
+    @staticmethod
+    def _row_count(result: str) -> int:
+        """Filas de un resultado de SQLDatabase.run (str de una lista de tuplas)"""
+        if not isinstance(result, str) or not result.startswith("[("):
+            return 0
+        return result.count("), (") + 1
+
+    def _run(self, query: str, run_manager=None):
+        with span("sql_db_query", kind="db", sql=query[:500]):
+            result = self._cached_run(query)
+            if not (isinstance(result, str) and result.startswith("Error:")):
+                record(rows=self._row_count(result), bytes=len(result.encode("utf-8")))
+            return result
+
+    def _cached_run(self, query: str):
+        key_sql = normalize_sql(query)
+        cacheable = self.query_cache is not None and re.match(r"(select|with)\b", key_sql)
+        version = self.data_version.get() if cacheable and self.data_version is not None else None
+        if not cacheable or version is None:
+            return self._guarded_run(query)
+        
+        key = (version, key_sql)
+        result = self.query_cache.get(key)
+        if result is not None:
+            logger.info("⚡ sql_db_query desde caché")
+            record(cache="hit")
+            return result
+        record(cache="miss")
+        result = self._guarded_run(query)
+        # Los errores no se guardan: el agente debe poder reintentar
+        if isinstance(result, str) and not result.startswith("Error:"):
+            self.query_cache.set(key, result)
+        return result
+
+
+class CachedSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """Toolkit estándar con sql_db_query reemplazado por la versión cacheada"""
+
+    query_cache: Any = None
+    data_version: Any = None
+
+    def get_tools(self):
+        tools = []
+        for tool in super().get_tools():
+            if isinstance(tool, QuerySQLDatabaseTool):
+                tool = CachedQuerySQLDatabaseTool(
+                    db=self.db,
+                    description=(
+                        f"{tool.description} Solo lectura: los resultados se limitan a "
+                        f"{SQL_ROW_CAP} filas y las consultas muy costosas se rechazan."
+                    ),
+                    query_cache=self.query_cache,
+                    data_version=self.data_version
+                )
+            tools.append(tool)
+        return tools
+
+
+class _AgentStreamHandler(BaseCallbackHandler):
+    """
+    Callback que pasa a una cola los pasos del agente (eventos "status") y
+    los tokens que el LLM genera después de "Final Answer:" (eventos "token").
+    """
+
+    FINAL_MARKER = "Final Answer:"
+
+    def __init__(self, events: queue.Queue):
+        self.events = events
+        self.streamed = False
+        self._buffer = ""
+        self._emitted = 0
+
+    def _reset(self):
+        self._buffer = ""
+        self._emitted = 0
+
+    def on_llm_start(self, *args, **kwargs):
+        self._reset()
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self._reset()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._buffer += token
+        marker = self._buffer.find(self.FINAL_MARKER)
+        if marker < 0:
+            return
+        start = max(marker + len(self.FINAL_MARKER), self._emitted)
+        pending = self._buffer[start:]
+        self._emitted = len(self._buffer)
+        if not self.streamed:
+            pending = pending.lstrip()
+        if pending:
+            self.streamed = True
+            self.events.put({"type": "token", "content": pending})
+
+    def on_agent_action(self, action, **kwargs):
+        self.events.put({"type": "status", "content": f"🔧 Ejecutando {action.tool}..."})
+
+
+class _TraceHandler(BaseCallbackHandler):
+    """
+    Callback que abre un span por cada llamada al LLM (con tokens usados) y
+    por cada herramienta del agente. sql_db_query abre su propio span con
+    filas y bytes (CachedQuerySQLDatabaseTool).
+    """
+
+    def __init__(self):
+        self._spans = {}
+
+    def _begin(self, run_id, name, kind):
+        current = begin_span(name, kind)
+        if current is not None:
+            self._spans[run_id] = current
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._begin(run_id, "llm", "llm")
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._begin(run_id, "llm", "llm")
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is None:
+            return
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0)
+        if not usage:
+            # En streaming el uso viene en usage_metadata del mensaje
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens += metadata.get("input_tokens", 0)
+                    completion_tokens += metadata.get("output_tokens", 0)
+        current.record(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        current.finish()
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.finish(error)
+
+    def on_tool_start(self, serialized, input_str, *, run_id, **kwargs):
+        name = (serialized or {}).get("name", "tool")
+        if name != "sql_db_query":
+            self._begin(run_id, name, "tool")
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.finish()
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        current = self._spans.pop(run_id, None)
+        if current is not None:
+            current.finish(error)
+
+
 class LangChainChatbot:
     SUPPORTED_PROVIDERS = ["openai", "deepseek", "groq"] # Agregado Groq
     DEFAULT_TABLE = "BD_Import_IQ"
@@ -31,19 +453,69 @@ class LangChainChatbot:
         self._setup_llm()
         self._create_agent()
     
+    @classmethod
+    def for_provider(cls, provider: str = "openai") -> "LangChainChatbot":
+        """
+        Chatbot (LLM + toolkit + agente) compartido por provider.
+        Se reconstruye solo si el SQLDatabase compartido fue reemplazado
+        (cambio de schema).
+        """
+        with _cache_lock:
+            bot = _CHATBOTS.get(provider)
+            if bot is not None:
+                current_db = get_database(bot._connection_string, bot._table_name)
+                if current_db is bot.db:
+                    return bot
+            bot = cls(provider=provider)
+            _CHATBOTS[provider] = bot
+            return bot
+    
     def _connect_database(self):
         connection_string = os.getenv("SUPABASE_CONNECTION_STRING")
         if not connection_string:
             raise ValueError("Falta SUPABASE_CONNECTION_STRING en .env")
-            
+        
+        self._connection_string = connection_string
+        self._table_name = os.getenv("TABLE_NAME", self.DEFAULT_TABLE)
         try:
-            self.db = SQLDatabase.from_uri(
-                connection_string,
-                include_tables=[os.getenv("TABLE_NAME", self.DEFAULT_TABLE)],
-                sample_rows_in_table_info=2
-            )
+            self.db = get_database(connection_string, self._table_name)
         except Exception as e:
             raise ConnectionError(f"Error conectando DB: {e}")
+        
+        # Versión de los datos para la caché de respuestas
+        self._version_table = True
+        self.data_version = DataVersion(
+            self._fetch_data_version,
+            ttl=int(os.getenv("DATA_VERSION_TTL", "60"))
+        )
+    
+    def _fetch_data_version(self) -> str:
+        """
+        Contador de version_datos (sql/006_version_datos.sql), que cambia con
+        cada escritura; sin esa tabla, conteo + ID máximo (no ve los UPDATE)
+        """
+        with self.db._engine.connect() as connection:
+            if self._version_table:
+                try:
+                    version = connection.execute(
+                        text("SELECT version, reescrituras FROM version_datos WHERE tabla = :tabla"),
+                        {"tabla": self._table_name}
+                    ).one_or_none()
+                    if version is not None:
+                        return f"v{version[0]}:{version[1]}"
+                except Exception as e:
+                    logger.warning(f"version_datos no disponible, usando conteo + ID máximo: {e}")
+                    connection.rollback()
+                self._version_table = False
+            count, max_id = connection.execute(
+                text(f'SELECT COUNT(*), MAX("ID") FROM "{self._table_name}"')
+            ).one()
+        return f"{count}:{max_id}"
+    
+    @property
+    def _cache_provider(self) -> str:
+        # Las respuestas del agente SQL no se mezclan con las del Chat v4
+        return f"sql:{self.provider}"
 
     def _setup_llm(self):
         # Configuración específica para que DeepSeek no alucine
@@ -54,7 +526,9 @@ class LangChainChatbot:
                 temperature=0, # Cero creatividad, solo lógica
                 openai_api_key=api_key,
                 openai_api_base="https://api.deepseek.com",
-                max_tokens=1024
+                max_tokens=1024,
+                streaming=True,
+                stream_usage=True
             )
             self.provider_name = "DeepSeek"
             
@@ -65,7 +539,8 @@ class LangChainChatbot:
             self.llm = ChatGroq(
                 model="llama-3.3-70b-versatile",
                 temperature=0,
-                api_key=api_key
+                api_key=api_key,
+                streaming=True
             )
             self.provider_name = "Groq Llama 3.3"
             
@@ -74,12 +549,19 @@ class LangChainChatbot:
             self.llm = ChatOpenAI(
                 model="gpt-4o-mini",
                 temperature=0,
-                openai_api_key=api_key
+                openai_api_key=api_key,
+                streaming=True,
+                stream_usage=True
             )
             self.provider_name = "OpenAI"
 
     def _create_agent(self):
-        self.toolkit = SQLDatabaseToolkit(db=self.db, llm=self.llm)
+        self.toolkit = CachedSQLDatabaseToolkit(
+            db=self.db,
+            llm=self.llm,
+            query_cache=_QUERY_CACHE,
+            data_version=self.data_version
+        )
         
         # Configuración específica según provider
         if self.provider == "deepseek":
@@ -248,46 +730,127 @@ RECUERDA:
 ¡EMPIEZA AHORA! NO INVENTES DATOS.
 """
     
+    def _agent_input(self, user_message: str) -> str:
+        # Para DeepSeek, agregar instrucción específica
+        if self.provider == "deepseek":
+            # Instrucción clara para ejecutar SQL
+            return f"""
+            Pregunta del usuario: {user_message}
+            
+            IMPORTANTE: Debes ejecutar una consulta SQL para responder.
+            Usa Action: sql_db_query seguido de la consulta SQL.
+            """
+        # Groq y OpenAI funcionan bien con el mensaje directo
+        return user_message
+    
+    @staticmethod
+    def _clean_response(response: str) -> str:
+        # Limpiar respuesta si es muy verbose
+        if "Entering new SQL Agent" in response:
+            lines = response.split('\n')
+            # Buscar la respuesta final
+            clean_response = []
+            capture = False
+            for line in lines:
+                if "Final Answer:" in line:
+                    capture = True
+                    clean_response.append(line.replace("Final Answer:", "").strip())
+                elif capture and not line.startswith(">"):
+                    clean_response.append(line)
+            
+            if clean_response:
+                return '\n'.join(clean_response).strip()
+        
+        return response
+    
     def chat(self, user_message: str) -> str:
         if not user_message: 
             return "Por favor, haz una pregunta sobre las importaciones."
         
+        with start_trace("chat_sql", provider=self.provider, question=user_message):
+            return self._chat(user_message)
+    
+    def _chat(self, user_message: str) -> str:
+        data_version = self.data_version.get() if answer_cache is not None else None
+        if answer_cache is not None:
+            cached = answer_cache.get(user_message, self._cache_provider, data_version)
+            if cached is not None:
+                record(path="cache")
+                return cached
+        
+        record(path="agent")
         try:
-            # Para DeepSeek, agregar instrucción específica
-            if self.provider == "deepseek":
-                # Instrucción clara para ejecutar SQL
-                enhanced_message = f"""
-                Pregunta del usuario: {user_message}
-                
-                IMPORTANTE: Debes ejecutar una consulta SQL para responder.
-                Usa Action: sql_db_query seguido de la consulta SQL.
-                """
-                response = self.agent.run(enhanced_message)
-            else:
-                # Groq y OpenAI funcionan bien con el mensaje directo
-                response = self.agent.run(user_message)
-            
-            # Limpiar respuesta si es muy verbose
-            if "Entering new SQL Agent" in response:
-                lines = response.split('\n')
-                # Buscar la respuesta final
-                clean_response = []
-                capture = False
-                for line in lines:
-                    if "Final Answer:" in line:
-                        capture = True
-                        clean_response.append(line.replace("Final Answer:", "").strip())
-                    elif capture and not line.startswith(">"):
-                        clean_response.append(line)
-                
-                if clean_response:
-                    return '\n'.join(clean_response).strip()
-            
+            response = self._clean_response(self.agent.run(self._agent_input(user_message), callbacks=[_TraceHandler()]))
+            if answer_cache is not None:
+                answer_cache.set(user_message, self._cache_provider, data_version, response)
             return response
             
         except Exception as e:
+            record(path="error")
             return self._handle_error(e)
     
+    def chat_stream(self, user_message: str) -> Iterator[Dict[str, str]]:
+        """
+        Versión streaming de chat(). Generador de eventos:
+        - {"type": "status", "content": ...} por cada herramienta que usa el agente
+        - {"type": "token", "content": ...} con la respuesta final a medida que se genera
+        - {"type": "trace", "content": Trace} al final, con los tiempos del turno (si hay tracing)
+        La traza viaja en el evento y no en la instancia: for_provider la comparte entre sesiones.
+        """
+        if not user_message:
+            yield {"type": "token", "content": "Por favor, haz una pregunta sobre las importaciones."}
+            return
+        
+        with start_trace("chat_sql", provider=self.provider, question=user_message) as trace:
+            yield from self._chat_stream(user_message)
+        if trace is not None:
+            yield {"type": "trace", "content": trace}
+    
+    def _chat_stream(self, user_message: str) -> Iterator[Dict[str, str]]:
+        data_version = self.data_version.get() if answer_cache is not None else None
+        if answer_cache is not None:
+            cached = answer_cache.get(user_message, self._cache_provider, data_version)
+            if cached is not None:
+                record(path="cache")
+                yield {"type": "status", "content": "⚡ Respuesta desde caché"}
+                yield {"type": "token", "content": cached}
+                return
+        
+        events: queue.Queue = queue.Queue()
+        handler = _AgentStreamHandler(events)
+        result: Dict[str, Any] = {}
+        
+        def run_agent():
+            try:
+                result["output"] = self.agent.run(self._agent_input(user_message), callbacks=[handler, _TraceHandler()])
+            except Exception as e:
+                result["error"] = e
+            finally:
+                events.put(None)
+        
+        record(path="agent")
+        # bind: el hilo del agente hereda la traza del turno
+        threading.Thread(target=bind(run_agent), daemon=True).start()
+        answer = ""
+        while True:
+            event = events.get()
+            if event is None:
+                break
+            if event["type"] == "token":
+                answer += event["content"]
+            yield event
+        
+        if "error" in result:
+            record(path="error")
+            yield {"type": "token", "content": self._handle_error(result["error"])}
+            return
+        if not handler.streamed:
+            # El agente terminó sin "Final Answer:" en streaming (ej: early stopping)
+            answer = self._clean_response(result["output"])
+            yield {"type": "token", "content": answer}
+        if answer_cache is not None:
+            answer_cache.set(user_message, self._cache_provider, data_version, answer.strip())
+    
     def _handle_error(self, error: Exception) -> str:
         """Maneja errores de forma amigable"""
         error_msg = str(error).lower()
@@ -317,6 +880,10 @@ RECUERDA:
             logger.error(f"Error desconocido: {error}")
             return f"❌ Error al procesar la pregunta: {str(error)[:200]}"
     
+    def cache_stats(self) -> Dict[str, Any]:
+        """Métricas de la caché de sql_db_query (hits, misses, tamaño...)"""
+        return _QUERY_CACHE.stats() if _QUERY_CACHE is not None else {}
+    
     def get_table_info(self) -> str:
         """Obtiene información de la tabla"""
         try:
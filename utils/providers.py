@@ -0,0 +1,83 @@
+"""
+Caché de salud de providers/modelos LLM
+Evita probar los modelos de Groq con una llamada real en cada mensaje:
+el resultado del probe se comparte en todo el proceso y se re-valida en
+segundo plano cada cierto intervalo.
+"""
+import os
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+class ProviderHealthCache:
+    """Recuerda qué modelo funciona por provider y lo re-prueba en background"""
+
+    def __init__(self, refresh_interval=600):
+        self.refresh_interval = refresh_interval
+        self._entries = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def _probe_all(self, provider, candidates, probe):
+        """Prueba los modelos en orden y guarda el primero que responde (o None)"""
+        model = None
+        for candidate in candidates:
+            try:
+                probe(candidate)
+                model = candidate
+                break
+            except Exception as e:
+                print(f"⚠️ {provider} modelo {candidate} no funciona: {e}")
+        with self._lock:
+            self._entries[provider] = {"model": model, "checked_at": time.time()}
+            self._refreshing.discard(provider)
+        return model
+
+    def _refresh_in_background(self, provider, candidates, probe):
+        with self._lock:
+            if provider in self._refreshing:
+                return
+            self._refreshing.add(provider)
+        thread = threading.Thread(
+            target=self._probe_all,
+            args=(provider, list(candidates), probe),
+            daemon=True
+        )
+        thread.start()
+
+    def get_model(self, provider, candidates, probe):
+        """
+        Devuelve el modelo sano del provider (None si ninguno funciona).
+        Solo la primera vez se prueba de forma síncrona; después se usa el
+        valor cacheado y, si venció, se re-prueba en segundo plano.
+
+        Args:
+            provider (str): Nombre del provider (ej: "groq")
+            candidates (list): Modelos en orden de preferencia
+            probe (callable): probe(model) lanza excepción si el modelo no responde
+        """
+        with self._lock:
+            entry = self._entries.get(provider)
+        if entry is None:
+            return self._probe_all(provider, candidates, probe)
+        if time.time() - entry["checked_at"] > self.refresh_interval:
+            self._refresh_in_background(provider, candidates, probe)
+        return entry["model"]
+
+    def mark_failed(self, provider):
+        """Olvida el resultado del provider para que se vuelva a probar"""
+        with self._lock:
+            self._entries.pop(provider, None)
+
+    def status(self):
+        with self._lock:
+            return {provider: dict(entry) for provider, entry in self._entries.items()}
+
+
+# Instancia compartida por todas las sesiones del proceso
+provider_health = ProviderHealthCache(
+    refresh_interval=int(os.getenv("PROVIDER_PROBE_INTERVAL", "600"))
+)
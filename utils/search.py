@@ -0,0 +1,136 @@
+"""
+Búsqueda difusa de texto
+Llama a las funciones de sql/004_busqueda_trigram.sql (pg_trgm) vía
+client.rpc para que las búsquedas por texto usen los índices GIN de
+trigramas y devuelvan las filas ordenadas por relevancia, y para reescribir
+valores de entidad mal escritos ("BAYR" -> "BAYER S.A.") al más parecido
+que existe en la tabla.
+
+Sin las funciones instaladas (o con el snapshot local) la misma escala de
+relevancia se calcula en Python con difflib. Con el snapshot, los valores de
+entidad se resuelven con los índices de trigramas de utils/entities.py;
+closest_value queda para las columnas que el diccionario no indexa.
+"""
+import difflib
+import os
+import pandas as pd
+from .tracing import record, payload_bytes
+
+SIMILARITY_THRESHOLD = float(os.getenv("SEARCH_SIMILARITY", "0.5"))
+
+
+def word_similarity(value, text):
+    """
+    Aproximación de word_similarity de pg_trgm: el mayor parecido entre value
+    y un tramo de palabras consecutivas de text con la misma cantidad de palabras
+    """
+    value = str(value).lower()
+    words = str(text).lower().split()
+    if not words:
+        return 0.0
+    size = max(1, len(value.split()))
+    return max(
+        difflib.SequenceMatcher(None, value, " ".join(words[i:i + size])).ratio()
+        for i in range(max(1, len(words) - size + 1))
+    )
+
+
+def relevance(text, value):
+    """Misma escala que fn_expresion_relevancia: igual = 2, lo contiene = 1, + similitud (0..1)"""
+    if text is None or (isinstance(text, float) and pd.isna(text)):
+        return 0.0
+    text_lower, value_lower = str(text).lower(), str(value).lower()
+    base = 2 if text_lower == value_lower else 1 if value_lower in text_lower else 0
+    return base + word_similarity(value_lower, text_lower)
+
+
+def rank_rows(rows, filters):
+    """Ordena filas por relevancia total respecto de {columna: valor} y la agrega como "relevancia" """
+    scored = [
+        {**row, "relevancia": round(sum(relevance(row.get(column), value) for column, value in filters.items()), 3)}
+        for row in rows or []
+    ]
+    return sorted(scored, key=lambda row: row["relevancia"], reverse=True)
+
+
+def closest_value(values, value, threshold=SIMILARITY_THRESHOLD):
+    """
+    Resolución local de una entidad entre los valores distintos de una columna:
+    value si alguno lo contiene, si no el más parecido (>= threshold), si no None
+    """
+    values = pd.Series(values, dtype=object).dropna().astype(str)
+    if values.empty:
+        return None
+    if values.str.contains(str(value), case=False, regex=False).any():
+        return value
+    scores = values.map(lambda candidate: word_similarity(value, candidate))
+    best = scores.idxmax()
+    return values[best] if scores[best] >= threshold else None
+
+
+class TrigramSearch:
+    """Búsqueda por trigramas en el servidor con degradación a ilike"""
+
+    def __init__(self, client, table_name, threshold=SIMILARITY_THRESHOLD):
+        self.client = client
+        self.table_name = table_name
+        self.threshold = threshold
+        self.available = True
+
+    def _call(self, function_name, params):
+        """
+        Ejecuta una función RPC.
+        Si la función no está instalada se desactiva la búsqueda difusa; ante
+        otros errores solo se devuelve None para que el llamador use ilike.
+        """
+        if not self.available:
+            return None
+        try:
+            response = self.client.rpc(function_name, params).execute()
+            record(rows=len(response.data or []), bytes=payload_bytes(response.data))
+            return response.data or []
+        except Exception as e:
+            error_msg = str(e)
+            if "PGRST202" in error_msg or "Could not find the function" in error_msg:
+                print(f"⚠️ Función {function_name} no instalada (sql/004_busqueda_trigram.sql), usando ilike")
+                self.available = False
+            else:
+                print(f"⚠️ Error en búsqueda difusa {function_name}: {e}")
+            return None
+
+    def match_values(self, column, value, limit=5):
+        """
+        Valores distintos de column que contienen o se parecen a value
+
+        Returns:
+            list | None: [{"valor", "similitud", "contiene"}], primero los que lo contienen
+        """
+        return self._call("fn_buscar_valores", {
+            "p_table": self.table_name,
+            "p_column": column,
+            "p_value": str(value),
+            "p_limit": int(limit),
+            "p_umbral": self.threshold
+        })
+
+    def resolve(self, column, value):
+        """value si algún valor de la columna lo contiene, si no el más parecido (None si no hay)"""
+        matches = self.match_values(column, value, limit=1)
+        if not matches:
+            return None
+        return value if matches[0]["contiene"] else matches[0]["valor"]
+
+    def search(self, filters, columns=None, limit=50):
+        """
+        Filas que contienen o se parecen a cada valor de filters, ordenadas por relevancia
+
+        Returns:
+            list | None: filas (con la clave "relevancia") o None si no se pudo buscar
+        """
+        return self._call("fn_buscar_importaciones", {
+            "p_table": self.table_name,
+            "p_filtros": {column: str(value) for column, value in filters.items()},
+            "p_columns": columns,
+            "p_limit": int(limit),
+            "p_umbral": self.threshold
+        })
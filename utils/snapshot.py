@@ -0,0 +1,228 @@
+"""
+Snapshot local (Parquet) de la tabla de importaciones
+Se refresca de forma incremental usando una marca de agua sobre "ID"
+para que las analíticas no descarguen toda la tabla en cada turno del chat.
+La versión de los datos (sql/006_version_datos.sql) dice si hubo cambios y
+si alguno fue una modificación en el lugar, que la marca de agua no ve.
+"""
+import os
+import threading
+import time
+import pandas as pd
+
+
+class TableSnapshot:
+    """
+    Copia columnar de la tabla guardada en disco (Parquet) y en memoria.
+
+    - Carga inicial: descarga toda la tabla con SupabaseClient.iter_importaciones.
+    - Sin cambios en la versión de los datos no se descarga nada.
+    - Si cambió el contador de reescrituras (UPDATE, DELETE, TRUNCATE o
+      upserts de la carga incremental) se reconstruye desde cero.
+    - Si no, refresco incremental: solo pide filas con ID > marca de agua.
+    - Si el conteo remoto no coincide con el local (borrados o recargas
+      completas sin version_datos), también se reconstruye desde cero.
+    """
+
+    def __init__(self, db, path=None, refresh_interval=300, watermark_column="ID"):
+        self.db = db
+        self.path = path or os.path.join(".cache", f"{db.table_name}.parquet")
+        self.refresh_interval = refresh_interval
+        self.watermark_column = watermark_column
+
+        self.df = None
+        self.high_water_id = None
+        # Versión de los datos con la que se sincronizó por última vez
+        self.version = None
+        self.last_refresh = 0.0
+        self._lock = threading.Lock()
+        self._listeners = []
+
+        self._load_from_disk()
+
+    # ========== PERSISTENCIA ==========
+
+    def _load_from_disk(self):
+        """Lee el snapshot previo si existe (arranque en frío rápido)"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            self.df = pd.read_parquet(self.path)
+            self._update_watermarks()
+            if os.path.exists(f"{self.path}.version"):
+                with open(f"{self.path}.version", encoding="utf-8") as f:
+                    self.version = f.read().strip() or None
+            print(f"📦 Snapshot cargado desde disco: {len(self.df)} registros")
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el snapshot {self.path}: {e}")
+            self.df = None
+
+    def _save_to_disk(self):
+        """Guarda el snapshot en Parquet (si pyarrow no está disponible, queda solo en memoria)"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            self.df.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, self.path)
+            self._save_version()
+        except Exception as e:
+            print(f"⚠️ Snapshot solo en memoria, no se pudo guardar en disco: {e}")
+
+    def _save_version(self):
+        """Guarda la versión de los datos junto al Parquet: al arrancar se sabe si hubo reescrituras"""
+        try:
+            with open(f"{self.path}.version", "w", encoding="utf-8") as f:
+                f.write(self.version or "")
+        except OSError as e:
+            print(f"⚠️ No se pudo guardar la versión del snapshot: {e}")
+
+    # ========== NOTIFICACIONES ==========
+
+    def add_listener(self, callback):
+        """
+        Registra callback(kind, rows) para estructuras derivadas (ej: el cubo).
+        kind = 'append' con un DataFrame de filas nuevas, o 'reset' si cambió
+        algo más que agregar filas (recarga, actualización o borrado).
+        """
+        self._listeners.append(callback)
+
+    def _notify(self, kind, rows=None):
+        for callback in self._listeners:
+            try:
+                callback(kind, rows)
+            except Exception as e:
+                print(f"⚠️ Error notificando cambio del snapshot: {e}")
+
+    # ========== DESCARGA ==========
+
+    def _fetch_since(self, last_id):
+        """Descarga (paginando por keyset) todas las filas con ID > last_id"""
+        filters = [(self.watermark_column, "gt", last_id)] if last_id is not None else None
+        return list(self.db.iter_importaciones(filters))
+
+    def _remote_count(self):
+        """Cantidad de filas en la tabla remota (None si no se puede obtener)"""
+        return self.db.count_importaciones()
+
+    def _remote_version(self):
+        """Token de DataVersion del cliente (None si no hay o no se pudo obtener)"""
+        token = getattr(self.db, "data_version_token", None)
+        return token.get() if token is not None else None
+
+    @staticmethod
+    def _rewrites(version):
+        """Contador de reescrituras de un token "v<escrituras>:<reescrituras>" (None si es conteo + ID)"""
+        if not version or not version.startswith("v"):
+            return None
+        return version.split(":", 1)[1]
+
+    @staticmethod
+    def _normalize(df):
+        """Unifica tipos mixtos en columnas de texto para que Parquet los acepte"""
+        for col in df.columns:
+            if df[col].dtype == object:
+                non_null = df[col].dropna()
+                if non_null.map(type).nunique() > 1:
+                    df[col] = df[col].where(df[col].isna(), df[col].astype(str))
+        return df
+
+    def _update_watermarks(self):
+        if self.df is None or self.df.empty:
+            self.high_water_id = None
+            return
+        self.high_water_id = self.df[self.watermark_column].max()
+
+    # ========== REFRESCO ==========
+
+    def refresh(self, force_full=False):
+        """
+        Sincroniza el snapshot con la tabla remota.
+
+        Returns:
+            int: Cantidad de filas nuevas incorporadas
+        """
+        with self._lock:
+            # La versión se lee antes que las filas: nunca queda una más nueva que los datos
+            version = self._remote_version()
+            full = force_full or self.df is None
+            if not full and version is not None and version == self.version:
+                self.last_refresh = time.time()
+                return 0
+            rewrites = self._rewrites(version)
+            known = self._rewrites(self.version)
+            if not full and known is not None and rewrites is not None and rewrites != known:
+                print("🔄 Filas modificadas o borradas en la tabla, recargando snapshot...")
+                full = True
+            new_rows = self._fetch_since(None if full else self.high_water_id)
+
+            appended = None
+            if full:
+                self.df = self._normalize(pd.DataFrame(new_rows))
+            elif new_rows:
+                appended = pd.DataFrame(new_rows)
+                merged = pd.concat([self.df, appended], ignore_index=True)
+                self.df = self._normalize(
+                    merged.drop_duplicates(subset=[self.watermark_column], keep="last").reset_index(drop=True)
+                )
+
+            # Borrados o recargas externas: el conteo deja de coincidir
+            if not full:
+                remote_count = self._remote_count()
+                if remote_count is not None and remote_count != len(self.df):
+                    print(f"🔄 Snapshot desfasado ({len(self.df)} local vs {remote_count} remoto), recargando...")
+                    self.df = self._normalize(pd.DataFrame(self._fetch_since(None)))
+                    full = True
+
+            self._update_watermarks()
+            version_changed = version != self.version
+            self.version = version
+            self.last_refresh = time.time()
+            if full or new_rows:
+                self._save_to_disk()
+                self._notify('reset' if full else 'append', appended)
+            elif version_changed and os.path.exists(self.path):
+                self._save_version()
+            return len(new_rows)
+
+    def is_stale(self):
+        return self.df is None or (time.time() - self.last_refresh) > self.refresh_interval
+
+    def get_dataframe(self):
+        """Devuelve el DataFrame del snapshot, refrescándolo si está vencido"""
+        if self.is_stale():
+            try:
+                self.refresh()
+            except Exception as e:
+                if self.df is None:
+                    raise
+                print(f"⚠️ Error refrescando snapshot, se usan datos locales: {e}")
+        return self.df
+
+    # ========== PARCHES LOCALES (CRUD) ==========
+
+    def upsert_rows(self, rows):
+        """Aplica al snapshot filas insertadas/actualizadas por este proceso"""
+        if self.df is None or not rows:
+            return
+        with self._lock:
+            incoming = pd.DataFrame(rows)
+            only_new = not incoming[self.watermark_column].isin(self.df[self.watermark_column]).any()
+            merged = pd.concat([self.df, incoming], ignore_index=True)
+            self.df = self._normalize(
+                merged.drop_duplicates(subset=[self.watermark_column], keep="last").reset_index(drop=True)
+            )
+            self._update_watermarks()
+            self._notify('append' if only_new else 'reset', incoming)
+
+    def delete_rows(self, ids):
+        """Quita del snapshot filas borradas por este proceso"""
+        if self.df is None:
+            return
+        with self._lock:
+            self.df = self.df[~self.df[self.watermark_column].isin(ids)].reset_index(drop=True)
+            self._update_watermarks()
+            self._notify('reset')
+
+    def invalidate(self):
+        """Fuerza un refresco en el próximo acceso"""
+        self.last_refresh = 0.0
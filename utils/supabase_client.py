@@ -1,78 +1,644 @@
 import os
-from supabase import create_client, Client
+import re
+from itertools import islice
+from supabase import create_client, Client, ClientOptions
 from dotenv import load_dotenv
 from datetime import datetime
 import pandas as pd
+from .snapshot import TableSnapshot
+from .aggregations import AggregationPushdown
+from .cube import RollupCube
+from .cache import TTLCache, cached_result
+from .answer_cache import DataVersion
+from .tracing import traced, record, payload_bytes
+from .search import TrigramSearch, SIMILARITY_THRESHOLD, closest_value, rank_rows
+from .entities import EntityDictionary
 
 load_dotenv()
 
 class SupabaseClient:
-    def __init__(self):
+    FILTER_OPERATORS = ('eq', 'neq', 'gt', 'gte', 'lt', 'lte', 'ilike')
+    
+    # Columnas de BD_Import_IQ (las de texto largo como Descripcion solo se piden si hacen falta)
+    COLUMNS = [
+        "ID", "DUA", "Fecha", "RUC", "Importador", "Embarcador", "Pais_origen",
+        "Descripcion", "Kg_Neto", "Qty_2", "Und_2", "CIF_Tot", "CIF_und",
+        "Marca", "Formulacion", "Concentracion", "Concent_disgregada",
+        "INGREDIENTE_nuevo", "CLASE_SIGIA", "TIPO", "Estado", "Presentacion", "Via"
+    ]
+    
+    # Columnas mínimas para los resúmenes (total registros/Kg/CIF, entidades únicas)
+    SUMMARY_COLUMNS = ["Kg_Neto", "CIF_Tot", "Importador", "Pais_origen"]
+    
+    def __init__(self, use_snapshot=None):
         url = os.getenv("SUPABASE_URL")
         key = os.getenv("SUPABASE_KEY")
         self.table_name = os.getenv("TABLE_NAME", "importaciones")
-        self.client: Client = create_client(url, key)
+        # Timeout HTTP de PostgREST: acota también las herramientas del chat que vencen
+        timeout = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "30"))
+        self.client: Client = create_client(url, key, options=ClientOptions(postgrest_client_timeout=timeout))
+        
+        # Filas por request al paginar (PostgREST suele limitar a 1000)
+        self.page_size = int(os.getenv("PAGE_SIZE", "1000"))
+        
+        # Snapshot local para servir las analíticas sin re-descargar la tabla
+        if use_snapshot is None:
+            use_snapshot = os.getenv("SNAPSHOT_ENABLED", "true").lower() == "true"
+        self.snapshot = None
+        if use_snapshot:
+            self.snapshot = TableSnapshot(
+                self,
+                path=os.getenv("SNAPSHOT_PATH"),
+                refresh_interval=int(os.getenv("SNAPSHOT_REFRESH_SECONDS", "300"))
+            )
+        
+        # Agregaciones en Postgres (sql/001_agregaciones.sql) cuando no hay snapshot
+        self.aggregator = None
+        if os.getenv("AGG_PUSHDOWN", "true").lower() == "true":
+            self.aggregator = AggregationPushdown(self.client, self.table_name, page_size=self.page_size)
+        
+        # Búsqueda difusa con índices de trigramas (sql/004_busqueda_trigram.sql)
+        self.text_search = None
+        if os.getenv("TEXT_SEARCH_ENABLED", "true").lower() == "true":
+            self.text_search = TrigramSearch(self.client, self.table_name)
+        
+        # Cubo año × mes × dimensión: desde el snapshot o desde mv_cubo_importaciones
+        self.cube = None
+        if os.getenv("CUBE_ENABLED", "true").lower() == "true":
+            self.cube = RollupCube(
+                self,
+                view_name=os.getenv("CUBE_VIEW", "mv_cubo_importaciones"),
+                refresh_interval=int(os.getenv("CUBE_REFRESH_SECONDS", "300"))
+            )
+        
+        # Valores canónicos de Marca/Importador/Pais_origen/INGREDIENTE_nuevo para
+        # que el chatbot filtre por igualdad (compartido entre sesiones, como el cubo)
+        self.entities = None
+        if os.getenv("ENTITY_DICTIONARY_ENABLED", "true").lower() == "true":
+            self.entities = EntityDictionary(self)
+        
+        # Caché de resultados compartida por todas las sesiones de Streamlit
+        # (app.py crea una sola instancia con st.cache_resource)
+        self.result_cache = None
+        if os.getenv("RESULT_CACHE_ENABLED", "true").lower() == "true":
+            self.result_cache = TTLCache(
+                max_size=int(os.getenv("RESULT_CACHE_SIZE", "256")),
+                ttl=int(os.getenv("RESULT_CACHE_TTL", "300"))
+            )
+            if self.snapshot is not None:
+                # Cambios detectados al refrescar el snapshot (otras cargas) también invalidan
+                self.snapshot.add_listener(lambda kind, rows: self.invalidate_cache())
+        
+        # Versión de los datos (sql/006_version_datos.sql, o conteo + ID máximo)
+        # para la caché de respuestas del chat
+        self._version_table = True
+        self.data_version_token = DataVersion(
+            self._fetch_data_version,
+            ttl=int(os.getenv("DATA_VERSION_TTL", "60"))
+        )
+    
+    # ========== CACHÉ DE RESULTADOS ==========
+    
+    def invalidate_cache(self):
+        """Vacía la caché de analíticas (se llama tras cada escritura)"""
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        if getattr(self, "data_version_token", None) is not None:
+            self.data_version_token.invalidate()
+    
+    def _after_write(self):
+        """
+        Tras una escritura de este proceso: vacía las cachés y, sin snapshot,
+        refresca la vista del cubo (si no, seguiría sirviendo los datos anteriores)
+        """
+        self.invalidate_cache()
+        if self.cube is not None and self.snapshot is None:
+            self.cube.refresh_view()
+    
+    def cache_stats(self):
+        """Métricas de la caché de analíticas (hits, misses, tamaño...)"""
+        return self.result_cache.stats() if self.result_cache is not None else {}
+    
+    def _fetch_data_version(self):
+        """
+        Contadores de version_datos, "v<escrituras>:<reescrituras>" (sube con
+        cada escritura, incluidos UPDATE y upserts). Sin esa tabla, conteo
+        exacto + ID máximo en un solo request: cambia con inserciones,
+        borrados y recargas, pero no con UPDATE.
+        """
+        if self._version_table:
+            try:
+                version = self._fetch_version(self.table_name)
+                if version is not None:
+                    return version
+                print(f"⚠️ version_datos no tiene fila para {self.table_name}, usando conteo + ID máximo")
+            except Exception as e:
+                print(f"⚠️ Tabla version_datos no disponible (sql/006_version_datos.sql), usando conteo + ID máximo: {e}")
+            self._version_table = False
+        response = self.client.table(self.table_name).select("ID", count="exact").order("ID", desc=True).limit(1).execute()
+        max_id = response.data[0]["ID"] if response.data else None
+        return f"{response.count}:{max_id}"
+    
+    def _fetch_version(self, tabla):
+        """Token "v<escrituras>:<reescrituras>" de version_datos para tabla (None si no tiene fila)"""
+        response = self.client.table("version_datos").select("version,reescrituras").eq("tabla", tabla).limit(1).execute()
+        if not response.data:
+            return None
+        return f"v{response.data[0]['version']}:{response.data[0]['reescrituras']}"
+    
+    @traced("db")
+    def data_version(self):
+        """Token de versión de los datos (None si no se pudo obtener)"""
+        return self.data_version_token.get()
+    
+    # ========== PROYECCIÓN DE COLUMNAS ==========
+    
+    @staticmethod
+    def _projection(columns):
+        """Lista de columnas sin duplicados, siempre con "ID" (None = todas)"""
+        if not columns:
+            return None
+        return list(dict.fromkeys(["ID", *columns]))
+    
+    def _select_clause(self, columns):
+        """Texto para .select(): "*" o las columnas pedidas"""
+        projection = self._projection(columns)
+        return ",".join(projection) if projection else "*"
+    
+    # ========== PAGINACIÓN ==========
+    
+    def _normalize_filters(self, filters):
+        """
+        Acepta dict {columna: valor} (igualdad) o lista de tuplas
+        (columna, operador, valor) y devuelve siempre la lista de tuplas
+        """
+        if not filters:
+            return []
+        if isinstance(filters, dict):
+            return [(column, 'eq', value) for column, value in filters.items()]
+        normalized = []
+        for column, op, value in filters:
+            if op not in self.FILTER_OPERATORS:
+                raise ValueError(f"Operador de filtro no soportado: {op}")
+            normalized.append((column, op, value))
+        return normalized
+    
+    def _iter_pages(self, filters=None, columns=None, page_size=None, table=None):
+        """
+        Recorre la tabla (o la vista indicada en table) por páginas ordenadas
+        por "ID" (keyset). En la primera página se pide el conteo exacto; si el
+        servidor recorta las páginas (max-rows) se sigue avanzando hasta cubrir
+        ese total.
+        """
+        page_size = page_size or self.page_size
+        filters = self._normalize_filters(filters)
+        select = self._select_clause(columns)
+        
+        last_id = None
+        total = None
+        fetched = 0
+        while True:
+            query = self.client.table(table or self.table_name).select(select, count="exact" if last_id is None else None)
+            for column, op, value in filters:
+                query = getattr(query, op)(column, value)
+            if last_id is not None:
+                query = query.gt("ID", last_id)
+            response = query.order("ID").limit(page_size).execute()
+            
+            page = response.data or []
+            record(rows=len(page), bytes=payload_bytes(page))
+            if last_id is None:
+                total = response.count
+            if not page:
+                break
+            
+            yield page
+            fetched += len(page)
+            last_id = page[-1]["ID"]
+            
+            if len(page) < page_size and (total is None or fetched >= total):
+                break
+    
+    def iter_importaciones(self, filters=None, columns=None, page_size=None):
+        """
+        Generador que recorre todas las importaciones que cumplen los filtros,
+        sin el tope silencioso de filas por request de PostgREST
+        filters: dict {columna: valor} o lista de (columna, operador, valor)
+                 con operador en eq/neq/gt/gte/lt/lte/ilike
+        columns: columnas a traer (None = todas)
+        page_size: filas por request
+        """
+        for page in self._iter_pages(filters, columns, page_size):
+            yield from page
+    
+    @traced("db")
+    def count_importaciones(self, filters=None):
+        """Cantidad exacta de filas que cumplen los filtros (None si falla)"""
+        try:
+            query = self.client.table(self.table_name).select("ID", count="exact")
+            for column, op, value in self._normalize_filters(filters):
+                query = getattr(query, op)(column, value)
+            return query.limit(1).execute().count
+        except Exception as e:
+            print(f"⚠️ No se pudo contar registros: {e}")
+            return None
+    
+    @staticmethod
+    def _year_filters(year):
+        return [("Fecha", "gte", f"{year}-01-01"), ("Fecha", "lte", f"{year}-12-31")]
+    
+    @staticmethod
+    def _entity_filters(filter_column, filter_value, exact=False):
+        if exact:
+            return [(filter_column, "eq", filter_value)]
+        return [(filter_column, "ilike", f"%{filter_value}%")]
+    
+    def _resolve_entity(self, filter_column, filter_value):
+        """
+        Reescribe el valor de una búsqueda por entidad: si ningún valor de la
+        columna lo contiene (ej: "BAYR") se usa el más parecido ("BAYER S.A.").
+        Con snapshot se resuelve en memoria (con los índices de trigramas del
+        diccionario de entidades si la columna está en él); sin él, con
+        fn_buscar_valores.
+        """
+        if not filter_value:
+            return filter_value
+        df = self._snapshot_df()
+        if df is not None:
+            if filter_column not in df.columns:
+                return filter_value
+            if self.entities is not None and self.entities.covers(filter_column):
+                resolved = self.entities.closest(filter_column, filter_value, SIMILARITY_THRESHOLD)
+            else:
+                resolved = closest_value(df[filter_column].dropna().unique(), filter_value)
+        elif self.text_search is not None and self.text_search.available:
+            resolved = self.text_search.resolve(filter_column, filter_value)
+        else:
+            return filter_value
+        if resolved is None or resolved == filter_value:
+            return filter_value
+        record(rewritten=f"{filter_value} -> {resolved}")
+        return resolved
+    
+    # ========== SNAPSHOT HELPERS ==========
+    
+    def _snapshot_df(self):
+        """DataFrame del snapshot local, o None si está desactivado o no disponible"""
+        if self.snapshot is None:
+            return None
+        try:
+            return self.snapshot.get_dataframe()
+        except Exception as e:
+            print(f"⚠️ Snapshot no disponible, consultando Supabase: {e}")
+            return None
+    
+    def _pushdown(self):
+        """Agregador del servidor; solo se usa si no hay snapshot local"""
+        if self.snapshot is None and self.aggregator is not None and self.aggregator.available:
+            return self.aggregator
+        return None
+    
+    def _engines(self):
+        """
+        Motores que responden agregaciones sin recorrer filas, en orden de preferencia:
+        el cubo pre-agregado y luego el pushdown a Postgres
+        """
+        engines = []
+        if self.cube is not None and self.cube.available:
+            engines.append(self.cube)
+        agg = self._pushdown()
+        if agg is not None:
+            engines.append(agg)
+        return engines
+    
+    @staticmethod
+    def _to_records(df):
+        """DataFrame -> lista de dicts con NaN convertidos a None (serializable a JSON)"""
+        return df.astype(object).where(df.notna(), None).to_dict('records')
+    
+    @staticmethod
+    def _apply_filters(df, filters):
+        """Aplica localmente los mismos filtros que se enviarían a PostgREST"""
+        mask = pd.Series(True, index=df.index)
+        for column, op, value in filters:
+            if column not in df.columns:
+                return df.iloc[0:0]
+            series = df[column]
+            # En SQL un NULL nunca cumple la condición
+            mask &= series.notna()
+            if column == 'Fecha':
+                # Fechas ISO: la comparación de texto equivale a la de fechas
+                series = series.astype(str)
+                value = str(value)
+            if op == 'eq':
+                mask &= series == value
+            elif op == 'neq':
+                mask &= series != value
+            elif op == 'gt':
+                mask &= series > value
+            elif op == 'gte':
+                mask &= series >= value
+            elif op == 'lt':
+                mask &= series < value
+            elif op == 'lte':
+                mask &= series <= value
+            elif op == 'ilike':
+                pattern = str(value)
+                inner = pattern[1:-1] if len(pattern) >= 2 and pattern.startswith('%') and pattern.endswith('%') else None
+                if inner is not None and '%' not in inner and '_' not in inner:
+                    mask &= series.astype(str).str.contains(inner, case=False, regex=False, na=False)
+                else:
+                    regex = '^' + re.escape(pattern).replace('%', '.*').replace('_', '.') + '$'
+                    mask &= series.astype(str).str.contains(regex, case=False, regex=True, na=False)
+        return df[mask]
+    
+    def _iter_frames(self, filters=None, columns=None):
+        """
+        Fuente única de datos para las analíticas:
+        el snapshot filtrado (un solo frame) o las páginas remotas como DataFrames
+        """
+        filters = self._normalize_filters(filters)
+        df = self._snapshot_df()
+        if df is not None:
+            if not df.empty:
+                yield self._filter_snapshot(df, filters, columns)
+            return
+        for page in self._iter_pages(filters, columns):
+            yield pd.DataFrame(page)
+    
+    def _filter_snapshot(self, df, filters, columns=None):
+        """Filtra el snapshot copiando solo las columnas proyectadas"""
+        projection = self._projection(columns)
+        if projection is None:
+            return self._apply_filters(df, filters)
+        needed = [c for c in dict.fromkeys(projection + [f[0] for f in filters]) if c in df.columns]
+        filtered = self._apply_filters(df[needed], filters)
+        return filtered[[c for c in projection if c in filtered.columns]]
+    
+    def _collect_records(self, filters=None, columns=None):
+        """Todas las filas que cumplen los filtros como lista de dicts"""
+        df = self._snapshot_df()
+        if df is not None:
+            if df.empty:
+                return []
+            return self._to_records(self._filter_snapshot(df, self._normalize_filters(filters), columns))
+        return list(self.iter_importaciones(filters, columns))
+    
+    # ========== AGREGACIÓN INCREMENTAL ==========
+    
+    def _group_agg(self, filters, group, agg_column, agg_function, columns=None, frames=None):
+        """
+        Agrega por grupo recorriendo los datos página a página.
+        Solo se mantienen sumas/conteos/mín/máx parciales por grupo, así la
+        memoria depende de la cantidad de grupos y no de filas.
+        group: nombre de columna o función df -> Series con la clave de grupo
+        columns: proyección a descargar (por defecto grupo + columna agregada)
+        frames: DataFrames ya descargados (AsyncSupabaseClient); por defecto _iter_frames
+        Returns: pd.Series indexada por grupo, o None si no hubo datos
+        """
+        if columns is None and not callable(group):
+            columns = [group, agg_column]
+        if frames is None:
+            frames = self._iter_frames(filters, columns)
+        partials = None
+        for df in frames:
+            if df.empty or agg_column not in df.columns:
+                continue
+            if callable(group):
+                keys = group(df)
+            elif group in df.columns:
+                keys = df[group]
+            else:
+                continue
+            part = df[agg_column].groupby(keys).agg(['sum', 'count', 'min', 'max'])
+            if partials is None:
+                partials = part
+            else:
+                partials = pd.concat([partials, part]).groupby(level=0).agg(
+                    {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+                )
+        
+        if partials is None:
+            return None
+        if agg_function == 'mean':
+            return partials['sum'] / partials['count']
+        if agg_function in ('sum', 'count', 'min', 'max'):
+            return partials[agg_function]
+        return pd.Series(dtype=float)
+    
+    def _summary(self, filters, columns=None, frames=None):
+        """Totales de registros/Kg/CIF y entidades únicas, de forma incremental"""
+        columns = columns or self.SUMMARY_COLUMNS
+        if frames is None:
+            frames = self._iter_frames(filters, columns)
+        registros = 0
+        total_kg = 0.0
+        total_cif = 0.0
+        cif_count = 0
+        importadores = set()
+        paises = set()
+        for df in frames:
+            if df.empty:
+                continue
+            registros += len(df)
+            if 'Kg_Neto' in df.columns:
+                total_kg += float(df['Kg_Neto'].sum())
+            if 'CIF_Tot' in df.columns:
+                total_cif += float(df['CIF_Tot'].sum())
+                cif_count += int(df['CIF_Tot'].count())
+            if 'Importador' in df.columns:
+                importadores.update(df['Importador'].dropna().unique())
+            if 'Pais_origen' in df.columns:
+                paises.update(df['Pais_origen'].dropna().unique())
+        
+        return {
+            'total_importaciones': registros,
+            'total_kg': total_kg,
+            'total_cif': total_cif,
+            'promedio_cif': total_cif / cif_count if cif_count else 0,
+            'importadores_unicos': len(importadores),
+            'paises_unicos': len(paises)
+        }
+    
+    @staticmethod
+    def _brands(frames):
+        """Marcas (no vacías) presentes en los frames"""
+        found = set()
+        for df in frames:
+            if 'Marca' in df.columns:
+                found.update(m for m in df['Marca'].dropna().unique() if m)
+        return found
+    
+    def _grouped_year(self, year, group_column, agg_column):
+        """Suma de agg_column por group_column en un año (cubo/pushdown o filas)"""
+        for engine in self._engines():
+            grouped = engine.group_by(group_column, agg_column, 'sum', year=year)
+            if grouped is not None:
+                return grouped
+        return self._group_agg(self._year_filters(year), group_column, agg_column, 'sum')
+    
+    def _pushed_new_brands(self, year):
+        """Marcas nuevas del año resueltas por el cubo/pushdown (None si ninguno puede)"""
+        for engine in self._engines():
+            pushed = engine.new_brands_count(year)
+            if pushed is not None:
+                return pushed
+        return None
+    
+    def _brand_set(self, filters):
+        """Marcas presentes en las filas que cumplen los filtros"""
+        return self._brands(self._iter_frames(filters, ["Marca"]))
+    
+    @staticmethod
+    def _compare_grouped(year1, year2, grouped1, grouped2):
+        """Arma el resultado de comparar_periodos a partir de las dos agregaciones"""
+        if grouped1 is None or grouped2 is None or grouped1.empty or grouped2.empty:
+            return {}
+        
+        # Crear dataframe de comparación
+        comparison = pd.DataFrame({
+            f'{year1}': grouped1,
+            f'{year2}': grouped2
+        }).fillna(0)
+        
+        # Calcular cambios
+        comparison['cambio_absoluto'] = comparison[f'{year2}'] - comparison[f'{year1}']
+        comparison['cambio_porcentual'] = ((comparison[f'{year2}'] - comparison[f'{year1}']) / comparison[f'{year1}'].replace(0, 1)) * 100
+        
+        # Identificar entidades nuevas y salientes
+        nuevas = set(grouped2.index) - set(grouped1.index)
+        salientes = set(grouped1.index) - set(grouped2.index)
+        
+        # Ordenar por cambio absoluto
+        comparison_sorted = comparison.sort_values('cambio_absoluto', ascending=False)
+        
+        return {
+            'year1': year1,
+            'year2': year2,
+            'total_year1': float(grouped1.sum()),
+            'total_year2': float(grouped2.sum()),
+            'cambio_total': float(grouped2.sum() - grouped1.sum()),
+            'cambio_porcentual_total': float(((grouped2.sum() - grouped1.sum()) / grouped1.sum()) * 100) if grouped1.sum() > 0 else 0,
+            'top_crecimiento': comparison_sorted.head(10)[['cambio_absoluto', 'cambio_porcentual']].to_dict('index'),
+            'top_decrecimiento': comparison_sorted.tail(10)[['cambio_absoluto', 'cambio_porcentual']].to_dict('index'),
+            'entidades_nuevas': list(nuevas),
+            'entidades_salientes': list(salientes),
+            'cantidad_entidades_year1': len(grouped1),
+            'cantidad_entidades_year2': len(grouped2)
+        }
+    
+    @staticmethod
+    def _year_comparison(year1, year2, stats_year1, stats_year2, metric):
+        """Arma el resultado de get_year_comparison a partir de los dos resúmenes"""
+        key = 'total_kg' if metric == 'Kg_Neto' else 'total_cif'
+        
+        value1 = stats_year1.get(key, 0)
+        value2 = stats_year2.get(key, 0)
+        
+        change = value2 - value1
+        percent_change = (change / value1 * 100) if value1 > 0 else 0
+        
+        return {
+            'year1': year1,
+            'year2': year2,
+            'value1': value1,
+            'value2': value2,
+            'change': change,
+            'percent_change': percent_change
+        }
     
     # ========== CRUD OPERATIONS ==========
     
-    def get_all_importaciones(self, limit=100):
-        """Obtener todas las importaciones"""
+    @traced("db")
+    def get_all_importaciones(self, limit=100, columns=None):
+        """Obtener todas las importaciones (hasta limit, paginando si hace falta)"""
         try:
-            response = self.client.table(self.table_name).select("*").limit(limit).execute()
-            return response.data
+            page_size = min(limit, self.page_size) if limit else None
+            rows = self.iter_importaciones(columns=columns, page_size=page_size)
+            return list(islice(rows, limit)) if limit else list(rows)
         except Exception as e:
             print(f"Error al obtener importaciones: {e}")
             return []
     
-    def get_importacion_by_id(self, id_importacion):
+    @traced("db")
+    def get_importacion_by_id(self, id_importacion, columns=None):
         """Obtener una importación por ID"""
         try:
-            response = self.client.table(self.table_name).select("*").eq("ID", id_importacion).execute()
+            response = self.client.table(self.table_name).select(self._select_clause(columns)).eq("ID", id_importacion).execute()
+            record(rows=len(response.data or []), bytes=payload_bytes(response.data))
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Error al obtener importación: {e}")
             return None
     
-    def search_importaciones(self, filters):
+    @traced("db")
+    def search_importaciones(self, filters, columns=None, exact=()):
         """
-        Buscar importaciones con múltiples filtros
+        Buscar importaciones con múltiples filtros, ordenadas por relevancia
+        (coincidencia exacta, luego las que contienen el valor y luego las
+        parecidas). Usa fn_buscar_importaciones (índices de trigramas) y, si
+        no está instalada, ilike.
         filters: dict con los campos a filtrar
+        columns: columnas a traer (None = todas)
+        exact: campos de filters que ya tienen el valor canónico (filtro por igualdad)
         """
         try:
-            query = self.client.table(self.table_name).select("*")
+            filters = {field: value for field, value in filters.items() if value}
+            exact = [field for field in exact if field in filters]
+            if self.text_search is not None and filters and not exact:
+                rows = self.text_search.search(filters, self._projection(columns))
+                if rows is not None:
+                    return rows
+            
+            query = self.client.table(self.table_name).select(self._select_clause(columns))
             
             for field, value in filters.items():
-                if value:
+                if field in exact:
+                    query = query.eq(field, value)
+                else:
                     query = query.ilike(field, f"%{value}%")
             
             response = query.limit(50).execute()
-            return response.data
+            record(rows=len(response.data or []), bytes=payload_bytes(response.data))
+            return rank_rows(response.data, {field: value for field, value in filters.items() if field not in exact})
         except Exception as e:
             print(f"Error en búsqueda: {e}")
             return []
     
+    @traced("db")
     def add_importacion(self, data):
         """Agregar nueva importación"""
         try:
             response = self.client.table(self.table_name).insert(data).execute()
+            if self.snapshot is not None:
+                self.snapshot.upsert_rows(response.data)
+            self._after_write()
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Error al agregar importación: {e}")
             return None
     
+    @traced("db")
     def update_importacion(self, id_importacion, data):
         """Actualizar importación existente"""
         try:
             response = self.client.table(self.table_name).update(data).eq("ID", id_importacion).execute()
+            if self.snapshot is not None:
+                self.snapshot.upsert_rows(response.data)
+            self._after_write()
             return response.data[0] if response.data else None
         except Exception as e:
             print(f"Error al actualizar importación: {e}")
             return None
     
+    @traced("db")
     def delete_importacion(self, id_importacion):
         """Eliminar importación"""
         try:
             response = self.client.table(self.table_name).delete().eq("ID", id_importacion).execute()
+            if self.snapshot is not None:
+                self.snapshot.delete_rows([id_importacion])
+            self._after_write()
             return True
         except Exception as e:
             print(f"Error al eliminar importación: {e}")
@@ -80,83 +646,92 @@ class SupabaseClient:
     
     # ========== ANALYTICS QUERIES ==========
     
-    def get_importaciones_by_pais(self, pais):
+    @traced("db")
+    def get_importaciones_by_pais(self, pais, columns=None):
         """Obtener importaciones por país de origen"""
         try:
-            response = self.client.table(self.table_name).select("*").eq("Pais_origen", pais).execute()
-            return response.data
+            return self._collect_records({"Pais_origen": pais}, columns)
         except Exception as e:
             print(f"Error: {e}")
             return []
     
-    def get_importaciones_by_importador(self, importador):
-        """Obtener importaciones por importador"""
+    @traced("db")
+    def get_importaciones_by_importador(self, importador, columns=None, exact=False):
+        """
+        Obtener importaciones por importador (el nombre puede estar mal escrito)
+        exact: True si importador ya es el valor canónico (filtro por igualdad)
+        """
         try:
-            response = self.client.table(self.table_name).select("*").ilike("Importador", f"%{importador}%").execute()
-            return response.data
+            if not exact:
+                importador = self._resolve_entity("Importador", importador)
+            return self._collect_records(self._entity_filters("Importador", importador, exact), columns)
         except Exception as e:
             print(f"Error: {e}")
             return []
     
-    def get_importaciones_by_date_range(self, fecha_inicio, fecha_fin):
+    @traced("db")
+    def get_importaciones_by_date_range(self, fecha_inicio, fecha_fin, columns=None):
         """Obtener importaciones en rango de fechas"""
         try:
-            response = self.client.table(self.table_name).select("*").gte("Fecha", fecha_inicio).lte("Fecha", fecha_fin).execute()
-            return response.data
+            return self._collect_records([("Fecha", "gte", fecha_inicio), ("Fecha", "lte", fecha_fin)], columns)
         except Exception as e:
             print(f"Error: {e}")
             return []
     
+    @traced("db")
+    @cached_result()
     def get_summary_stats(self):
         """Obtener estadísticas resumidas"""
         try:
-            all_data = self.get_all_importaciones(limit=10000)
-            if not all_data:
+            stats = None
+            if self.cube is not None and self.cube.available:
+                stats = self.cube.summary_by_year(None)
+            if stats is None:
+                stats = self._summary(None)
+            if not stats['total_importaciones']:
                 return {}
             
-            df = pd.DataFrame(all_data)
-            
-            stats = {
-                "total_importaciones": len(df),
-                "total_kg": df['Kg_Neto'].sum(),
-                "total_cif": df['CIF_Tot'].sum(),
-                "paises_unicos": df['Pais_origen'].nunique(),
-                "importadores_unicos": df['Importador'].nunique(),
-                "promedio_cif": df['CIF_Tot'].mean()
+            return {
+                "total_importaciones": stats['total_importaciones'],
+                "total_kg": stats['total_kg'],
+                "total_cif": stats['total_cif'],
+                "paises_unicos": stats['paises_unicos'],
+                "importadores_unicos": stats['importadores_unicos'],
+                "promedio_cif": stats['promedio_cif']
             }
-            return stats
         except Exception as e:
             print(f"Error en estadísticas: {e}")
             return {}
     
-    def get_importaciones_by_year(self, year):
-        """Obtener todas las importaciones de un año específico"""
+    @traced("db")
+    def get_importaciones_by_year(self, year, columns=None):
+        """
+        Obtener todas las importaciones de un año específico
+        columns: columnas a traer (None = todas)
+        """
         try:
-            fecha_inicio = f"{year}-01-01"
-            fecha_fin = f"{year}-12-31"
-            response = self.client.table(self.table_name).select("*").gte("Fecha", fecha_inicio).lte("Fecha", fecha_fin).execute()
-            return response.data
+            return self._collect_records(self._year_filters(year), columns)
         except Exception as e:
             print(f"Error: {e}")
             return []
     
+    @traced("db")
+    @cached_result()
     def get_unique_values_by_year(self, column, year):
         """Obtener valores únicos de una columna para un año específico"""
         try:
-            data = self.get_importaciones_by_year(year)
-            if not data:
-                return []
-            
-            df = pd.DataFrame(data)
-            if column not in df.columns:
-                return []
-            
-            unique_values = df[column].dropna().unique().tolist()
-            return unique_values
+            unique_values = {}
+            for df in self._iter_frames(self._year_filters(year), [column]):
+                if column not in df.columns:
+                    continue
+                unique_values.update(dict.fromkeys(df[column].dropna().unique().tolist()))
+            return list(unique_values)
         except Exception as e:
             print(f"Error: {e}")
             return []
     
+    @traced("db")
+    @cached_result()
     def get_aggregated_by_year(self, year, group_column, agg_column='Kg_Neto', agg_function='sum'):
         """
         Obtener datos agregados por año
@@ -166,34 +741,23 @@ class SupabaseClient:
         agg_function: 'sum', 'mean', 'count', 'min', 'max'
         """
         try:
-            data = self.get_importaciones_by_year(year)
-            if not data:
-                return {}
-            
-            df = pd.DataFrame(data)
+            for engine in self._engines():
+                pushed = engine.group_by(group_column, agg_column, agg_function, year=year)
+                if pushed is not None:
+                    return pushed.to_dict()
             
-            if group_column not in df.columns or agg_column not in df.columns:
+            result = self._group_agg(self._year_filters(year), group_column, agg_column, agg_function)
+            if result is None:
                 return {}
             
-            if agg_function == 'sum':
-                result = df.groupby(group_column)[agg_column].sum().to_dict()
-            elif agg_function == 'mean':
-                result = df.groupby(group_column)[agg_column].mean().to_dict()
-            elif agg_function == 'count':
-                result = df.groupby(group_column)[agg_column].count().to_dict()
-            elif agg_function == 'min':
-                result = df.groupby(group_column)[agg_column].min().to_dict()
-            elif agg_function == 'max':
-                result = df.groupby(group_column)[agg_column].max().to_dict()
-            else:
-                result = {}
-            
-            return result
+            return result.to_dict()
         except Exception as e:
             print(f"Error: {e}")
             return {}
     
-    def get_time_series_by_entity(self, filter_column, filter_value, group_by_time='year', agg_column='Kg_Neto', agg_function='sum'):
+    @traced("db")
+    @cached_result(casefold=("filter_value",))
+    def get_time_series_by_entity(self, filter_column, filter_value, group_by_time='year', agg_column='Kg_Neto', agg_function='sum', exact=False):
         """
         Análisis temporal de una entidad específica (marca, importador, país)
         filter_column: columna para filtrar (ej: 'Marca', 'Importador', 'Pais_origen')
@@ -201,35 +765,37 @@ class SupabaseClient:
         group_by_time: 'year' o 'month' (solo year por ahora)
         agg_column: columna a agregar
         agg_function: función de agregación
+        exact: True si filter_value ya es el valor canónico (igualdad en lugar de ilike)
         """
         try:
-            # Obtener todos los datos filtrados por la entidad
-            response = self.client.table(self.table_name).select("*").ilike(filter_column, f"%{filter_value}%").execute()
-            
-            if not response.data:
+            if agg_function not in ('sum', 'mean', 'count'):
                 return {}
             
-            df = pd.DataFrame(response.data)
-            
-            # Convertir Fecha a datetime
-            df['Fecha'] = pd.to_datetime(df['Fecha'])
-            df['year'] = df['Fecha'].dt.year
-            
-            # Agrupar por año
-            if agg_function == 'sum':
-                result = df.groupby('year')[agg_column].sum().to_dict()
-            elif agg_function == 'mean':
-                result = df.groupby('year')[agg_column].mean().to_dict()
-            elif agg_function == 'count':
-                result = df.groupby('year')[agg_column].count().to_dict()
-            else:
-                result = {}
+            if not exact:
+                filter_value = self._resolve_entity(filter_column, filter_value)
+            for engine in self._engines():
+                pushed = engine.time_series(filter_column, filter_value, agg_column, agg_function, exact=exact)
+                if pushed is not None:
+                    return pushed.to_dict()
+            
+            # Agrupar por año de la Fecha
+            result = self._group_agg(
+                self._entity_filters(filter_column, filter_value, exact),
+                lambda df: pd.to_datetime(df['Fecha']).dt.year.rename('year'),
+                agg_column,
+                agg_function,
+                columns=['Fecha', agg_column]
+            )
+            if result is None:
+                return {}
             
-            return result
+            return {int(year): value for year, value in result.items()}
         except Exception as e:
             print(f"Error: {e}")
             return {}
     
+    @traced("db")
+    @cached_result()
     def get_top_n_global(self, group_column, agg_column='Kg_Neto', agg_function='sum', n=10, year=None):
         """
         Obtener el top N de entidades (marcas, importadores, países) a nivel histórico o por año
@@ -240,29 +806,18 @@ class SupabaseClient:
         year: opcional, si se especifica filtra por año
         """
         try:
-            if year:
-                # Filtrar por año
-                data = self.get_importaciones_by_year(year)
-            else:
-                # Obtener todos los datos históricos
-                data = self.get_all_importaciones(limit=100000)
-            
-            if not data:
+            if agg_function not in ('sum', 'mean', 'count'):
                 return {}
             
-            df = pd.DataFrame(data)
+            for engine in self._engines():
+                pushed = engine.group_by(group_column, agg_column, agg_function, year=year, limit=n)
+                if pushed is not None:
+                    return pushed.to_dict()
             
-            if group_column not in df.columns or agg_column not in df.columns:
-                return {}
-            
-            # Agrupar y agregar
-            if agg_function == 'sum':
-                result = df.groupby(group_column)[agg_column].sum()
-            elif agg_function == 'mean':
-                result = df.groupby(group_column)[agg_column].mean()
-            elif agg_function == 'count':
-                result = df.groupby(group_column)[agg_column].count()
-            else:
+            # Histórico completo o filtrado por año
+            filters = self._year_filters(year) if year else None
+            result = self._group_agg(filters, group_column, agg_column, agg_function)
+            if result is None:
                 return {}
             
             # Ordenar y tomar top N
@@ -273,42 +828,82 @@ class SupabaseClient:
             print(f"Error: {e}")
             return {}
     
-    def get_entity_total_historico(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum'):
+    @traced("db")
+    @cached_result(casefold=("filter_value",))
+    def get_entity_total_historico(self, filter_column, filter_value, agg_column='Kg_Neto', agg_function='sum', exact=False):
         """
         Obtener el total histórico de una entidad específica (todos los años agregados)
         filter_column: columna para filtrar (ej: 'Marca', 'Importador')
         filter_value: valor a buscar
         agg_column: columna a agregar
         agg_function: función de agregación
+        exact: True si filter_value ya es el valor canónico (igualdad en lugar de ilike)
         """
         try:
-            # Obtener todos los datos de la entidad
-            response = self.client.table(self.table_name).select("*").ilike(filter_column, f"%{filter_value}%").execute()
-            
-            if not response.data:
+            if not exact:
+                filter_value = self._resolve_entity(filter_column, filter_value)
+            for engine in self._engines():
+                pushed = engine.entity_total(filter_column, filter_value, agg_column, agg_function, exact=exact)
+                if pushed is not None:
+                    if not pushed['registros']:
+                        return {}
+                    return {
+                        'total': float(pushed['total'] or 0),
+                        'registros': int(pushed['registros']),
+                        'promedio': float(pushed['promedio'] or 0),
+                        'min': float(pushed['minimo'] or 0),
+                        'max': float(pushed['maximo'] or 0),
+                        'anio_inicio': pushed['anio_inicio'],
+                        'anio_fin': pushed['anio_fin']
+                    }
+            
+            # Acumular totales de la entidad página a página
+            registros = 0
+            suma = 0.0
+            valores = 0
+            minimo = None
+            maximo = None
+            anio_inicio = None
+            anio_fin = None
+            for df in self._iter_frames(self._entity_filters(filter_column, filter_value, exact), [agg_column, 'Fecha']):
+                if df.empty:
+                    continue
+                registros += len(df)
+                if agg_column in df.columns and df[agg_column].notna().any():
+                    suma += float(df[agg_column].sum())
+                    valores += int(df[agg_column].count())
+                    minimo = float(df[agg_column].min()) if minimo is None else min(minimo, float(df[agg_column].min()))
+                    maximo = float(df[agg_column].max()) if maximo is None else max(maximo, float(df[agg_column].max()))
+                if 'Fecha' in df.columns:
+                    anios = pd.to_datetime(df['Fecha']).dt.year.dropna()
+                    if not anios.empty:
+                        anio_inicio = int(anios.min()) if anio_inicio is None else min(anio_inicio, int(anios.min()))
+                        anio_fin = int(anios.max()) if anio_fin is None else max(anio_fin, int(anios.max()))
+            
+            if not registros:
                 return {}
             
-            df = pd.DataFrame(response.data)
+            promedio = suma / valores if valores else 0
             
             # Calcular total
             if agg_function == 'sum':
-                total = df[agg_column].sum()
+                total = suma
             elif agg_function == 'mean':
-                total = df[agg_column].mean()
+                total = promedio
             elif agg_function == 'count':
-                total = len(df)
+                total = registros
             else:
                 total = 0
             
             # Estadísticas adicionales
             result = {
                 'total': float(total),
-                'registros': len(df),
-                'promedio': float(df[agg_column].mean()) if agg_column in df.columns else 0,
-                'min': float(df[agg_column].min()) if agg_column in df.columns else 0,
-                'max': float(df[agg_column].max()) if agg_column in df.columns else 0,
-                'anio_inicio': int(pd.to_datetime(df['Fecha']).dt.year.min()) if 'Fecha' in df.columns else None,
-                'anio_fin': int(pd.to_datetime(df['Fecha']).dt.year.max()) if 'Fecha' in df.columns else None
+                'registros': registros,
+                'promedio': float(promedio),
+                'min': minimo if minimo is not None else 0,
+                'max': maximo if maximo is not None else 0,
+                'anio_inicio': anio_inicio,
+                'anio_fin': anio_fin
             }
             
             return result
@@ -316,6 +911,8 @@ class SupabaseClient:
             print(f"Error: {e}")
             return {}
     
+    @traced("db")
+    @cached_result()
     def comparar_periodos(self, year1, year2, group_column, agg_column='Kg_Neto'):
         """
         Comparar dos años y calcular cambios
@@ -325,106 +922,49 @@ class SupabaseClient:
         agg_column: columna a agregar
         """
         try:
-            # Obtener datos de ambos años
-            data_year1 = self.get_importaciones_by_year(year1)
-            data_year2 = self.get_importaciones_by_year(year2)
+            # Agrupar por columna ambos años
+            grouped1 = self._grouped_year(year1, group_column, agg_column)
+            grouped2 = self._grouped_year(year2, group_column, agg_column)
             
-            if not data_year1 or not data_year2:
-                return {}
-            
-            df1 = pd.DataFrame(data_year1)
-            df2 = pd.DataFrame(data_year2)
-            
-            # Agrupar por columna
-            grouped1 = df1.groupby(group_column)[agg_column].sum()
-            grouped2 = df2.groupby(group_column)[agg_column].sum()
-            
-            # Crear dataframe de comparación
-            comparison = pd.DataFrame({
-                f'{year1}': grouped1,
-                f'{year2}': grouped2
-            }).fillna(0)
-            
-            # Calcular cambios
-            comparison['cambio_absoluto'] = comparison[f'{year2}'] - comparison[f'{year1}']
-            comparison['cambio_porcentual'] = ((comparison[f'{year2}'] - comparison[f'{year1}']) / comparison[f'{year1}'].replace(0, 1)) * 100
-            
-            # Identificar entidades nuevas y salientes
-            nuevas = set(grouped2.index) - set(grouped1.index)
-            salientes = set(grouped1.index) - set(grouped2.index)
-            
-            # Ordenar por cambio absoluto
-            comparison_sorted = comparison.sort_values('cambio_absoluto', ascending=False)
-            
-            result = {
-                'year1': year1,
-                'year2': year2,
-                'total_year1': float(grouped1.sum()),
-                'total_year2': float(grouped2.sum()),
-                'cambio_total': float(grouped2.sum() - grouped1.sum()),
-                'cambio_porcentual_total': float(((grouped2.sum() - grouped1.sum()) / grouped1.sum()) * 100) if grouped1.sum() > 0 else 0,
-                'top_crecimiento': comparison_sorted.head(10)[['cambio_absoluto', 'cambio_porcentual']].to_dict('index'),
-                'top_decrecimiento': comparison_sorted.tail(10)[['cambio_absoluto', 'cambio_porcentual']].to_dict('index'),
-                'entidades_nuevas': list(nuevas),
-                'entidades_salientes': list(salientes),
-                'cantidad_entidades_year1': len(grouped1),
-                'cantidad_entidades_year2': len(grouped2)
-            }
-            
-            return result
+            return self._compare_grouped(year1, year2, grouped1, grouped2)
         except Exception as e:
             print(f"Error: {e}")
             return {}
     
+    @traced("db")
+    @cached_result()
     def get_summary_stats_by_year(self, year):
         """
         Obtiene estadísticas resumidas para un año específico
         
         Args:
             year (int): Año a consultar (ej: 2023, 2024, 2025)
-            
+        
         Returns:
             dict: Estadísticas del año
         """
         try:
-            # Filtrar por año
-            response = (
-                self.client.table(self.table_name)
-                .select("*")
-                .gte("Fecha", f"{year}-01-01")
-                .lte("Fecha", f"{year}-12-31")
-                .execute()
-            )
-            
-            data = response.data
-            
-            if not data:
-                return {
-                    'total_importaciones': 0,
-                    'total_kg': 0,
-                    'total_cif': 0,
-                    'promedio_cif': 0,
-                    'importadores_unicos': 0,
-                    'paises_unicos': 0
-                }
-            
-            df = pd.DataFrame(data)
-            
-            stats = {
-                'total_importaciones': len(df),
-                'total_kg': float(df['Kg_Neto'].sum()) if 'Kg_Neto' in df.columns else 0,
-                'total_cif': float(df['CIF_Tot'].sum()) if 'CIF_Tot' in df.columns else 0,
-                'promedio_cif': float(df['CIF_Tot'].mean()) if 'CIF_Tot' in df.columns else 0,
-                'importadores_unicos': df['Importador'].nunique() if 'Importador' in df.columns else 0,
-                'paises_unicos': df['Pais_origen'].nunique() if 'Pais_origen' in df.columns else 0
-            }
-            
-            return stats
-            
+            for engine in self._engines():
+                pushed = engine.summary_by_year(year)
+                if pushed is not None:
+                    return {
+                        'total_importaciones': int(pushed['total_importaciones']),
+                        'total_kg': float(pushed['total_kg']),
+                        'total_cif': float(pushed['total_cif']),
+                        'promedio_cif': float(pushed['promedio_cif']),
+                        'importadores_unicos': int(pushed['importadores_unicos']),
+                        'paises_unicos': int(pushed['paises_unicos'])
+                    }
+            
+            # Filtrar por año (sin datos devuelve todo en cero)
+            return self._summary(self._year_filters(year))
+        
         except Exception as e:
             print(f"Error obteniendo stats de {year}: {e}")
             return {}
-
+    
+    @traced("db")
+    @cached_result()
     def get_new_brands_count(self, year):
         """
         Cuenta cuántas marcas nuevas aparecieron en un año
@@ -432,41 +972,30 @@ class SupabaseClient:
         
         Args:
             year (int): Año a analizar
-            
+        
         Returns:
             int: Número de marcas nuevas
         """
         try:
-            # Obtener marcas del año actual
-            current_year_response = (
-                self.client.table(self.table_name)
-                .select("Marca")
-                .gte("Fecha", f"{year}-01-01")
-                .lte("Fecha", f"{year}-12-31")
-                .execute()
-            )
+            pushed = self._pushed_new_brands(year)
+            if pushed is not None:
+                return pushed
             
-            current_brands = set([row['Marca'] for row in current_year_response.data if row.get('Marca')])
-            
-            # Obtener marcas de años anteriores
-            previous_years_response = (
-                self.client.table(self.table_name)
-                .select("Marca")
-                .lt("Fecha", f"{year}-01-01")
-                .execute()
-            )
-            
-            previous_brands = set([row['Marca'] for row in previous_years_response.data if row.get('Marca')])
+            # Marcas del año actual y de años anteriores
+            current_brands = self._brand_set(self._year_filters(year))
+            previous_brands = self._brand_set([("Fecha", "lt", f"{year}-01-01")])
             
             # Marcas nuevas = marcas del año actual que NO estaban en años anteriores
             new_brands = current_brands - previous_brands
             
             return len(new_brands)
-            
+        
         except Exception as e:
             print(f"Error contando marcas nuevas de {year}: {e}")
             return 0
-
+    
+    @traced("db")
+    @cached_result()
     def get_year_comparison(self, year1, year2, metric='Kg_Neto'):
         """
         Compara métricas entre dos años
@@ -475,7 +1004,7 @@ class SupabaseClient:
             year1 (int): Primer año
             year2 (int): Segundo año
             metric (str): Métrica a comparar ('Kg_Neto' o 'CIF_Tot')
-            
+        
         Returns:
             dict: Comparación con cambio absoluto y porcentual
         """
@@ -483,23 +1012,8 @@ class SupabaseClient:
             stats_year1 = self.get_summary_stats_by_year(year1)
             stats_year2 = self.get_summary_stats_by_year(year2)
             
-            key = 'total_kg' if metric == 'Kg_Neto' else 'total_cif'
-            
-            value1 = stats_year1.get(key, 0)
-            value2 = stats_year2.get(key, 0)
-            
-            change = value2 - value1
-            percent_change = (change / value1 * 100) if value1 > 0 else 0
-            
-            return {
-                'year1': year1,
-                'year2': year2,
-                'value1': value1,
-                'value2': value2,
-                'change': change,
-                'percent_change': percent_change
-            }
-            
+            return self._year_comparison(year1, year2, stats_year1, stats_year2, metric)
+        
         except Exception as e:
             print(f"Error comparando {year1} vs {year2}: {e}")
-            return {}
\ No newline at end of file
+            return {}
@@ -0,0 +1,271 @@
+"""
+Trazas por turno de chat
+Cada pregunta abre una traza y cada paso un span hijo: llamadas al LLM,
+herramientas, métodos de SupabaseClient y consultas SQL del agente. Cada
+span registra su duración y, cuando aplica, filas descargadas, bytes de
+respuesta y tokens usados. Al cerrar la traza se agrega una línea JSON a
+TRACE_PATH solo si se configuró (por defecto no se escribe archivo: las
+preguntas de los usuarios quedarían en disco y el archivo crece sin límite).
+
+Uso:
+    with start_trace("chat", provider="groq") as trace:
+        with span("llm.completion", kind="llm"):
+            ...
+            record(prompt_tokens=120, completion_tokens=40)
+    trace.breakdown()   # filas para mostrar bajo la respuesta
+
+Sin traza activa span(), record() y @traced no hacen nada. Los hilos no
+heredan la traza: las tareas enviadas a un pool se envuelven con bind().
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_PATH = os.getenv("TRACE_PATH", "")
+
+# Contadores que se acumulan en el span y se suman en los totales de la traza
+COUNTERS = ("rows", "bytes", "prompt_tokens", "completion_tokens")
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+_current_span = contextvars.ContextVar("span", default=None)
+_write_lock = threading.Lock()
+
+
+class Span:
+    def __init__(self, name, kind, parent_id=None, **attrs):
+        self.id = uuid.uuid4().hex[:12]
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attrs = dict(attrs)
+        self.start = time.perf_counter()
+        self.duration_ms = None
+        self.error = None
+
+    def record(self, **values):
+        """Suma los contadores (rows, bytes, tokens) y fija el resto de atributos"""
+        for key, value in values.items():
+            if key in COUNTERS:
+                self.attrs[key] = self.attrs.get(key, 0) + (value or 0)
+            else:
+                self.attrs[key] = value
+
+    def finish(self, error=None):
+        self.duration_ms = (time.perf_counter() - self.start) * 1000
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"[:300]
+
+    def to_dict(self, origin):
+        data = {
+            "span_id": self.id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_ms": round((self.start - origin) * 1000, 2),
+            "duration_ms": round(self.duration_ms, 2) if self.duration_ms is not None else None
+        }
+        data.update(self.attrs)
+        if self.error:
+            data["error"] = self.error
+        return data
+
+
+class Trace:
+    """Spans de un turno; el primero es la raíz (el turno completo)"""
+
+    def __init__(self, name, **attrs):
+        self.id = uuid.uuid4().hex
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.root = Span(name, "turn", **attrs)
+        self.spans = [self.root]
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def totals(self):
+        totals = {key: 0 for key in COUNTERS}
+        with self._lock:
+            for span in self.spans:
+                for key in COUNTERS:
+                    totals[key] += span.attrs.get(key, 0) or 0
+        return totals
+
+    def to_dict(self):
+        with self._lock:
+            spans = [s.to_dict(self.root.start) for s in self.spans]
+        return {
+            "trace_id": self.id,
+            "started_at": self.started_at,
+            "name": self.root.name,
+            "duration_ms": spans[0]["duration_ms"],
+            "totals": self.totals(),
+            "spans": spans
+        }
+
+    def breakdown(self):
+        """
+        Spans en orden de inicio con su profundidad, para mostrar como tabla:
+        [{"paso": "  get_top_n_global", "tipo": "db", "ms": 812.4, "filas": 9000, ...}]
+        """
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        depth = {}
+        rows = []
+        for span in spans:
+            depth[span.id] = depth.get(span.parent_id, -1) + 1
+            rows.append({
+                "paso": "  " * depth[span.id] + span.name,
+                "tipo": span.kind,
+                "ms": round(span.duration_ms or 0, 1),
+                "filas": span.attrs.get("rows"),
+                "bytes": span.attrs.get("bytes"),
+                "tokens": (span.attrs.get("prompt_tokens", 0) + span.attrs.get("completion_tokens", 0)) or None,
+                "error": span.error
+            })
+        return rows
+
+
+def current_trace():
+    return _current_trace.get()
+
+
+def _write(trace):
+    if not TRACE_PATH:
+        return
+    try:
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with _write_lock:
+            directory = os.path.dirname(TRACE_PATH)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(TRACE_PATH, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+    except Exception as e:
+        print(f"⚠️ No se pudo escribir la traza: {e}")
+
+
+def _reset(var, token):
+    # Un generador cerrado desde otro contexto no puede usar su token
+    try:
+        var.reset(token)
+    except ValueError:
+        var.set(None)
+
+
+@contextmanager
+def start_trace(name, **attrs):
+    """Abre la traza de un turno (None si el tracing está desactivado)"""
+    if not TRACING_ENABLED:
+        yield None
+        return
+    trace = Trace(name, **attrs)
+    trace_token = _current_trace.set(trace)
+    span_token = _current_span.set(trace.root)
+    error = None
+    try:
+        yield trace
+    except BaseException as e:
+        error = e if isinstance(e, Exception) else None
+        raise
+    finally:
+        trace.root.finish(error)
+        _reset(_current_span, span_token)
+        _reset(_current_trace, trace_token)
+        _write(trace)
+
+
+@contextmanager
+def span(name, kind="step", **attrs):
+    """Span hijo del span actual (None sin traza activa)"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+    parent = _current_span.get()
+    current = Span(name, kind, parent.id if parent else None, **attrs)
+    trace.add(current)
+    token = _current_span.set(current)
+    error = None
+    try:
+        yield current
+    except Exception as e:
+        error = e
+        raise
+    finally:
+        current.finish(error)
+        _reset(_current_span, token)
+
+
+def begin_span(name, kind="step", **attrs):
+    """
+    Span abierto manualmente (para callbacks con inicio y fin separados);
+    quien lo abre llama a .finish(). None sin traza activa.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    parent = _current_span.get()
+    current = Span(name, kind, parent.id if parent else None, **attrs)
+    trace.add(current)
+    return current
+
+
+def record(**values):
+    """Registra contadores/atributos en el span actual (no hace nada sin traza)"""
+    current = _current_span.get()
+    if current is not None and _current_trace.get() is not None:
+        current.record(**values)
+
+
+def payload_bytes(data):
+    """Tamaño aproximado en bytes de una respuesta JSON (solo se calcula con traza activa)"""
+    if _current_trace.get() is None:
+        return 0
+    try:
+        return len(json.dumps(data, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+def traced(kind, name=None):
+    """Decorador: ejecuta la función dentro de un span (nombre = el de la función)"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_trace.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, kind):
+                return func(*args, **kwargs)
+
+        return wrapper
+    return decorator
+
+
+def bind(func, name=None, kind="step"):
+    """
+    Envuelve func para ejecutarla en otro hilo con la traza actual
+    (y dentro de un span si se indica name).
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        if name is None:
+            return func(*args, **kwargs)
+        with span(name, kind):
+            return func(*args, **kwargs)
+
+    return functools.wraps(func)(lambda *args, **kwargs: context.run(run, *args, **kwargs))